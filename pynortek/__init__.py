@@ -1,5 +1,9 @@
 from .pynortek import *
 from .pynortek_binary import *
+from .pynortek_ascii2nc import *
+from .pynortek_netcdf import *
+from .pynortek_xarray import *
+from .pynortek_overview import *
 
 with open(version_file) as version_f:
    version = version_f.read().strip()
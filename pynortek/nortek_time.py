@@ -6,6 +6,8 @@ import datetime
 import argparse
 import logging
 import glob
+import concurrent.futures
+import threading
 
 # Serial baud rates
 baud = [300,600,1200,2400,4800,9600,'19200 (Vector)',38400,57600,115200,'460800 (TODL)',576000,921600]
@@ -26,9 +28,94 @@ except:
 
 
 
-def serial_ports():
+# Cache of the ports that could be opened, keyed by port name and
+# holding the (st_rdev, st_mtime) of the device node. Lock files are
+# checked on every scan, failed opens are not cached
+_serial_ports_cache = {}
+
+
+def serial_port_is_virtual(port):
+    """ Cheap sysfs check if a port is a virtual console/pty or a
+    serial8250 placeholder without a UART behind it (Linux only)
+
+    Return:
+       True if the port can be skipped, False otherwise
+    """
+    devicename = port.split('/')[-1]
+    sysdir = '/sys/class/tty/' + devicename
+    if(os.path.isdir(sysdir) == False): # No sysfs, cannot decide
+        return False
+    if(os.path.exists(sysdir + '/device') == False): # Virtual console, pty
+        return True
+    try: # serial8250 ports without a UART have type 0 (PORT_UNKNOWN)
+        with open(sysdir + '/type') as ftype:
+            if(int(ftype.read()) == 0):
+                return True
+    except Exception:
+        pass
+
+    return False
+
+
+def serial_port_locked(port):
+    """ Tests if a serial port has been locked by another program
+
+    Return:
+       True if the port is locked, False otherwise
+    """
+    try:
+        return test_serial_lock_file(port,brutal=True)
+    except Exception as e:
+        logger.debug('serial_port_locked(): Exception:' + str(e))
+        return True
+
+
+def serial_port_open(port, timeout=1.0):
+    """ Tests if a single serial port can be opened
+
+    Return:
+       True if the port could be opened, False otherwise
+    """
+    try:
+        logger.debug("serial_port_open(): Opening serial port " + str(port))
+        s = serial.Serial(port,timeout=timeout,write_timeout=timeout)
+        s.close()
+        return True
+    #except (OSError, serial.SerialException):
+    except Exception as e:
+        logger.debug('serial_port_open(): Exception:' + str(e))
+
+    return False
+
+
+def serial_port_probe(port, timeout=1.0, FLAG_UNIXOID=True):
+    """ Tests if a single serial port is usable
+
+    Return:
+       True if the port is not locked and could be opened, False otherwise
+    """
+    logger.debug("serial_port_probe(): Testing serial port " + str(port))
+    if(FLAG_UNIXOID and serial_port_locked(port)): # test if serial port has been locked
+        return False
+
+    return serial_port_open(port,timeout)
+
+
+def serial_ports(timeout=1.0, max_workers=None, use_cache=True):
     """ Lists serial port names
 
+        The ports are probed concurrently in a thread pool, ports not
+        answering within timeout seconds are regarded as not
+        available. Virtual consoles are skipped using sysfs. The lock
+        files are checked on every call, ports that could be opened are
+        cached as long as the mtime of the device node does not
+        change.
+
+        :param timeout: The time in seconds a port probe may take
+        :param max_workers: Number of threads used for probing, one per
+            port if None. With less threads the probes are queued and
+            every round of probes gets timeout seconds
+        :param use_cache: Do not open ports again that could be opened before
         :raises EnvironmentError:
             On unsupported or unknown platforms
         :returns:
@@ -43,32 +130,61 @@ def serial_ports():
     elif sys.platform.startswith('linux') or sys.platform.startswith('cygwin'):
         # this excludes your current terminal "/dev/tty"
         ports = glob.glob('/dev/tty[A-Za-z]*')
+        ports = [port for port in ports if serial_port_is_virtual(port) == False]
     elif sys.platform.startswith('darwin'):
         ports = glob.glob('/dev/tty.*')
     else:
         raise EnvironmentError('Unsupported platform')
 
-    result = []
+    ports = sorted(ports)
+    result = {}
+    ports_probe = {}
     for port in ports:
-        try:
-            logger.debug("serial_ports(): Testing serial port " + str(port))
-            if(FLAG_UNIXOID): # test if serial port has been locked
-                logger.debug('Testing serial port ' + str(port))
-                ret = test_serial_lock_file(port,brutal=True)
+        try: # Windows COM ports have no device node, they are always probed
+            st = os.stat(port)
+            key = (st.st_rdev, st.st_mtime)
+        except Exception:
+            key = None
+
+        # The lock files change without touching the device node, they are not cached
+        if(FLAG_UNIXOID and serial_port_locked(port)):
+            logger.debug('serial_ports(): ' + str(port) + ' is locked')
+            continue
+
+        if(use_cache and (key is not None) and (_serial_ports_cache.get(port) == key)):
+            result[port] = True
+            continue
+
+        ports_probe[port] = key
+
+    if(len(ports_probe) > 0):
+        logger.debug('serial_ports(): Probing {:d} ports'.format(len(ports_probe)))
+        nworkers = len(ports_probe) if max_workers is None else min(max_workers,len(ports_probe))
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=nworkers)
+        futures = {}
+        for port in ports_probe.keys():
+            futures[pool.submit(serial_port_open,port,timeout)] = port
+
+        # The probes queued behind the workers start timeout seconds later at most
+        nrounds = -(-len(ports_probe) // nworkers)
+        done, not_done = concurrent.futures.wait(futures.keys(), timeout=timeout * nrounds)
+        for future in done:
+            port = futures[future]
+            result[port] = future.result()
+            if(result[port] and (ports_probe[port] is not None)):
+                _serial_ports_cache[port] = ports_probe[port]
             else:
-                ret = False
-                
-            if(ret == False):
-                logger.debug("serial_ports(): Opening serial port " + str(port))
-                s = serial.Serial(port)
-                s.close()
-                result.append(port)
-        #except (OSError, serial.SerialException):
-        except Exception as e:
-            logger.debug('serial_ports(): Exception:' + str(e))
-            pass
+                _serial_ports_cache.pop(port, None)
 
-    return result
+        for future in not_done:
+            port = futures[future]
+            logger.debug('serial_ports(): Timeout while probing ' + str(port))
+            future.cancel()
+
+        # Do not wait for hanging ports
+        pool.shutdown(wait=False)
+
+    return [port for port in ports if result.get(port, False)]
 
 
 def test_serial_lock_file(port, brutal = False):
@@ -175,14 +291,31 @@ def bcdDigits(chars):
         
     return vals_all
 
-def check_nortek(data):
+def _sleep(dt, cancel=None):
+    """ Sleeps dt seconds, returns early with True if the cancel event
+    (threading.Event) has been set
+    """
+    if(cancel is None):
+        time.sleep(dt)
+        return False
+
+    return cancel.wait(dt)
+
+
+def _cancelled(cancel=None):
+    """ True if the cancel event (threading.Event) has been set
+    """
+    return (cancel is not None) and cancel.is_set()
+
+
+def check_nortek(data, progress=print):
     """ Checks in a binary data string if a Nortek like pattern is found
     """
     if(b'Confirm:' in data):
-        print('Found Nortek device in sampling mode, doing nothing')
+        progress('Found Nortek device in sampling mode, doing nothing')
         return [False,None]
     if(b'Command mode' in data):
-        print('Found Nortek device in command mode')
+        progress('Found Nortek device in command mode')
         # Lets get the device string
         ind1 = data.find(b'\n\r')
         ind2 = data.rfind(b'\x06\x06')
@@ -194,32 +327,60 @@ def check_nortek(data):
             
         return [True,dev_str]
     else:
-        print('Found no Nortek device, doing nothing')
+        progress('Found no Nortek device, doing nothing')
         return [False,None]
 
 
-def nortek_set_time(ser,time_set):
+def nortek_open(port, baud, cancel=None, progress=print):
+    """ Opens a serial port and brings a Nortek device into command mode
+    Return:
+       [ser,device string] if a Nortek device was found, [None,None] otherwise
+    """
+    ser = serial.Serial(port,baud)  # open serial port
+    progress('Opened port: ' + ser.name)         # check which port was really used
+    ser.reset_input_buffer()
+    ser.write(b'@@@@@@')     # send a break
+    _sleep(.200,cancel) # wait at least 100 ms
+    ser.write(b'K1W%!Q')     # write a break, second part
+    if _sleep(2.0,cancel):
+        ser.close()
+        return [None,None]
+
+    data = ser.read(ser.in_waiting)
+    logger.debug('data:' + str(data))
+    nortek = check_nortek(data,progress=progress)
+    if nortek[0]:
+        return [ser,nortek[1]]
+    else:
+        ser.close()
+        return [None,None]
+
+
+def nortek_set_time(ser,time_set,cancel=None,progress=print):
     """ Send a get time command and returns the current time
     """
-    print('Setting time')
+    progress('Setting time')
     ser.reset_input_buffer()
     t2 = time_set + datetime.timedelta(0,2)
     
     tdata = [t2.minute,t2.second,t2.day,t2.hour,t2.year-2000,t2.month]
     bdata = int2bcd(tdata)
     com = b'SC' + bdata
-    print(com)
+    progress(str(com))
     ser.write(com)
-    time.sleep(2.0)
+    if _sleep(2.0,cancel): # SC has been sent, the device might still acknowledge it
+        progress('Cancelled, time state unknown')
+        return
+
     data = ser.read(ser.in_waiting)
     ind1 = data.find(b'\x06\x06')
     if(ind1 > -1):
-        print('Time set ...')
+        progress('Time set ...')
     else:
-        print('Time not set ...')        
+        progress('Time not set ...')        
         
 
-def nortek_get_time(ser):
+def nortek_get_time(ser,cancel=None,progress=print):
     """ Send a get time command and returns the current time
     """
     ser.reset_input_buffer()
@@ -227,6 +388,8 @@ def nortek_get_time(ser):
     ser.write(b'RC')
     t1 = datetime.datetime.utcnow()
     while( (ser.in_waiting <= 8) and ((t2 - t1) < datetime.timedelta(0,2)) ):
+        if _sleep(0.01,cancel):
+            return None
         t2 = datetime.datetime.utcnow()    
 
     data = ser.read(ser.in_waiting)
@@ -243,24 +406,25 @@ def nortek_get_time(ser):
         second = bcdDigits([data[ind1-5:ind1-4]])[0]
         minute = bcdDigits([data[ind1-6:ind1-5]])[0]
         t = datetime.datetime(year,month,day,hour,minute,second)
-        print(t2,t,(t2-t).total_seconds())
+        progress(str(t2) + ' ' + str(t) + ' ' + str((t2-t).total_seconds()))
         return({'sys': t2, 'nortek':t,'sys_sent': t1})
 
 
     return None
 
 
-def nortek_set_time_fancy(ser,time_set,dt):
+def nortek_set_time_fancy(ser,time_set,dt,cancel=None,progress=print):
     """ Send a set time command 
         Args:
            dt: time difference in microseconds
     """
-    print('Setting time with time difference:' + str(dt))
+    progress('Setting time with time difference:' + str(dt))
     # Wait a long a we have a new second (almost)
     dt_micro = 1e6 - 5000 # 5 Milliseconds
     # Wait a long a we have a new second (almost)    
     while datetime.datetime.utcnow().microsecond < dt_micro:
-        pass
+        if _cancelled(cancel):
+            return
     
     ser.reset_input_buffer()
     t2 = time_set + datetime.timedelta(0,2) + datetime.timedelta(0,0,dt)
@@ -268,36 +432,42 @@ def nortek_set_time_fancy(ser,time_set,dt):
     tdata = [t2.minute,t2.second,t2.day,t2.hour,t2.year-2000,t2.month]
     bdata = int2bcd(tdata)
     com = b'SC' + bdata
-    print(com)
+    progress(str(com))
     ser.write(com)
-    time.sleep(2.0)
+    if _sleep(2.0,cancel): # SC has been sent, the device might still acknowledge it
+        progress('Cancelled, time state unknown')
+        return
+
     data = ser.read(ser.in_waiting)
     ind1 = data.find(b'\x06\x06')
     if(ind1 > -1):
-        print('Time set ...')
+        progress('Time set ...')
     else:
-        print('Time not set ...')        
+        progress('Time not set ...')        
 
 
-def nortek_get_time_fancy(ser):
+def nortek_get_time_fancy(ser,cancel=None,progress=print):
     """ Send a get time command and returns the current time, as the Nortek returns the time after its second is 
     """
     ser.reset_input_buffer()
     dt_micro = 1e6 - 5000 # 5 Milliseconds
     # Wait a long a we have a new second (almost)
     while datetime.datetime.utcnow().microsecond < dt_micro:
-        pass
+        if _cancelled(cancel):
+            return None
     t2 = datetime.datetime.utcnow()    
     ser.write(b'RC')
     t1 = datetime.datetime.utcnow()
     while( (ser.in_waiting <= 8) and ((t2 - t1) < datetime.timedelta(0,2)) ):
+        if _cancelled(cancel):
+            return None
         t2 = datetime.datetime.utcnow()    
 
     data = ser.read(ser.in_waiting)
     ind1 = data.rfind(b'\x06\x06')
-    print(ind1)
-    print('data_all',data)
-    print('data:',data[:ind1])    
+    logger.debug(str(ind1))
+    logger.debug('data_all:' + str(data))
+    logger.debug('data:' + str(data[:ind1]))
     if(ind1 > -1):
         #print(data[ind1-1:ind1])
         month  = bcdDigits([data[ind1-1:ind1]])[0]
@@ -307,7 +477,7 @@ def nortek_get_time_fancy(ser):
         second = bcdDigits([data[ind1-5:ind1-4]])[0]
         minute = bcdDigits([data[ind1-6:ind1-5]])[0]
         t = datetime.datetime(year,month,day,hour,minute,second)
-        print(t2,t,(t2-t).total_seconds())
+        logger.debug(str(t2) + ' ' + str(t) + ' ' + str((t2-t).total_seconds()))
         return({'sys': t2, 'nortek':t,'sys_sent': t1})
 
 
@@ -333,13 +503,41 @@ def todl_parse_time(data):
     return None
 
 
-def todl_set_time(ser):
+def todl_open(port, baud, cancel=None, progress=print):
+    """ Opens a serial port and stops a TODL
+    Return:
+       [ser,time of the TODL] if a TODL was found, [None,None] otherwise
+    """
+    ser = serial.Serial(port,baud)  # open serial port
+    progress('Opened port: ' + ser.name)         # check which port was really used
+    ser.reset_input_buffer()        
+    ser.write(b'stop\n')     # write a stop
+    _sleep(.5,cancel)
+    ser.write(b'stop\n')     # write a stop
+    _sleep(.5,cancel)
+    ser.write(b'time\n')     # write a time command
+    if _sleep(0.1,cancel):
+        ser.close()
+        return [None,None]
+
+    data = ser.read(ser.in_waiting)
+    t_todl = todl_parse_time(data)
+    if(t_todl is not None):
+        return [ser,t_todl]
+    else:
+        ser.close()
+        return [None,None]
+
+
+def todl_set_time(ser,cancel=None,progress=print):
     """ Sets the time of a TODL
     """
     dtoff = datetime.timedelta(0,1)
     t = datetime.datetime.utcnow()
     n = 1
     while True:
+        if _cancelled(cancel):
+            return
         t = datetime.datetime.utcnow()
         sec = t.second
         if(n == 0):
@@ -347,26 +545,29 @@ def todl_set_time(ser):
         if(t.microsecond > 970000): # A bit of time for prorgamming needed roughly 0.03 seconds
             n -= 1        
             if True:
-                print('Setting time!')
+                progress('Setting time!')
                 tset = t + dtoff # strftime does not care about (rounds) 
                                  # microseconds, so we have to add the
                                  # dtoff
                 ts = tset.strftime('%Y-%m-%d %H:%M:%S') 
-                print('Setting time to:' + ts)
+                progress('Setting time to:' + ts)
                 tcom = 'set time ' + ts
                 tcom = tcom.encode('utf-8') + b'\n'
                 ser.write(tcom)     # write a time command
 
 
-    time.sleep(0.5)
+    _sleep(0.5,cancel)
     data = ser.read(ser.in_waiting)
-    print(data)            
+    progress(str(data))
 
 
-def todl_get_time(ser):
+def todl_get_time(ser,n_compare=3,cancel=None,progress=print):
+    """ Compares the TODL time n_compare times with the computer time
+    Return:
+       A list of [t1,t3,t_todl] entries, possibly shorter than n_compare if cancelled
+    """
     t = datetime.datetime.utcnow()
     second_done = t.second
-    n_compare = 3
     dt_sleep = 0.01
     n_test = int(1.0/dt_sleep)
     dt_all = []
@@ -376,11 +577,15 @@ def todl_get_time(ser):
             break
 
         sec = t.second
-        time.sleep(.5)
+        if _sleep(.5,cancel):
+            break
         n_compare -= 1
         ttodl_all = []
+        t_todl = None
         # Ask for time many times and when a new second is reached break
         for i in range(0,n_test):
+            if _cancelled(cancel):
+                return tall
             if True:
                 t = datetime.datetime.utcnow()
                 ts = t.strftime('%Y-%m-%d %H:%M:%S %Z')
@@ -408,11 +613,15 @@ def todl_get_time(ser):
                         #print(ttodl_all,dttodl)
                         break
 
+        if(t_todl is None):
+            progress('No time received from TODL')
+            continue
+
         # This is not entirely correct as we should take the dt_sleep into account
         dt = t3 - t_todl
         dt_all.append(dt.total_seconds())
         tstr = 'Time TODL:' + str(t_todl) + ' time computer: ' + str(t3) + ' difference [s]: ' + str(dt.total_seconds())
-        print(tstr)
+        progress(tstr)
         tall.append([t1,t3,t_todl])
 
     return tall
@@ -491,6 +700,55 @@ def main():
     ser.close()             # close port
 
 
+# Workers to do the serial communication outside of the Qt main thread
+class serialWorkerSignals(QtCore.QObject):
+    """ The signals of a serialWorker, QRunnable cannot have signals itself
+
+    """
+    progress = QtCore.pyqtSignal(str)
+    result   = QtCore.pyqtSignal(object)
+    error    = QtCore.pyqtSignal(str)
+    finished = QtCore.pyqtSignal()
+
+
+class serialWorker(QtCore.QRunnable):
+    """ Calls function(*args, cancel=..., progress=..., **kwargs) in a
+    thread of a QThreadPool. Progress messages and the return value are
+    sent back with signals, the operation can be stopped with cancel()
+
+    """
+    def __init__(self, port, function, *args, **kwargs):
+        QtCore.QRunnable.__init__(self)
+        self.port = port
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = serialWorkerSignals()
+        self._cancel = threading.Event()
+        self.setAutoDelete(False)
+
+    def cancel(self):
+        self._cancel.set()
+
+    def run(self):
+        funcname = self.__class__.__name__ + '.run()'
+        try:
+            ret = self.function(*self.args, cancel=self._cancel, progress=self.signals.progress.emit, **self.kwargs)
+            self.signals.result.emit(ret)
+        except Exception as e:
+            logger.debug(funcname + ' Exception:' + str(e))
+            self.signals.error.emit(str(e))
+        finally:
+            self.signals.finished.emit()
+
+
+def serial_ports_worker(use_cache=True, cancel=None, progress=print):
+    """ serial_ports() with the serialWorker interface
+    """
+    progress('Searching for serial ports')
+    return serial_ports(use_cache=use_cache)
+
+
 # A qt gui for conveniently setting Nortek time
 class guiMain(QtWidgets.QMainWindow):
     """ The main gui widget
@@ -501,6 +759,10 @@ class guiMain(QtWidgets.QMainWindow):
         #self.__version__ = pymqdatastream.__version__
         # Add a logger object
         QtWidgets.QWidget.__init__(self)
+        # The open devices and running workers, keyed by port
+        self.devices = {}
+        self.workers = {}
+        self.threadpool = QtCore.QThreadPool()
         # Create the menu
         self.file_menu = QtWidgets.QMenu('&File',self)
         self.device_widgets = []
@@ -524,10 +786,14 @@ class guiMain(QtWidgets.QMainWindow):
 
         self.combo_baud.setCurrentIndex(5)
         self.close_bu = QtWidgets.QPushButton('Close')
-        #self.close_bu.clicked.connect(w.close)
+        self.close_bu.clicked.connect(self.serial_close_bu)
         self.open_bu = QtWidgets.QPushButton('Open')
         self.get_time_bu = QtWidgets.QPushButton('Get time')
         self.set_time_bu = QtWidgets.QPushButton('Set time')
+        self.ports_bu = QtWidgets.QPushButton('Test ports')
+        self.ports_bu.clicked.connect(lambda: self.test_ports(use_cache=False))
+        self.cancel_bu = QtWidgets.QPushButton('Cancel')
+        self.cancel_bu.clicked.connect(self.cancel_bu_clicked)
         self.text = QtWidgets.QPlainTextEdit()
         self.text.setReadOnly(True)
         self.text.textChanged.connect(self.text_changed)
@@ -542,6 +808,9 @@ class guiMain(QtWidgets.QMainWindow):
         self.layout.addWidget(self.combo_serial,0,0+1)
         self.layout.addWidget(self.combo_baud,0,1+1)
         self.layout.addWidget(self.open_bu,0,2+1)
+        self.layout.addWidget(self.ports_bu,1,0+1)
+        self.layout.addWidget(self.close_bu,1,1+1)
+        self.layout.addWidget(self.cancel_bu,2,1+1)
         self.layout.addWidget(self.get_time_bu,1,2+1)
         self.layout.addWidget(self.set_time_bu,2,2+1)
         self.layout.addWidget(self.text,3,0,1,3+1)
@@ -556,37 +825,34 @@ class guiMain(QtWidgets.QMainWindow):
 
     def device_changed(self):
         dev = self.combo_device.currentText()
-        print(dev)
+        logger.debug(dev)
         time_str = 'Changing device to ' + dev
         time_str += '\n----------------------------------------'
-        self.text.appendPlainText(time_str)
-        if self.log_check.isChecked():
-            self.logfile.write(time_str + '\n')
-            self.logfile.flush()        
+        self.print(time_str)
         if(dev == 'Nortek'):
-            self.open_bu.clicked.connect(self.nortek_serial_open_bu)            
-            self.get_time_bu.clicked.connect(self.nortek_get_time)            
-            self.set_time_bu.clicked.connect(self.nortek_set_time)
             try:            
                 self.open_bu.clicked.disconnect(self.todl_serial_open_bu)
                 self.get_time_bu.clicked.disconnect(self.todl_get_time)
                 self.set_time_bu.clicked.disconnect(self.todl_set_time)
             except:
                 pass            
+            self.open_bu.clicked.connect(self.nortek_serial_open_bu)            
+            self.get_time_bu.clicked.connect(self.nortek_get_time)            
+            self.set_time_bu.clicked.connect(self.nortek_set_time)
         elif(dev == 'TODL'):
-            self.open_bu.clicked.connect(self.todl_serial_open_bu)
-            self.get_time_bu.clicked.connect(self.todl_get_time)
-            self.set_time_bu.clicked.connect(self.todl_set_time)
             try:
                 self.open_bu.clicked.disconnect(self.nortek_serial_open_bu)            
                 self.get_time_bu.clicked.disconnect(self.nortek_get_time)            
                 self.set_time_bu.clicked.disconnect(self.nortek_set_time)
             except:
                 pass
+            self.open_bu.clicked.connect(self.todl_serial_open_bu)
+            self.get_time_bu.clicked.connect(self.todl_get_time)
+            self.set_time_bu.clicked.connect(self.todl_set_time)
                 
 
     def text_changed(self):
-        print('Changed')
+        pass
 
     def log_file(self):
         fname = self.input_name.text()        
@@ -607,37 +873,94 @@ class guiMain(QtWidgets.QMainWindow):
             print(fname)
             self.input_name.setText(fname[0])
 
-            
-    def nortek_get_time(self):
+    def start_worker(self, port, function, *args, result=None, **kwargs):
+        """ Starts function in a worker thread, only one worker per port
+        is allowed, workers of different ports run in parallel
+
+        Args:
+           port: The port the worker is using
+           function: The function to be called
+           result: Function called in the main thread with the return value of function
+        Return:
+           The worker or None if the port is busy
+        """
+        if(port in self.workers.keys()):
+            self.print(str(port) + ' is busy, cancel the running operation first')
+            return None
+
+        worker = serialWorker(port, function, *args, **kwargs)
+        worker.signals.progress.connect(lambda dstr, port=port: self.print(str(port) + ': ' + dstr))
+        worker.signals.error.connect(lambda dstr, port=port: self.print(str(port) + ': Error: ' + dstr))
+        if(result is not None):
+            worker.signals.result.connect(result)
+        worker.signals.finished.connect(lambda port=port: self.workers.pop(port,None))
+        self.workers[port] = worker
+        self.threadpool.start(worker)
+        return worker
+
+    def get_device(self, devtype):
+        """ Returns the open device of type devtype for the port selected in combo_serial
+        """
+        port = self.combo_serial.currentText()
         try:
-            self.ser
+            device = self.devices[port]
         except:
-            print('No serial port open, doing nothing')
-            return
-        
-        t = nortek_get_time_fancy(self.ser)
-        print(t)
-
-        if(t is not None):
-            dt = (t['sys'] - t['nortek'])
-            dts = (t['sys_sent'] - t['nortek'])
-            time_str = 'PC: ' + str(t['sys']) + ' Nortek: '  + str(t['nortek'])
-            time_str += ', difference PC-Nortek ' + str( dt.total_seconds()) + ' s'
-            #time_str += ', difference PC-Nortek ' + str( dts.total_seconds()) + ' s'
-            self.text.appendPlainText(time_str)
-            if self.log_check.isChecked():
-                self.logfile.write(time_str + '\n')
-                self.logfile.flush()
-
-            self.dt = dt
-        else:
-            self.dt = None
+            self.print('No serial port open on ' + str(port) + ', doing nothing')
+            return None
 
-    def nortek_set_time(self):
+        if(device['device'] != devtype):
+            self.print(str(port) + ' is not a ' + devtype + ', doing nothing')
+            return None
+
+        return device
+
+    def cancel_bu_clicked(self):
+        port = self.combo_serial.currentText()
         try:
-            self.ser
+            self.workers[port].cancel()
+            self.print('Cancelling operation on ' + str(port))
+        except:
+            self.print('No running operation on ' + str(port))
+
+    def serial_close_bu(self):
+        port = self.combo_serial.currentText()
+        self.serial_close(port)
+
+    def serial_close(self, port):
+        if(port in self.workers.keys()):
+            self.print(str(port) + ' is busy, cancel the running operation first')
+            return
+
+        try: # Close a serial device if its existing
+            device = self.devices.pop(port)
+            dstr = 'Closing serial device ' + str(port)
+            self.print(dstr)
+            device['ser'].close()
         except:
-            print('No serial port open, doing nothing')
+            pass
+            
+    def nortek_get_time(self):
+        device = self.get_device('Nortek')
+        if(device is None):
+            return
+
+        def result(t, device=device):
+            if(t is not None):
+                dt = (t['sys'] - t['nortek'])
+                dts = (t['sys_sent'] - t['nortek'])
+                time_str = 'PC: ' + str(t['sys']) + ' Nortek: '  + str(t['nortek'])
+                time_str += ', difference PC-Nortek ' + str( dt.total_seconds()) + ' s'
+                #time_str += ', difference PC-Nortek ' + str( dts.total_seconds()) + ' s'
+                self.print(time_str)
+                device['dt'] = dt
+            else:
+                device['dt'] = None
+
+        self.start_worker(device['port'], nortek_get_time_fancy, device['ser'], result=result)
+
+    def nortek_set_time(self):
+        device = self.get_device('Nortek')
+        if(device is None):
             return
         
         tset = datetime.datetime.utcnow()
@@ -646,125 +969,103 @@ class guiMain(QtWidgets.QMainWindow):
         self.print(time_str)
 
 
-        if self.dt == None:
+        if device['dt'] == None:
             dt = 0
         else:
-            dt = self.dt.total_seconds()*1e6
+            dt = device['dt'].total_seconds()*1e6
             if(abs(dt) > (1.0*1e6)):
                 dt = 0
 
             
-        nortek_set_time_fancy(self.ser,tset,dt)
+        self.start_worker(device['port'], nortek_set_time_fancy, device['ser'], tset, dt)
         #nortek_set_time_fancy(self.ser,tset,0)
             
 
     def nortek_serial_open_bu(self):
         PORT = self.combo_serial.currentText()
         BAUD = int(self.combo_baud.currentText().split()[0])
-        try: # Close a serial device if its existing
-            dstr = 'Closing already open serial device'
-            self.text.appendPlainText(dstr)
-            if self.log_check.isChecked():
-                self.logfile.write(dstr + '\n')
-                self.logfile.flush()                                        
-            self.ser.close()
-        except:
-            pass
-        
-        ser = serial.Serial(PORT,BAUD)  # open serial port
-        self.ser = ser
-        print('Opened port: ' + ser.name)         # check which port was really used
-        ser.reset_input_buffer()
-        ser.write(b'@@@@@@')     # send a break
-        time.sleep(.200) # wait at least 100 ms
-        ser.write(b'K1W%!Q')     # write a break, second part
-        time.sleep(2.0)
-        data = ser.read(ser.in_waiting)
-        print('data',data)
-        nortek = check_nortek(data)
-        if nortek[0]:
-            dstr = 'Found a Nortek device: ' + nortek[1]
-            self.text.appendPlainText(dstr)
-            if self.log_check.isChecked():
-                self.logfile.write(dstr + '\n')
-                self.logfile.flush()                
-        else:
-            dstr = 'Did not find a Nortek device in command mode ...'
-            self.text.appendPlainText(dstr)
-            if self.log_check.isChecked():
-                self.logfile.write(dstr + '\n')
-                self.logfile.flush()                
-            ser.close()
+        self.serial_close(PORT)
+        if(PORT in self.workers.keys()):
+            return
+
+        def result(ret, port=PORT):
+            ser, dev_str = ret
+            if ser is not None:
+                self.devices[port] = {'ser':ser,'port':port,'device':'Nortek','dt':None}
+                dstr = 'Found a Nortek device: ' + dev_str
+            else:
+                dstr = 'Did not find a Nortek device in command mode ...'
+
+            self.print(dstr)
+
+        self.start_worker(PORT, nortek_open, PORT, BAUD, result=result)
 
 
     def todl_serial_open_bu(self):
         PORT = self.combo_serial.currentText()
         BAUD = int(self.combo_baud.currentText().split()[0])
-        try: # Close a serial device if its existing
-            dstr = 'Closing already open serial device'
-            self.print(dstr)            
-            self.ser.close()
-        except:
-            pass
-        
-        ser = serial.Serial(PORT,BAUD)  # open serial port
-        self.ser = ser
-        print('Opened port: ' + ser.name)         # check which port was really used
-        ser.reset_input_buffer()        
-        ser.write(b'stop\n')     # write a stop
-        time.sleep(.5)
-        ser.write(b'stop\n')     # write a stop
-        time.sleep(.5)
-        ser.write(b'time\n')     # write a time command
-        time.sleep(0.1)
-        data = ser.read(ser.in_waiting)
-        t_todl = todl_parse_time(data)
-        if(t_todl is not None):
-            dstr = 'Found a TODL'
-        else:
-            dstr = 'Did not find a TODL, exiting ...'
+        self.serial_close(PORT)
+        if(PORT in self.workers.keys()):
+            return
 
-        self.print(dstr)
+        def result(ret, port=PORT):
+            ser, t_todl = ret
+            if(ser is not None):
+                self.devices[port] = {'ser':ser,'port':port,'device':'TODL','dt':None}
+                dstr = 'Found a TODL'
+            else:
+                dstr = 'Did not find a TODL, exiting ...'
+
+            self.print(dstr)
+
+        self.start_worker(PORT, todl_open, PORT, BAUD, result=result)
 
 
     def todl_get_time(self):
-        try:
-            self.ser
-        except:
-            print('No serial port open, doing nothing')
+        device = self.get_device('TODL')
+        if(device is None):
             return
-            
-        
-        t = todl_get_time(self.ser)
-        print(t)
-        for i in range(len(t)):
-            t_todl = t[i][2]
-            t_system = t[i][1]
-            dt = t_todl - t_system
-            print(t_system,t_todl)
-
-            dstr = 'Time TODL:' + str(t_todl) + ' time computer: ' + str(t_system) + ' difference [s]: ' + str(dt.total_seconds())
-            self.print(dstr)
+
+        def result(t, device=device):
+            if(len(t) > 0):
+                # The single comparisons are streamed as progress messages, print the mean difference
+                dt = [(t_system - t_todl).total_seconds() for t1, t_system, t_todl in t]
+                dt_mean = sum(dt) / len(dt)
+                time_str = 'PC: ' + str(t[-1][1]) + ' TODL: ' + str(t[-1][2])
+                time_str += ', difference PC-TODL ' + str(dt_mean) + ' s (mean of ' + str(len(dt)) + ')'
+                self.print(time_str)
+                device['dt'] = datetime.timedelta(seconds=dt_mean)
+            else:
+                device['dt'] = None
+
+        self.start_worker(device['port'], todl_get_time, device['ser'], result=result)
 
 
     def todl_set_time(self):
-        try:
-            self.ser
-        except:
-            print('No serial port open, doing nothing')
+        device = self.get_device('TODL')
+        if(device is None):
             return
             
         self.print('Setting TODL time')
-        todl_set_time(self.ser)        
+        self.start_worker(device['port'], todl_set_time, device['ser'])
         
-    def test_ports(self):
+    def test_ports(self, use_cache=True):
         """ Searching for serial ports
+
+        Args:
+           use_cache: Use the ports found by earlier searches, False opens all ports again
         """
-        ports = serial_ports()
-        ports_good = ports
-        self.combo_serial.clear()
-        for port in ports_good:
-            self.combo_serial.addItem(str(port))        
+        def result(ports):
+            ports_good = ports
+            port_current = self.combo_serial.currentText()
+            self.combo_serial.clear()
+            for port in ports_good:
+                self.combo_serial.addItem(str(port))        
+
+            self.combo_serial.setCurrentText(port_current)
+
+        # Ports are not a single serial port, use an own key
+        self.start_worker('ports', serial_ports_worker, use_cache, result=result)
 
 
     def _quit(self):
@@ -772,6 +1073,22 @@ class guiMain(QtWidgets.QMainWindow):
         logger.debug(funcname)
         self.close()
 
+    def closeEvent(self, event):
+        """ Cancels all running workers and closes the serial devices
+        """
+        for worker in list(self.workers.values()):
+            worker.cancel()
+
+        self.threadpool.waitForDone(3000)
+        for device in self.devices.values():
+            try:
+                device['ser'].close()
+            except:
+                pass
+
+        self.devices = {}
+        event.accept()
+
     def print(self,dstr):
         self.text.appendPlainText(dstr)
         if self.log_check.isChecked():
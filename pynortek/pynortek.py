@@ -6,7 +6,14 @@ import pytz
 import datetime
 import os
 import re
+import collections.abc
+import concurrent.futures
+import functools
+import threading
+import warnings
+import netCDF4
 from numpy import cos,sin
+from .pynortek_ascii import loadtxt_ascii, count_columns, cache_read, cache_header, cache_rawdata, cache_write
 
 
 whd_format = """1   Month                            (1-12)
@@ -42,44 +49,546 @@ version_file = pkg_resources.resource_filename('pynortek','VERSION')
 logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
 logger = logging.getLogger('pynortek')
 
-def xyz2enu(u,v,w,head,pitch,roll,inverse=False):
+def xyz2enu(u,v,w,head,pitch,roll,inverse=False,chunksize=65536):
     """
     Transforms velocities in XYZ coordinates to ENU, or vice versa if
     inverse=True. Transformation is done according to the Nortek
     convention
 
+    Args:
+        u,v,w: Velocities of shape (N,) or (N,ncells)
+        head,pitch,roll: Heading, pitch and roll of length N in degrees
+        inverse: ENU to XYZ
+        chunksize: The number of samples transformed at once
+    Return:
+        [ut,vt,wt]
     """
-    # convert to radians
-    hh = np.pi*(head-90)/180
-    pp = np.pi*pitch/180
-    rr = np.pi*roll/180
-
-    ut = np.zeros(np.shape(u))
-    vt = np.zeros(np.shape(u))
-    wt = np.zeros(np.shape(u))    
-
-    for i in range(len(head)):
-        # generate heading matrix
-        H = np.matrix([[cos(hh[i]), sin(hh[i]), 0],[-sin(hh[i]), cos(hh[i]), 0],[0, 0, 1]])
-        # generate combined pitch and roll matrix
-        P = [[cos(pp[i]), -sin(pp[i])*sin(rr[i]), -cos(rr[i])*sin(pp[i])],
-             [0,           cos(rr[i]),                       -sin(rr[i])],
-             [sin(pp[i]),  sin(rr[i])*cos(pp[i]),  cos(pp[i])*cos(rr[i])]]
-
-        R = H*P
-        #print(R)
-        if(inverse):
-            R = np.inv(R)
+    u = np.asarray(u)
+    v = np.asarray(v)
+    w = np.asarray(w)
+    dtype = float_dtype(np.result_type(u,v,w))
+    ut = np.zeros(np.shape(u),dtype=dtype)
+    vt = np.zeros(np.shape(u),dtype=dtype)
+    wt = np.zeros(np.shape(u),dtype=dtype)
+
+    for i0 in range(0,len(head),chunksize):
+        i1 = min(i0 + chunksize,len(head))
+        # heading times combined pitch and roll matrix
+        R = heading_pitch_roll_matrices(head[i0:i1],pitch[i0:i1],roll[i0:i1])
+        if(inverse): # The inverse of a rotation matrix is its transpose
+            R = np.swapaxes(R,-1,-2)
 
         # do transformation
-        ut[i]  = R[0,0]*u[i] + R[0,1]*v[i] + R[0,2]*w[i];
-        vt[i]  = R[1,0]*u[i] + R[1,1]*v[i] + R[1,2]*w[i];
-        wt[i]  = R[2,0]*u[i] + R[2,1]*v[i] + R[2,2]*w[i];
+        rotate([u[i0:i1],v[i0:i1],w[i0:i1]],R.astype(dtype),[ut[i0:i1],vt[i0:i1],wt[i0:i1]])
 
-    
     return [ut,vt,wt]
 
+def datetime64_from_columns(month,day,year,hour,minute,second):
+    """ Creates a datetime64[ns] array out of the date columns of a
+    Nortek ASCII file, the fraction of the seconds is truncated to
+    microseconds
+
+    Return:
+        datetime64[ns] array
+    """
+    year = np.asarray(year).astype(np.int64)
+    month = np.asarray(month).astype(np.int64)
+    millis = np.asarray(second) % 1
+    second_int = (np.asarray(second) - millis).astype(np.int64)
+    micro = (millis * 1000 * 1000).astype(np.int64)
+    t64 = ((year - 1970) * 12 + month - 1).astype('datetime64[M]').astype('datetime64[ns]')
+    t64 += (np.asarray(day).astype(np.int64) - 1).astype('timedelta64[D]')
+    t64 += np.asarray(hour).astype(np.int64).astype('timedelta64[h]')
+    t64 += np.asarray(minute).astype(np.int64).astype('timedelta64[m]')
+    t64 += second_int.astype('timedelta64[s]')
+    t64 += micro.astype('timedelta64[us]')
+    return t64
+
+
+def utc_offset(t64,timezone):
+    """ Returns the UTC offset of timezone for the local times in t64 as
+    timedelta64[ns] array, calculated once for every hour found in t64
+    """
+    if(len(t64) == 0):
+        return np.zeros(0,dtype='timedelta64[ns]')
+
+    hours, ind = np.unique(t64.astype('datetime64[h]'),return_inverse=True)
+    offsets = np.zeros(len(hours),dtype='timedelta64[ns]')
+    for i,h in enumerate(hours.astype(datetime.datetime)):
+        if(hasattr(timezone,'localize')): # pytz, replace() would use the local mean time of the zone
+            offset = timezone.localize(h).utcoffset()
+        else:
+            offset = h.replace(tzinfo=timezone).utcoffset()
+        offsets[i] = np.timedelta64(int(offset.total_seconds() * 1e6),'us')
+
+    return offsets[np.reshape(ind,-1)]
+
+
+def datetime_from_datetime64(t64,timezone):
+    """ Converts a datetime64 array (UTC) into a list of datetime objects in timezone
+    """
+    # The local time and timezone info, calculated once for every hour
+    hours, ind = np.unique(t64.astype('datetime64[h]'),return_inverse=True)
+    ind = np.reshape(ind,-1)
+    offsets = np.zeros(len(hours),dtype='timedelta64[us]')
+    tzinfos = []
+    for i,h in enumerate(hours.astype(datetime.datetime)):
+        hlocal = h.replace(tzinfo=pytz.UTC).astimezone(timezone)
+        offsets[i] = np.timedelta64(int(hlocal.utcoffset().total_seconds() * 1e6),'us')
+        tzinfos.append(hlocal.tzinfo)
+
+    t = (t64.astype('datetime64[us]') + offsets[ind]).astype(datetime.datetime).tolist()
+    if(len(tzinfos) == 1 or all([tzinfo is tzinfos[0] for tzinfo in tzinfos])):
+        t = [ttmp.replace(tzinfo=tzinfos[0]) for ttmp in t]
+    else:
+        t = [ttmp.replace(tzinfo=tzinfos[i]) for ttmp,i in zip(t,ind)]
+
+    return t
+
+
+def wave_burst_index(burst_whd,burst):
+    """ Returns the index of the burst in the wave header data (.whd)
+    of every burst counter of the wave data (.wad), the first one if a
+    burst counter appears several times in the header data
+    """
+    order = np.argsort(burst_whd,kind='stable')
+    burst_sorted = burst_whd[order]
+    ind = np.searchsorted(burst_sorted,burst)
+    ind = np.minimum(ind,len(burst_sorted) - 1)
+    if((len(burst_sorted) == 0) or np.any(burst_sorted[ind] != burst)):
+        raise ValueError('Burst counter of the wave data not found in the wave header data')
+
+    return order[ind]
+
+
+def groups_from_labels(labels):
+    """ Groups the samples with the same label (e.g. the burst counter)
+
+    Return:
+        [labels_unique,starts,counts,order], order sorts the samples by
+        their label (stable) and is None if they are already sorted,
+        starts and counts are the first index and the number of samples of
+        each group in the sorted samples
+    """
+    labels = np.asarray(labels)
+    if(np.all(labels[1:] >= labels[:-1])):
+        order = None
+        labels_sorted = labels
+    else:
+        order = np.argsort(labels,kind='stable')
+        labels_sorted = labels[order]
+
+    labels_unique, starts, counts = np.unique(labels_sorted,return_index=True,return_counts=True)
+    return [labels_unique,starts,counts,order]
+
+
+def group_statistics(variables,starts,counts,order=None,stats=('mean',),masks=None,threshold=0,mask_variables=None,chunksize=2**16):
+    """ Calculates statistics of groups of consecutive samples (e.g. of
+    a burst) with np.add.reduceat, a chunk of groups at a time. The
+    variables are not changed.
+
+    Args:
+        variables: Dictionary of the variables, arrays of shape (N,) or (N,ncells)
+        starts, counts: The first index and the number of samples of the groups in the (sorted) samples, see groups_from_labels
+        order: Index sorting the samples into the groups, None if sorted (then views of the data are used)
+        stats: The statistics, 'mean', 'std', 'count' (valid samples), 'median'
+        masks: List of arrays, samples where all arrays are below or equal threshold are not used, None for no masking
+        mask_variables: The variables masked, all if None, only variables of the shape of the masks are masked
+        chunksize: The approximate number of samples processed at once
+    Return:
+        Dictionary with the statistics of the variables (key, key_std, key_count, key_median)
+        and the index of the first and last sample (first, last) of the groups
+    """
+    starts = np.asarray(starts,dtype=np.int64)
+    counts = np.asarray(counts,dtype=np.int64)
+    ends = starts + counts
+    ngroups = len(starts)
+    if(mask_variables is None):
+        mask_variables = list(variables.keys())
+
+    if(order is None):
+        results = {'first':starts,'last':ends - 1}
+    else:
+        results = {'first':order[starts],'last':order[ends - 1]}
+
+    chunks = {}
+    g0 = 0
+    while g0 < ngroups:
+        g1 = max(g0 + 1,int(np.searchsorted(ends,starts[g0] + chunksize,side='right')))
+        if(order is None): # Views of the sorted samples
+            ind = slice(starts[g0],ends[g1-1])
+        else:
+            ind = order[starts[g0]:ends[g1-1]]
+        lstarts = starts[g0:g1] - starts[g0]
+        lcounts = counts[g0:g1]
+        # The mask is calculated once per chunk for all variables
+        bad = None
+        if masks is not None:
+            bad = np.all([np.asarray(m[ind]) <= threshold for m in masks],axis=0)
+
+        for k in variables.keys():
+            data = variables[k]
+            dtype = float_dtype(data.dtype)
+            x = np.asarray(data[ind]).astype(dtype,copy=False)
+            valid = None
+            if((bad is not None) and (k in mask_variables) and (np.shape(bad) == np.shape(x))):
+                valid = ~bad
+                x = np.where(valid,x,0)
+
+            stats_chunk = group_statistics_chunk(x,valid,lstarts,lcounts,stats)
+            for s in stats_chunk.keys():
+                key = k if s == 'mean' else k + '_' + s
+                chunks.setdefault(key,[]).append(stats_chunk[s])
+
+        g0 = g1
+
+    for k in chunks.keys():
+        results[k] = np.concatenate(chunks[k])
+
+    return results
+
+
+def group_statistics_chunk(x,valid,starts,counts,stats):
+    """ Calculates the statistics of the groups in x, see group_statistics
+
+    Args:
+        x: The data, invalid samples set to 0
+        valid: Boolean array of the valid samples or None if all are valid
+    """
+    result = {}
+    shape_counts = (len(counts),) + (1,) * (np.ndim(x) - 1)
+    if valid is None:
+        n = np.reshape(counts,shape_counts)
+    else:
+        n = np.add.reduceat(valid,starts,axis=0,dtype=np.int64)
+
+    with np.errstate(invalid='ignore',divide='ignore'):
+        mean = np.add.reduceat(x,starts,axis=0,dtype=x.dtype) / n
+        mean = mean.astype(x.dtype,copy=False)
+        if('mean' in stats):
+            result['mean'] = mean
+        if('std' in stats):
+            dev = x - np.repeat(mean,counts,axis=0)
+            if valid is not None:
+                dev[~valid] = 0
+            std = np.sqrt(np.add.reduceat(dev * dev,starts,axis=0,dtype=x.dtype) / n)
+            result['std'] = std.astype(x.dtype,copy=False)
+
+    if('count' in stats):
+        result['count'] = np.broadcast_to(n,np.shape(mean)).copy()
+    if('median' in stats):
+        median = np.zeros(np.shape(mean),dtype=x.dtype)
+        xnan = x if valid is None else np.where(valid,x,np.nan)
+        with warnings.catch_warnings(): # All NaN groups
+            warnings.simplefilter('ignore',RuntimeWarning)
+            for i in range(len(starts)):
+                median[i] = np.nanmedian(xnan[starts[i]:starts[i]+counts[i]],axis=0)
+        result['median'] = median
+
+    return result
+
+
+def average_samples(variables,navg,time=None,stats=('mean',)):
+    """ Averages navg consecutive samples of the variables, the last
+    window may contain less samples
+
+    Args:
+        variables: Dictionary of arrays of shape (N,) or (N,ncells)
+        navg: The number of samples averaged
+        time: The key of the time variable (datetime64 or float), averaged as midpoint of the first and the last sample of a window
+        stats: See group_statistics
+    Return:
+        Dictionary of the averaged variables and the number of samples averaged (nsamples)
+    """
+    if(len(variables) == 0):
+        return {}
+    nsamples = len(variables[list(variables.keys())[0]])
+    starts = np.arange(0,nsamples,navg)
+    counts = np.minimum(starts + navg,nsamples) - starts
+    variables_avg = {k:variables[k] for k in variables.keys() if k != time}
+    avg = group_statistics(variables_avg,starts,counts,stats=stats,chunksize=max(navg,2**16))
+    if(time is not None):
+        t = variables[time]
+        avg[time] = t[avg['first']] + (t[avg['last']] - t[avg['first']]) / 2
+
+    avg.pop('first')
+    avg.pop('last')
+    avg['nsamples'] = counts
+    return avg
+
+
+def navg_stream(source,navg=10,time='time',stats=('mean',)):
+    """ Averages navg consecutive samples of a stream of chunks in
+    constant memory, samples of a window split between two chunks are
+    carried over into the next chunk
+
+    Usage:
+       >>>for avg in navg_stream(netcdf_chunks('advfile.nc','vel'),navg=16*60):
+       >>>    print(avg['time'],avg['v1'])
+
+    Args:
+        source: Iterable of dictionaries of arrays of the same length, e.g. netcdf_chunks
+        navg: The number of samples averaged
+        time: The key of the time variable, see average_samples
+    Yields:
+        Dictionaries of the averaged data, see average_samples
+    """
+    rest = None
+    for chunk in source:
+        if(time not in chunk.keys()):
+            time = None
+        if(rest is not None):
+            chunk = {k:np.concatenate((rest[k],chunk[k])) for k in chunk.keys()}
+
+        nsamples = len(chunk[list(chunk.keys())[0]])
+        nfull = (nsamples // navg) * navg
+        if(nfull > 0):
+            yield average_samples({k:chunk[k][:nfull] for k in chunk.keys()},navg,time=time,stats=stats)
+
+        rest = {k:chunk[k][nfull:] for k in chunk.keys()}
+
+    if((rest is not None) and (len(rest[list(rest.keys())[0]]) > 0)): # The last window
+        yield average_samples(rest,navg,time=time,stats=stats)
+
+
+def netcdf_chunks(fname,group='vel',variables=None,chunksize=2**16):
+    """ Reads the variables of a group of a netCDF file (as created by
+    bin2nc) chunk wise
+
+    Args:
+        fname: The filename or an open netCDF4.Dataset
+        variables: List of the variables, all variables of the group if None
+    Yields:
+        Dictionaries of the variables with up to chunksize samples
+    """
+    if(isinstance(fname,netCDF4.Dataset)):
+        dataset = fname
+        close = False
+    else:
+        dataset = netCDF4.Dataset(fname)
+        close = True
+
+    try:
+        grp = dataset.groups[group]
+        if(variables is None):
+            variables = list(grp.variables.keys())
+        nsamples = len(grp.variables[variables[0]])
+        for i0 in range(0,nsamples,chunksize):
+            i1 = min(i0 + chunksize,nsamples)
+            yield {k:np.ma.filled(grp.variables[k][i0:i1],np.nan) for k in variables}
+    finally:
+        if close:
+            dataset.close()
+
+
+def repair_phase_shift_array(vel,threshold,vel_prev=None):
+    """Repairs phase shifts (wraps of the velocity at the ambiguity
+    velocity threshold) of pulse coherent measurements along the first
+    axis of vel, all other axes (cells, beams) at once. A sample is
+    wrapped if it and the previous (repaired) sample are larger than
+    0.7 * threshold and have different signs, it then gets the sign of
+    the previous sample and the magnitude 2 * threshold - abs(vel). As
+    repaired samples are large as well, all samples of a run of large
+    samples get the sign of the first sample of the run. The velocities
+    are assumed to be smaller than 1.3 * threshold.
+
+    Args:
+        vel: Array of shape (N,...)
+        threshold: The ambiguity velocity
+        vel_prev: The last repaired sample of the previous chunk (shape vel.shape[1:]), None for the first chunk
+    Return:
+        The repaired velocities
+    """
+    vel = np.asarray(vel)
+    if(vel_prev is not None):
+        vel = np.concatenate((np.reshape(vel_prev,(1,) + np.shape(vel)[1:]),vel))
+
+    vthresh = threshold - 0.3 * threshold
+    velabs = np.abs(vel)
+    sign = np.sign(vel)
+    large = velabs > vthresh
+    start = large.copy()
+    start[1:] &= ~large[:-1]
+    # The index of the first sample of the run of every sample
+    ind = np.where(start,np.arange(len(vel)).reshape((-1,) + (1,) * (vel.ndim - 1)),0)
+    ind = np.maximum.accumulate(ind,axis=0)
+    sign_run = np.take_along_axis(sign,ind,axis=0)
+    wrapped = large & (sign != sign_run)
+    vel_rep = np.where(wrapped,sign_run * (threshold + (threshold - velabs)),vel)
+    if(vel_prev is not None):
+        vel_rep = vel_rep[1:]
+
+    return vel_rep
+
+
+def float_dtype(dtype):
+    """ Returns the floating point dtype used for calculations with data of dtype,
+    float32 for float32 and small integers, float64 otherwise
+    """
+    return np.result_type(dtype,np.float32)
+
+
+def beam_matrix(T,updown=False):
+    """ Returns a copy of the transformation matrix T (BEAM to XYZ),
+    the signs of the Y and Z rows are changed if the instrument is
+    pointing downward
+    """
+    T = np.array(T,dtype=np.float64)
+    if updown:
+        logger.debug('Downlooking, changing matrix')
+        T[1,:] = -T[1,:]
+        T[2,:] = -T[2,:]
+
+    return T
+
+
+def heading_pitch_roll_matrices(head,pitch,roll):
+    """ Returns the (N,3,3) stack of the rotation matrices XYZ to ENU
+    (heading matrix times the combined pitch and roll matrix) according
+    to the Nortek convention
+
+    Args:
+        head, pitch, roll: Arrays of length N in degrees
+    """
+    # convert to radians
+    hh = np.pi*(np.asarray(head,dtype=np.float64)-90)/180
+    pp = np.pi*np.asarray(pitch,dtype=np.float64)/180
+    rr = np.pi*np.asarray(roll,dtype=np.float64)/180
+    ch, sh = cos(hh), sin(hh)
+    cp, sp = cos(pp), sin(pp)
+    cr, sr = cos(rr), sin(rr)
+    zero = np.zeros(np.shape(hh))
+    one = np.ones(np.shape(hh))
+    # heading matrix
+    H = np.stack((np.stack((ch,sh,zero),axis=-1),
+                  np.stack((-sh,ch,zero),axis=-1),
+                  np.stack((zero,zero,one),axis=-1)),axis=-2)
+    # combined pitch and roll matrix
+    P = np.stack((np.stack((cp,-sp*sr,-cr*sp),axis=-1),
+                  np.stack((zero,cr,-sr),axis=-1),
+                  np.stack((sp,sr*cp,cp*cr),axis=-1)),axis=-2)
+    return np.matmul(H,P)
+
+
+def rotation_matrix(coord_from,coord_to,T,hpr=None):
+    """ Returns the matrix rotating velocities from coord_from to coord_to ('BEAM', 'XYZ', 'ENU')
+
+    Args:
+        T: The transformation matrix BEAM to XYZ (see beam_matrix)
+        hpr: [heading,pitch,roll] arrays of length N, needed for ENU
+    Return:
+        (3,3) matrix or (N,3,3) stack of matrices if ENU is involved
+    """
+    # Everything is rotated via XYZ
+    M = np.eye(3)
+    if(coord_from == 'BEAM'):
+        M = T
+    elif(coord_from == 'ENU'):
+        M = np.swapaxes(heading_pitch_roll_matrices(*hpr),-1,-2) # The inverse rotation matrix is the transpose
+
+    if(coord_to == 'BEAM'):
+        M = np.matmul(np.linalg.inv(T),M)
+    elif(coord_to == 'ENU'):
+        M = np.matmul(heading_pitch_roll_matrices(*hpr),M)
+
+    if(coord_from == coord_to):
+        M = np.broadcast_to(np.eye(3),np.shape(M))
+
+    return M
+
+
+def rotate(vel,M,vel_rot):
+    """ Rotates the three velocity components in vel with the matrix M
+    into the preallocated arrays in vel_rot
+
+    Args:
+        vel: List of the three velocity components, arrays of shape (N,) or (N,ncells)
+        M: (3,3) matrix or (N,3,3) stack of matrices
+        vel_rot: List of three arrays of the shape of the velocities
+    """
+    V = np.stack([np.reshape(v,(np.shape(v)[0],-1)) for v in vel],axis=1) # (N,3,ncells)
+    Vrot = np.matmul(M,V) # Batched matrix product, (3,3) or (N,3,3) times (N,3,ncells)
+
+    for i in range(3):
+        vel_rot[i][:] = np.reshape(Vrot[:,i],np.shape(vel_rot[i]))
+
+
 raw_data_files = ['.prf','.vec','.wpa','.wpr'] # Names of raw binary data files
+# The processing methods and the files they depend on, the method is
+# called when the first file is listed in the header
+processing_stages = {'process_rawdata_sen':['sen'],
+                     'process_rawdata_wave':['whd','wad']}
+# The attributes created by the processing stages, processed on first access in lazy mode
+lazy_attributes = {'t':'process_datetime','tu':'process_rawdata_sen','t64':'process_rawdata_sen',
+                   'data_wave':'process_rawdata_wave','data_wave_burst':'process_rawdata_wave'}
+aquadopp_keys = ['v1','v2','v3','a1','a2','a3','c1','c2','c3'] # Profiler (Aquadopp) files
+vector_keys = ['dat'] # Vector files
+# The columns of the files needed for the time axis and the burst mapping, they have to be part of usecols
+usecols_required = {'sen':[0,1,2,3,4,5],'whd':[0,1,2,3,4,5,6],'wad':[0,1,3,4]}
+coordinate_systems = ['BEAM','XYZ','ENU']
+# The dtypes of the loaded files, float64 if not listed. Integer types
+# are changed to uint16 for burst sampling (counters in the files)
+memory_profiles = {'default':{},
+                   'compact':{'v1':np.float32,'v2':np.float32,'v3':np.float32,
+                              'a1':np.uint8,'a2':np.uint8,'a3':np.uint8,
+                              'c1':np.uint8,'c2':np.uint8,'c3':np.uint8,
+                              'dat':np.float32}}
+class lazydict(collections.abc.MutableMapping):
+    """ A dictionary calling the function of a key on the first access
+    of the key, the returned value is stored and returned from then on
+
+    Usage:
+       >>>d = lazydict({'a':lambda: np.loadtxt('a.txt')})
+       >>>d['a'] # loads a.txt
+    """
+    def __init__(self,loaders):
+        self.loaders = dict(loaders)
+        self.store = {}
+        self.lock = threading.RLock()
+
+    def __getitem__(self,key):
+        try:
+            return self.store[key]
+        except KeyError:
+            pass
+
+        with self.lock:
+            if(key not in self.store.keys()):
+                self.store[key] = self.loaders[key]()
+
+            return self.store[key]
+
+    def __setitem__(self,key,value):
+        self.store[key] = value
+
+    def __delitem__(self,key):
+        if(key not in self):
+            raise KeyError(key)
+        self.store.pop(key,None)
+        self.loaders.pop(key,None)
+
+    def __iter__(self):
+        for key in self.loaders.keys():
+            yield key
+        for key in self.store.keys():
+            if(key not in self.loaders.keys()):
+                yield key
+
+    def __len__(self):
+        return len(set(self.loaders.keys()) | set(self.store.keys()))
+
+    def __contains__(self,key):
+        return (key in self.loaders.keys()) or (key in self.store.keys())
+
+    def loaded(self):
+        """ Returns the keys already loaded
+        """
+        return list(self.store.keys())
+
+    def __repr__(self):
+        return 'lazydict(loaded:{}, not loaded:{})'.format(self.loaded(),[k for k in self.loaders.keys() if k not in self.store.keys()])
+
+
 class pynortek():
     """A Nortek parsing object
 
@@ -90,11 +599,33 @@ class pynortek():
        >>>aquadopp = pynortek(filename)
 
     """
-    def __init__(self,filename, verbosity=logging.DEBUG, timezone=pytz.UTC):
+    def __init__(self,filename, verbosity=logging.DEBUG, timezone=pytz.UTC, nworkers=None, pool='thread', cache=False, cachedir=None, lazy=False, cells=None, usecols=None, memory='default', lazy_t=False):
         """
+        Args:
+            filename: The deployment name, i.e. the .hdr file without the suffix
+            nworkers: The number of files loaded concurrently, all files if None
+            pool: 'thread' or 'process', the pool the files are loaded with
+            cache: Cache the parsed header and data as .npy files, unchanged files are read memory mapped (read only) from the cache
+            cachedir: The directory of the cache, filename + '_cache' if None
+            lazy: rawdata and data are loaded on first access of a key, t, tu, data_wave and data_wave_burst are processed on first access
+            cells: Index, slice or list of the profiler cells to be loaded (v, a, c files), e.g. slice(0,20)
+            usecols: Dictionary of suffix and list of columns to be loaded, e.g. {'sen':[0,1,2,3,4,5,15]}, the columns of usecols_required have to be included. Sensors of the header not loaded are not in data
+            memory: The memory profile, 'default' (float64) or 'compact' (float32 velocities, uint8/uint16 amplitudes and correlations), see memory_profiles
+            lazy_t: Create the list of datetime objects (t) on first access, the time axis is in t64 (datetime64, UTC) and tu (unix time)
         """
         logger.setLevel(verbosity)
         self.timezone = timezone
+        self.lazy = lazy
+        self.cells = cells
+        self.usecols = usecols if usecols is not None else {}
+        for suffix in self.usecols.keys():
+            missing = [i for i in usecols_required.get(suffix,[]) if i not in self.usecols[suffix]]
+            if(len(missing) > 0):
+                raise ValueError('usecols of {} need the columns {}, missing {}'.format(suffix,usecols_required[suffix],missing))
+        if(memory not in memory_profiles.keys()):
+            raise ValueError('Unknown memory profile {}, choose one of {}'.format(memory,list(memory_profiles.keys())))
+        self.memory = memory
+        self.lazy_t = lazy_t
         self.deployment = os.path.split(filename)[-1]
         self.fpath = os.path.split(filename)[0]
         self.rawdata = {}
@@ -102,19 +633,34 @@ class pynortek():
         print(self.deployment)
         print(self.fpath)        
         filename_hdr = filename + '.hdr'
-        logger.debug('Trying to open header file: ' + filename_hdr)
-        try:
-            fhdr = open(filename_hdr)
-        except Exception as e:
-            raise ValueError('Could not open header file, exiting\n{}'.format(filename_hdr))
-            #logger.warning('Could not open header file, exiting')
-            #return
+        self.filename_hdr = filename_hdr
+        self.cache = cache
+        manifest = None
+        header = None
+        if cache:
+            if(cachedir is None):
+                cachedir = filename + '_cache'
+
+            manifest = cache_read(cachedir)
+            header = cache_header(manifest,filename_hdr,self.timezone)
+
+        self.cachedir = cachedir
+        if(header is None):
+            logger.debug('Trying to open header file: ' + filename_hdr)
+            try:
+                fhdr = open(filename_hdr)
+            except Exception as e:
+                raise ValueError('Could not open header file, exiting\n{}'.format(filename_hdr))
+                #logger.warning('Could not open header file, exiting')
+                #return
+
+            header = self.parse_header(fhdr)
+            fhdr.close()
 
-        header = self.parse_header(fhdr)
         self.header = header
         #print(header)
         logger.info('Loading files')
-        flag_wave = False
+        files = {}
         for fread in header['files']:
             logger.info('File:{}'.format(fread))
             IS_RAW = False
@@ -123,41 +669,218 @@ class pynortek():
                     IS_RAW=True
 
             if(IS_RAW == False):
-                logger.info('Loading:{}'.format(fread))
                 suffix = fread.split('.')[-1]
-                fname_tmp = os.path.join(self.fpath,fread)
-                #print(fname_tmp)
-                # Read the rawdata
-                if fname_tmp.lower().endswith('.whd'):  # Loading wave header data
-                    logger.info('Reading wave header data')
-                    #self.read_rawdata_wave_header(fname_tmp)
-                    try:
-                        data_tmp = np.loadtxt(fname_tmp)
-                        self.rawdata[suffix] = data_tmp
-                        flag_wave = True                        
-                    except:
-                        self.rawdata[suffix] = None
-                elif fname_tmp.lower().endswith('.wad'):  # Loading wave data
-                    logger.info('Reading wave data')
-                    flag_wave = True
-                    try:
-                        data_tmp = np.loadtxt(fname_tmp)
-                        self.rawdata[suffix] = data_tmp
-                    except:
-                        self.rawdata[suffix] = None
-                else:  # Saving rawdata into dictionary
-                    logger.info('Reading velocity data')                    
-                    try:
-                        data_tmp = np.loadtxt(fname_tmp)
-                        self.rawdata[suffix] = data_tmp
-                    except:
-                        self.rawdata[suffix] = None
+                files[suffix] = os.path.join(self.fpath,fread)
+
+        self.files = files
+        rawdata_cached = {}
+        if cache:
+            rawdata_cached = cache_rawdata(manifest,cachedir,files)
+
+        self.cached = list(rawdata_cached.keys())
+        if lazy:
+            logger.info('Lazy mode, files are loaded on first access')
+            loaders = {}
+            for suffix in files.keys():
+                loaders[suffix] = functools.partial(self.load_file,suffix)
+
+            self.rawdata = lazydict(loaders)
+            for suffix in rawdata_cached.keys():
+                self.rawdata[suffix] = self.select_rawdata(suffix,rawdata_cached[suffix])
+
+            self.data = lazydict(self.data_loaders())
+            self.data.update(self.distance())
+            return
+
+        # Load the files concurrently and start the processing depending
+        # on a file as soon as its data is available
+        stages = {}
+        for stage in processing_stages.keys():
+            suffixes = processing_stages[stage]
+            if(suffixes[0] in files.keys()):
+                stages[stage] = suffixes
+
+        for suffix in rawdata_cached.keys():
+            self.rawdata[suffix] = self.select_rawdata(suffix,rawdata_cached[suffix])
+
+        self.process_stages(stages)
+        if(pool == 'process'):
+            executor = concurrent.futures.ProcessPoolExecutor
+        else:
+            executor = concurrent.futures.ThreadPoolExecutor
+
+        files_load = [suffix for suffix in files.keys() if suffix not in rawdata_cached.keys()]
+        rawdata_load = {}
+        with executor(max_workers=nworkers if nworkers else max(1,len(files_load))) as pool_load:
+            futures = {}
+            for suffix in files_load:
+                fname_tmp = files[suffix]
+                logger.info('Loading:{}'.format(fname_tmp))
+                # The cache holds all columns as float64, selected and converted afterwards
+                if cache:
+                    future = pool_load.submit(loadtxt_ascii,fname_tmp)
+                else:
+                    future = pool_load.submit(loadtxt_ascii,fname_tmp,dtype=self.file_dtype(suffix),
+                                              usecols=self.file_usecols(suffix))
+                futures[future] = suffix
+
+            for future in concurrent.futures.as_completed(futures):
+                suffix = futures[future]
+                try:
+                    data_tmp = future.result()
+                    logger.info('Loaded:{}'.format(files[suffix]))
+                    if cache:
+                        rawdata_load[suffix] = data_tmp
+                        data_tmp = self.select_rawdata(suffix,data_tmp)
+                    self.rawdata[suffix] = data_tmp
+                except Exception as e:
+                    logger.warning('Could not load {}: {}'.format(files[suffix],e))
+                    self.rawdata[suffix] = None
+
+                self.process_stages(stages)
+
+        if cache and (len(files_load) > 0 or manifest is None):
+            try:
+                cache_write(cachedir,filename_hdr,header,files,rawdata_load,self.cached)
+            except Exception as e:
+                logger.warning('Could not write cache {}: {}'.format(cachedir,e))
+
+        # Process the remaining raw data just loaded
+        self.process_rawdata_data()
+
+    def __getattr__(self,name):
+        """ Processes the time axis and the wave data on first access in
+        lazy mode and the datetime time axis t on first access if lazy_t
+        """
+        stage = lazy_attributes.get(name)
+        if((stage is None) or (stage in self.__dict__.setdefault('stages_running',[]))):
+            raise AttributeError("'{}' object has no attribute '{}'".format(type(self).__name__,name))
+        if((self.__dict__.get('lazy') != True) and (stage != 'process_datetime')):
+            raise AttributeError("'{}' object has no attribute '{}'".format(type(self).__name__,name))
+
+        logger.debug('Lazy mode: {} accessed, calling {}'.format(name,stage))
+        self.stages_running.append(stage)
+        try:
+            getattr(self,stage)()
+        finally:
+            self.stages_running.remove(stage)
+
+        return self.__dict__[name]
+
+    def file_usecols(self,suffix,ncols=None):
+        """ Returns the columns to be loaded of the file with suffix,
+        None for all columns. Defined by usecols and, for profiler
+        files, cells.
+
+        Args:
+            ncols: The number of columns of the file, read from the file if None
+        """
+        if(suffix in self.usecols.keys()):
+            return list(self.usecols[suffix])
+        elif((self.cells is not None) and (suffix in aquadopp_keys)):
+            if(ncols is None):
+                ncols = count_columns(self.files[suffix])
+            offset = 2 if self.header['Burst sampling'] else 0
+            cells = np.arange(ncols - offset)[self.cells]
+            return list(range(offset)) + list(np.atleast_1d(cells) + offset)
+        else:
+            return None
+
+    def column_index(self,suffix,ind):
+        """ Returns the index of column ind of the file with suffix (as
+        in the header) in rawdata[suffix], None if the column was not
+        loaded (usecols)
+        """
+        if(suffix not in self.usecols.keys()):
+            return ind
+
+        usecols = list(self.usecols[suffix])
+        return usecols.index(ind) if ind in usecols else None
+
+    def file_dtype(self,suffix):
+        """ Returns the dtype of the data of the file with suffix as defined in the memory profile
+        """
+        dtype = np.dtype(memory_profiles[self.memory].get(suffix,np.float64))
+        if(np.issubdtype(dtype,np.integer) and self.header['Burst sampling']):
+            # The burst and ensemble counters are stored in the file as well
+            dtype = np.dtype(np.uint16)
+
+        return dtype
+
+    def select_rawdata(self,suffix,data):
+        """ Selects the columns of file_usecols of the fully loaded data
+        of file suffix and converts it to the dtype of the memory profile
+        """
+        usecols = self.file_usecols(suffix,np.shape(data)[1])
+        if(usecols is not None):
+            data = data[:,usecols]
+
+        return data.astype(self.file_dtype(suffix),copy=False)
+
+    def load_file(self,suffix):
+        """ Loads the file with suffix, used in lazy mode. The data is
+        cached if the cache is used.
+
+        Returns:
+            The data or None if the file could not be loaded
+        """
+        fname_tmp = self.files[suffix]
+        logger.info('Loading:{}'.format(fname_tmp))
+        try:
+            if self.cache:
+                data_tmp = loadtxt_ascii(fname_tmp)
+            else:
+                data_tmp = loadtxt_ascii(fname_tmp,dtype=self.file_dtype(suffix),usecols=self.file_usecols(suffix))
+        except Exception as e:
+            logger.warning('Could not load {}: {}'.format(fname_tmp,e))
+            return None
+
+        if self.cache:
+            try:
+                cache_write(self.cachedir,self.filename_hdr,self.header,self.files,{suffix:data_tmp},self.cached)
+                self.cached.append(suffix)
+            except Exception as e:
+                logger.warning('Could not write cache {}: {}'.format(self.cachedir,e))
+
+            data_tmp = self.select_rawdata(suffix,data_tmp)
+
+        return data_tmp
+
+    def data_loaders(self):
+        """ Returns the functions creating the entries of data in lazy mode
+        """
+        loaders = {}
+        if(('sen' in self.files.keys()) and ('sensors' in self.header.keys())):
+            for k in self.header['sensors'].keys():
+                ind_key = self.column_index('sen',self.header['sensors'][k] - 1)
+                if(ind_key is not None):
+                    loaders[k] = functools.partial(self.rawdata_column,'sen',ind_key)
+
+        for key in aquadopp_keys + vector_keys:
+            if(key in self.files.keys()):
+                loaders[key] = functools.partial(self.rawdata_data,key)
+
+        return loaders
+
+    def rawdata_column(self,suffix,ind):
+        """ Returns column ind of rawdata[suffix]
+        """
+        return self.rawdata[suffix][:,ind]
+
+    def process_stages(self,stages):
+        """ Calls the processing stages (dictionary of method name and
+        the suffixes it depends on) whose files are loaded and removes
+        them from stages
+        """
+        for stage in list(stages.keys()):
+            if(all([s in self.rawdata.keys() for s in stages[stage]])):
+                suffixes = stages.pop(stage)
+                if(any([self.rawdata[s] is None for s in suffixes])):
+                    logger.warning('Missing data for {}, skipping'.format(stage))
+                else:
+                    logger.debug('Data of {} available, calling {}'.format(suffixes,stage))
+                    getattr(self,stage)()
 
-        if flag_wave:
-            self.process_rawdata_wave()
-        # Process the raw data just loaded
-        self.process_rawdata()
-        
     def parse_header(self,fhdr):
         """ Parses a nortek header file
         """
@@ -190,6 +913,15 @@ class pynortek():
                     logger.debug('Found a wave data file (.wad), looking for key entries')
                     header_field = 'wave_data'
                     header[header_field] = {}                                        
+                # Vector velocity data and velocity header files
+                if('.dat' in l[-7:]):
+                    logger.debug('Found a velocity data file (.dat), looking for key entries')
+                    header_field = 'velocity_data'
+                    header[header_field] = {}
+                if('.vhd' in l[-7:]):
+                    logger.debug('Found a velocity header file (.vhd), looking for key entries')
+                    header_field = 'velocity_header'
+                    header[header_field] = {}
 
             # Transducer distance (beam coordinates)
             if(('Beam' in l) and ('Vertical' in l)):
@@ -323,6 +1055,13 @@ class pynortek():
                         field = lsp[1]
                         value = lsp[0]
                         header[header_field][field] = int(value)                                                
+                    elif(header_field in ['velocity_data','velocity_header']):
+                        l = l.replace('\n','').replace('\r','').strip()
+                        lsp = re.sub("  +" , "\t", l).split('\t')
+                        logger.debug('.{} entry:{}'.format('dat' if header_field == 'velocity_data' else 'vhd',lsp))
+                        field = lsp[1]
+                        value = lsp[0]
+                        header[header_field][field] = int(value)
                     elif(header_field == 'distance'):
                         l = l.replace('\n','').replace('\r','').strip()
                         lsp = re.sub("  +" , "\t", l).split('\t')
@@ -443,12 +1182,12 @@ class pynortek():
         freqstr = self.header['Head configuration']['Head frequency']
         if freqstr.startswith('1000'):
             logger.debug('1000 kHz: Setting Delta t for burst to 0.5s (0.25 for AST)')
-            dt = datetime.timedelta(seconds=0.5)
-            dt_AST = datetime.timedelta(seconds=0.25)
+            dt = np.timedelta64(500,'ms')
+            dt_AST = np.timedelta64(250,'ms')
         else:
             logger.debug('<1000 kHz: Setting Delta t for burst to 1s (0.5 for AST)')
-            dt = datetime.timedelta(seconds=1.0)
-            dt_AST = datetime.timedelta(seconds=0.5)
+            dt = np.timedelta64(1000,'ms')
+            dt_AST = np.timedelta64(500,'ms')
 
         try:
             self.data_wave
@@ -458,211 +1197,197 @@ class pynortek():
         try:
             self.data_wave_burst
         except:
-            self.data_wave_burst = {}                        
-
-        t  = []
-        tu = []
-        burst_tmp = []
-        for i in range(np.shape(self.rawdata['whd'][:,0])[0]):
-            burst = int(self.rawdata['whd'][i,6])
-            month  = int(self.rawdata['whd'][i,0])
-            day    = int(self.rawdata['whd'][i,1])
-            year   = int(self.rawdata['whd'][i,2])
-            hour   = int(self.rawdata['whd'][i,3])
-            minute = int(self.rawdata['whd'][i,4])
-            millis = self.rawdata['whd'][i,5]%1
-            second = int(self.rawdata['whd'][i,5] - millis)
-            micro  = int(millis*1000*1000)
-            ttmp = datetime.datetime(year,month,day,hour,minute,second,micro,tzinfo=self.timezone)
-            t.append(ttmp)
-            tu.append(ttmp.timestamp())
-            burst_tmp.append(burst)
+            if(self.lazy or self.lazy_t):
+                self.data_wave_burst = lazydict({})
+            else:
+                self.data_wave_burst = {}
+
+        whd = self.rawdata['whd']
+        t64_local = datetime64_from_columns(*[whd[:,self.column_index('whd',i)] for i in range(6)])
+        t64 = t64_local - utc_offset(t64_local,self.timezone)
+        tu = (t64 - np.datetime64('1970-01-01T00:00:00','ns')) / np.timedelta64(1,'s')
+        t = datetime_from_datetime64(t64,self.timezone)
 
         # Map burst data
         logger.debug('Mapping burst data (.whd)')
         self.data_wave['t'] = t
+        self.data_wave['t64'] = t64
         self.data_wave['tu'] = tu
         for k in self.header['wave_header'].keys():
-            ind_key = self.header['wave_header'][k] - 1
-            self.data_wave[k] = self.rawdata['whd'][:,ind_key]
+            ind_key = self.column_index('whd',self.header['wave_header'][k] - 1)
+            if(ind_key is not None):
+                self.data_wave[k] = self.rawdata['whd'][:,ind_key]
 
 
         # Calculate time for ensemble members of burst
         logger.debug('Mapping ensemble members of burst data (.wad)')        
         for k in self.header['wave_data'].keys():
-            ind_key = self.header['wave_data'][k] - 1
-            self.data_wave_burst[k] = self.rawdata['wad'][:,ind_key]
+            ind_key = self.column_index('wad',self.header['wave_data'][k] - 1)
+            if(ind_key is not None):
+                self.data_wave_burst[k] = self.rawdata['wad'][:,ind_key]
 
         logger.debug('Creating time axis for burst members')
-        t_burst  = []
-        tu_burst = []
-        t_AST  = []
-        tu_AST  = []
-        burst_AST  = []        
-        AST  = []                
-        for i in range(np.shape(self.rawdata['wad'][:,0])[0]):
-            burst = int(self.rawdata['wad'][i,0])
-            ensemble = int(self.rawdata['wad'][i,1])
-            #print('burst',burst,'ensemble',ensemble)
-            #print(burst_tmp)
-            iburst = burst_tmp.index(burst)
-            #print('iburst',iburst)
-            #t_iburst = t[iburst]            
-            t_ensemble = t[iburst] + (ensemble - 1 ) * dt
-            t_burst.append(t_ensemble)
-            tu_burst.append(t_ensemble.timestamp())            
-            # AST is sampled with double frequency
-            AST1 = float(self.rawdata['wad'][i,3])
-            AST2 = float(self.rawdata['wad'][i,4])
-            AST.append(AST1)
-            AST.append(AST2)
-            t_AST1 = t[iburst] + (ensemble - 1 ) * dt - dt_AST
-            t_AST2 = t[iburst] + (ensemble - 1 ) * dt
-            t_AST.append(t_AST1)
-            t_AST.append(t_AST2)
-            burst_AST.append(burst)
-            burst_AST.append(burst)
-            tu_AST.append(t_AST1.timestamp())
-            tu_AST.append(t_AST2.timestamp())
-
-
-
-
-        self.data_wave_burst['t'] = t_burst
-        self.data_wave_burst['t_AST'] = t_AST
-        self.data_wave_burst['tu'] = tu_burst
-        self.data_wave_burst['tu_AST'] = tu_AST        
-        self.data_wave_burst['AST'] = AST
-        self.data_wave_burst['burst_AST'] = burst_AST        
-            
-        
+        wad = self.rawdata['wad']
+        burst = wad[:,self.column_index('wad',0)].astype(np.int64)
+        ensemble = wad[:,self.column_index('wad',1)].astype(np.int64)
+        iburst = wave_burst_index(whd[:,self.column_index('whd',6)].astype(np.int64),burst)
+        t64_burst = t64[iburst] + (ensemble - 1) * dt
+        # AST is sampled with double frequency, the two samples of a row are interleaved
+        t64_AST = np.stack((t64_burst - dt_AST,t64_burst),axis=1).reshape(-1)
+
+        self.data_wave_burst['t64'] = t64_burst
+        self.data_wave_burst['t64_AST'] = t64_AST
+        self.data_wave_burst['tu'] = (t64_burst - np.datetime64('1970-01-01T00:00:00','ns')) / np.timedelta64(1,'s')
+        self.data_wave_burst['tu_AST'] = (t64_AST - np.datetime64('1970-01-01T00:00:00','ns')) / np.timedelta64(1,'s')
+        self.data_wave_burst['AST'] = wad[:,[self.column_index('wad',3),self.column_index('wad',4)]].astype(np.float64).reshape(-1)
+        self.data_wave_burst['burst_AST'] = np.repeat(burst,2)
+        # The datetime objects, created on first access with lazy_t
+        if(isinstance(self.data_wave_burst,lazydict)):
+            self.data_wave_burst.loaders['t'] = lambda: np.asarray(datetime_from_datetime64(t64_burst,self.timezone),dtype=object)
+            self.data_wave_burst.loaders['t_AST'] = lambda: np.asarray(datetime_from_datetime64(t64_AST,self.timezone),dtype=object)
+        else:
+            self.data_wave_burst['t'] = np.asarray(datetime_from_datetime64(t64_burst,self.timezone),dtype=object)
+            self.data_wave_burst['t_AST'] = np.asarray(datetime_from_datetime64(t64_AST,self.timezone),dtype=object)
 
 
     def process_rawdata(self):
         """ Processes .sen data stored in data['sen'] and the remaining rawdata
         """
+        self.process_rawdata_sen()
+        self.process_rawdata_data()
+
+    def process_rawdata_sen(self):
+        """ Processes .sen data stored in data['sen'], creating the time axis
+        """
         logger.debug('Creating time axis')
-        t  = []
-        tu = []        
-        for i in range(np.shape(self.rawdata['sen'][:,0])[0]):
-            month  = int(self.rawdata['sen'][i,0])
-            day    = int(self.rawdata['sen'][i,1])
-            year   = int(self.rawdata['sen'][i,2])
-            hour   = int(self.rawdata['sen'][i,3])
-            minute = int(self.rawdata['sen'][i,4])
-            millis = self.rawdata['sen'][i,5]%1
-            second = int(self.rawdata['sen'][i,5] - millis)
-            micro  = int(millis*1000*1000)
-            ttmp = datetime.datetime(year,month,day,hour,minute,second,micro,tzinfo=self.timezone)
-            t.append(ttmp)
-            tu.append(ttmp.timestamp())
-            
-        
-        self.t = t # datetime time
-        self.tu = tu # unix time
+        sen = self.rawdata['sen']
+        t64_local = datetime64_from_columns(*[sen[:,self.column_index('sen',i)] for i in range(6)])
+        self.t64 = t64_local - utc_offset(t64_local,self.timezone) # datetime64 time (UTC)
+        self.tu = (self.t64 - np.datetime64('1970-01-01T00:00:00','ns')) / np.timedelta64(1,'s') # unix time
+        if((self.__dict__.get('lazy_t') != True) and (self.__dict__.get('lazy') != True)):
+            self.process_datetime()
 
         for k in self.header['sensors'].keys():
-            ind_key = self.header['sensors'][k] - 1
-            self.data[k] = self.rawdata['sen'][:,ind_key]
+            ind_key = self.column_index('sen',self.header['sensors'][k] - 1)
+            if(ind_key is not None):
+                self.data[k] = self.rawdata['sen'][:,ind_key]
 
-        
+    def process_datetime(self):
+        """ Creates the datetime time axis (t) out of t64
+        """
+        logger.debug('Creating datetime time axis')
+        self.t = datetime_from_datetime64(self.t64,self.timezone) # datetime time
+
+    def process_rawdata_data(self):
+        """ Processes the remaining rawdata (profiler and Vector data)
+        """
         # Processing the remaining data
+        # For a profiler (Aquadopp)
+        for key in aquadopp_keys:
+            if(key in self.rawdata.keys()):
+               logger.info('Getting data from: ' + key + ' (profiler)')
+               self.data[key] = self.rawdata_data(key)
+
+        self.data.update(self.distance())
+        for key in vector_keys:
+            if(key in self.rawdata.keys()):
+               logger.info('Getting data from: ' + key + ' (Vector)')
+               self.data[key] = self.rawdata_data(key)
+
+    def rawdata_data(self,key):
+        """ Returns the data of rawdata[key] without the burst and ensemble counter columns
+        """
         try:
             burst_sampling = self.header['Burst sampling']
         except:
             burst_sampling = False
 
-        logger.info('Burst sampling {}'.format(burst_sampling))
-        # For a profiler (Aquadopp)
-        aquadopp_keys = ['v1','v2','v3','a1','a2','a3','c1','c2','c3']
-        for key in aquadopp_keys:
-            if(key in self.rawdata.keys()):
-               logger.info('Getting data from: ' + key + ' (profiler)')
-               if burst_sampling:
-                   self.data[key] = self.rawdata[key][:,2:]
-               else:
-                   self.data[key] = self.rawdata[key][:,:]
+        logger.debug('Burst sampling {}'.format(burst_sampling))
+        if burst_sampling:
+            return self.rawdata[key][:,2:]
+        else:
+            return self.rawdata[key][:,:]
 
+    def distance(self):
+        """ Returns the distance of the cells as found in the header (dis_beam, dis_vertical)
+        """
+        distance = {}
         if('distance' in self.header.keys()):
             try:
-                self.data['dis_beam'] = np.asarray(self.header['distance']['beam'])
+                distance['dis_beam'] = np.asarray(self.header['distance']['beam'])
             except:
                 pass
-            self.data['dis_vertical'] = np.asarray(self.header['distance']['vertical'])
+            distance['dis_vertical'] = np.asarray(self.header['distance']['vertical'])
 
-        vector_keys = ['dat']
-        for key in vector_keys:
-            if(key in self.rawdata.keys()):
-               logger.info('Getting data from: ' + key + ' (Vector)')
-               if burst_sampling:
-                   self.data[key] = self.rawdata[key][:,2:]
-               else:
-                   self.data[key] = self.rawdata[key][:,:]
+        if(self.cells is not None):
+            for k in distance.keys():
+                distance[k] = np.atleast_1d(distance[k][self.cells])
+
+        return distance
 
 
-    def rot_vel(self,coord,updown=None,save=True):
+    def rot_vel(self,coord,updown=None,save=True,chunksize=4096):
         """ Rotates the velocities to different coordinate system
         Args:
-            coord:
-            updown:
-            save:
+            coord: The coordinate system, 'BEAM', 'XYZ' or 'ENU'. ENU uses the heading, pitch and roll of the sensor data
+            updown: Instrument pointing downward, from the header if None
+            save: Save the rotated velocities in self.rotvel ('u', 'v', 'w' and the repaired velocities 'u_rep' ...), the coordinate system in self.rotvel_coord
+            chunksize: The number of samples rotated at once
+        Return:
+            [v1_rot,v2_rot,v3_rot]
         """
         logger.debug('trans_coord():')
-        T = self.header['Transformation matrix'][:]
+        coord_data = self.header['Coordinate system']
+        for c in [coord,coord_data]:
+            if(c not in coordinate_systems):
+                raise ValueError('Unknown coordinate system {}, choose one of {}'.format(c,coordinate_systems))
+
         if(updown == None):
             updown = self.header['updown']
 
         # flip axes if instrument is pointing downward
         # (so from here on, XYZ refers to a right-handed coordinate system
         # with z pointing upward)
+        T = beam_matrix(self.header['Transformation matrix'],updown)
 
-        if updown:
-            logger.debug('Downlooking, changing matrix')
-            T[1,:] = -T[1,:];
-            T[2,:] = -T[2,:];
+        # The rotated velocities have the dtype of the velocities (float32 in the compact memory profile)
+        dtype = float_dtype(self.data['v1'].dtype)
+        vel_all = [[self.data['v1'],self.data['v2'],self.data['v3']]]
+        repaired = 'v1_rep' in self.data.keys()
+        if repaired:
+            vel_all.append([self.data['v1_rep'],self.data['v2_rep'],self.data['v3_rep']])
+
+        vel_rot_all = []
+        for vel in vel_all:
+            vel_rot_all.append([np.zeros(np.shape(v),dtype=dtype) for v in vel])
 
-        v1_rot = np.zeros(np.shape(self.data['v1']))
-        v2_rot = np.zeros(np.shape(self.data['v2']))
-        v3_rot = np.zeros(np.shape(self.data['v3']))
-        try:
-            v1_rep_rot = np.zeros(np.shape(self.data['v1_rep']))
-            v2_rep_rot = np.zeros(np.shape(self.data['v2_rep']))
-            v3_rep_rot = np.zeros(np.shape(self.data['v3_rep']))
-            repaired = True
-        except:
-            repaired = False
-            pass
-        
         print(np.shape(self.data['v1']))
-        if(coord == 'XYZ'):
-            if(self.header['Coordinate system'] == 'BEAM'):
-                logger.debug('BEAM to XYZ')
-                for i in range(np.shape(v1_rot)[0]):
-                    for j in range(np.shape(v1_rot)[1]):
-                        v1_rot[i,j] = T[0,0] * self.data['v1'][i,j] + T[0,1] * self.data['v2'][i,j] + T[0,2] * self.data['v3'][i,j]
-                        v2_rot[i,j] = T[1,0] * self.data['v1'][i,j] + T[1,1] * self.data['v2'][i,j] + T[1,2] * self.data['v3'][i,j]
-                        v3_rot[i,j] = T[2,0] * self.data['v1'][i,j] + T[2,1] * self.data['v2'][i,j] + T[2,2] * self.data['v3'][i,j]
-                        if repaired:
-                            v1_rep_rot[i,j] = T[0,0] * self.data['v1_rep'][i,j] + T[0,1] * self.data['v2_rep'][i,j] + T[0,2] * self.data['v3_rep'][i,j]
-                            v2_rep_rot[i,j] = T[1,0] * self.data['v1_rep'][i,j] + T[1,1] * self.data['v2_rep'][i,j] + T[1,2] * self.data['v3_rep'][i,j]
-                            v3_rep_rot[i,j] = T[2,0] * self.data['v1_rep'][i,j] + T[2,1] * self.data['v2_rep'][i,j] + T[2,2] * self.data['v3_rep'][i,j]                        
+        logger.debug('{} to {}'.format(coord_data,coord))
+        nsamples = np.shape(self.data['v1'])[0]
+        for i0 in range(0,nsamples,chunksize):
+            i1 = min(i0 + chunksize,nsamples)
+            if('ENU' in [coord,coord_data]):
+                hpr = [self.data['Heading'][i0:i1],self.data['Pitch'][i0:i1],self.data['Roll'][i0:i1]]
+            else:
+                hpr = None
 
+            M = rotation_matrix(coord_data,coord,T,hpr).astype(dtype)
+            for vel,vel_rot in zip(vel_all,vel_rot_all):
+                rotate([v[i0:i1] for v in vel],M,[v[i0:i1] for v in vel_rot])
 
+        [v1_rot,v2_rot,v3_rot] = vel_rot_all[0]
         if save:
             logger.debug('saving data in trans')
-            try: # Check if self.trans is existing
-                self.trans
-            except:
-                self.rotvel = {}
-            if(coord == 'XYZ'):
-                self.rotvel['u'] = v1_rot[:]
-                self.rotvel['v'] = v2_rot[:]
-                self.rotvel['w'] = v3_rot[:]
-                if repaired:                
-                    # Save the repaired data as well
-                    self.rotvel['u_rep'] = v1_rep_rot[:]
-                    self.rotvel['v_rep'] = v2_rep_rot[:]
-                    self.rotvel['w_rep'] = v3_rep_rot[:]                                
+            self.rotvel = {}
+            self.rotvel_coord = coord
+            self.rotvel['u'] = v1_rot[:]
+            self.rotvel['v'] = v2_rot[:]
+            self.rotvel['w'] = v3_rot[:]
+            if repaired:                
+                # Save the repaired data as well
+                self.rotvel['u_rep'] = vel_rot_all[1][0]
+                self.rotvel['v_rep'] = vel_rot_all[1][1]
+                self.rotvel['w_rep'] = vel_rot_all[1][2]
 
 
         return [v1_rot,v2_rot,v3_rot]
@@ -673,221 +1398,176 @@ class pynortek():
         else:
             self.navg(navg)
 
-    def navg(self,navg=10):
+    def navg(self,navg=10,stats=('mean',)):
         """
         Averages n samples to one value
+
+        Args:
+            navg: The number of samples averaged, the last window may contain less samples
+            stats: See burst_avg
         """
         funcname = __name__ + '.navg_avg():'
+        nsamples = len(self.t64)
+        print('Nsamples',nsamples)
+        varavg = ['v1','v2','v3','a1','a2','a3','c1','c2','c3','Pressure']
+        logger.info(funcname + ' Will average over {:d} samples'.format(navg))
+        variables = {'t64':self.t64}
+        for v in varavg:
+            if v in self.data.keys():
+                variables[v] = self.data[v]
+            else:
+                logger.info('Variable {} not found'.format(v))
+
         try:
-            self.rotvel
+            for v in ['u','v','w']:
+                variables['rotvel_' + v] = self.rotvel[v]
             flag_rotvel = True
         except:
             flag_rotvel = False
-        nsamples = len(self.t)
-        print('Nsamples',nsamples)
+
+        avg = average_samples(variables,navg,time='t64',stats=stats)
         burstavg = {}
         burstavg_rotvel = {}
-        varavg = ['v1','v2','v3','a1','a2','a3','c1','c2','c3','Pressure']
-        logger.info(funcname + ' Will average over {:d} samples'.format(navg))
-        #burstavg['nburst'] = []
-        burstavg['t'] = []
-        for count,i in enumerate(range(0,nsamples,navg)):
-            iup = min([i+navg,nsamples])
-            ind = range(i,iup)
-            t0 = self.t[ind[0]]
-            t1 = self.t[ind[-1]]
-            dt = t1 - t0
-            tb = t0 + dt / 2
-            #print(t0,dt)
-            burstavg['t'].append(tb)
-            #burstavg['nburst'].append(sum(ind))
-            logger.debug('Averaging {:d} samples of burst {:d} between {:s} and {:s}'.format(sum(ind),i, str(t0), str(t1)))
-            for ivar, v in enumerate(varavg):
-                if v in self.data.keys():
-                    if count == 0:
-                        burstavg[v] = []
-
-                    # This holds for vectors
-                    if len(np.shape(self.data[v])) == 2:
-                        dataavg = self.data[v][ind,:].mean(0)
-                    elif len(np.shape(self.data[v])) == 1:
-                        dataavg = self.data[v][ind].mean(0)
-
-                    burstavg[v].append(dataavg)
-                else:
-                    logger.info('Variable {} not found'.format(v))
-
-            if flag_rotvel:
-                rotvel_vars = ['u', 'v', 'w']
-                for ivar, v in enumerate(rotvel_vars):
-                    if count == 0:
-                        burstavg_rotvel[v] = []
-
-                    dataavg = self.rotvel[v][ind, :].mean(0)
-                    burstavg_rotvel[v].append(dataavg)
-
-
-                #dataavg = self.data[v][ind, :].mean(0)
-
-        # Make an array out of the lists
-        burstavg['t'] = np.asarray(burstavg['t'])
-        #burstavg['nburst'] = np.asarray(burstavg['nburst'])
-        for ivar, v in enumerate(varavg):
-            if v in self.data.keys():
-                burstavg[v] = np.asarray(burstavg[v])
+        for k in avg.keys():
+            if k.startswith('rotvel_'):
+                burstavg_rotvel[k.replace('rotvel_','',1)] = avg[k]
+            else:
+                burstavg[k] = avg[k]
 
+        burstavg['tu'] = (burstavg['t64'] - np.datetime64('1970-01-01T00:00:00','ns')) / np.timedelta64(1,'s')
+        burstavg['t'] = np.asarray(datetime_from_datetime64(burstavg['t64'],self.timezone),dtype=object)
         self.data_navg = burstavg
-
         if flag_rotvel:
-            for ivar, v in enumerate(rotvel_vars):
-                burstavg_rotvel[v] = np.asarray(burstavg_rotvel[v])
-                self.rotvel_burstavg = burstavg_rotvel            
+            self.rotvel_navg = burstavg_rotvel
 
-    def burst_avg(self, c_threshold=0):
+    def burst_avg(self, c_threshold=0, stats=('mean',), chunksize=2**16):
         """
         Averages the bursts
+
+        Args:
+            c_threshold: Samples with all three correlations (c1, c2, c3) below or equal the threshold are not used (if > 0)
+            stats: The statistics calculated, 'mean' and optionally 'std', 'count' (valid samples), 'median', saved as e.g. v1, v1_std, v1_count, v1_median
+            chunksize: The approximate number of samples processed at once
         """
         funcname = __name__ + '.burst_avg():'
-        nbursts = int(self.data['Burst counter'].max())
-        sburst = int(self.data['Burst counter'].min())
-        burstavg = {}
-        burstavg_rotvel = {}
         varavg = ['v1','v2','v3','a1','a2','a3','c1','c2','c3','Pressure']
-        logger.info(funcname + ' Will average {:d} bursts'.format(nbursts))
-        burstavg['nburst'] = []
-        burstavg['t'] = []
-        for count,i in enumerate(range(sburst,nbursts)):
-            ind = self.data['Burst counter'] == i
-            indi = np.where(ind)[0]
-            t0 = self.t[indi[0]]
-            t1 = self.t[indi[-1]]
-            dt = t1 - t0
-            tb = t0 + dt / 2
-            #print(t0,dt)
-            burstavg['t'].append(tb)
-            burstavg['nburst'].append(sum(ind))
-            logger.debug('Averaging {:d} samples of burst {:d} between {:s} and {:s}'.format(sum(ind),i, str(t0), str(t1)))
-            for ivar, v in enumerate(varavg):
-                if count == 0:
-                    burstavg[v] = []
-
-                # This holds for vectors
-                if len(np.shape(self.data[v])) == 2:
-                    datatmp = self.data[v][ind,:]
-                    if c_threshold > 0:
-                        c1tmp = self.data['c1'][ind,:]
-                        c2tmp = self.data['c2'][ind,:]
-                        c3tmp = self.data['c3'][ind,:]                        
-                elif len(np.shape(self.data[v])) == 1:
-                    datatmp = self.data[v][ind]
-                    if c_threshold > 0:
-                        c1tmp = self.data['c1'][ind]
-                        c2tmp = self.data['c2'][ind]
-                        c3tmp = self.data['c3'][ind]
-
-                if c_threshold > 0 and (v != 'Pressure'):                
-                    indbad = (c1tmp <= c_threshold) & (c2tmp <= c_threshold) & (c3tmp <= c_threshold)
-                    #print(np.shape(indbad),np.shape(datatmp),np.shape(c1tmp),np.shape(c2tmp),np.shape(c3tmp))
-                    datatmp[indbad] = np.NaN
-                    dataavg = np.nanmean(datatmp,0)
-                else:
-                    dataavg = datatmp.mean(0)
-                    
-                burstavg[v].append(dataavg)
-
-
-            if True:
-                rotvel_vars = ['u', 'v', 'w']
-                for ivar, v in enumerate(rotvel_vars):
-                    if count == 0:
-                        burstavg_rotvel[v] = []
-
-                    datatmp = self.rotvel[v][ind, :]
-                    if c_threshold > 0:
-                        c1tmp = self.data['c1'][ind,:]
-                        c2tmp = self.data['c2'][ind,:]
-                        c3tmp = self.data['c3'][ind,:]
-                        indbad = (c1tmp <= c_threshold) & (c2tmp <= c_threshold) & (c3tmp <= c_threshold)
-                        #print(np.shape(indbad),np.shape(datatmp),np.shape(c1tmp),np.shape(c2tmp),np.shape(c3tmp))
-                        datatmp[indbad] = np.NaN
-                        dataavg = np.nanmean(datatmp,0)
-                        #print('dataavg')
-                    else:
-                        dataavg = datatmp.mean(0)                        
-                    
-                    burstavg_rotvel[v].append(dataavg)
+        burst, starts, counts, order = groups_from_labels(self.data['Burst counter'])
+        logger.info(funcname + ' Will average {:d} bursts'.format(len(burst)))
+        variables = {}
+        for v in varavg:
+            if v in self.data.keys():
+                variables[v] = self.data[v]
+            else:
+                logger.info('Variable {} not found'.format(v))
+
+        mask_variables = [v for v in variables.keys() if v != 'Pressure']
+        try:
+            for v in ['u','v','w']:
+                variables['rotvel_' + v] = self.rotvel[v]
+                mask_variables.append('rotvel_' + v)
+            flag_rotvel = True
+        except:
+            flag_rotvel = False
 
+        if c_threshold > 0:
+            masks = [self.data['c1'],self.data['c2'],self.data['c3']]
+        else:
+            masks = None
 
-                #dataavg = self.data[v][ind, :].mean(0)
+        groupstats = group_statistics(variables,starts,counts,order=order,stats=stats,masks=masks,
+                                      threshold=c_threshold,mask_variables=mask_variables,chunksize=chunksize)
 
-        # Make an array out of the lists
-        burstavg['t'] = np.asarray(burstavg['t'])
-        burstavg['nburst'] = np.asarray(burstavg['nburst'])
-        for ivar, v in enumerate(varavg):
-            burstavg[v] = np.asarray(burstavg[v])
+        t64 = self.t64[groupstats['first']] + (self.t64[groupstats['last']] - self.t64[groupstats['first']]) / 2
+        burstavg = {}
+        burstavg_rotvel = {}
+        burstavg['burst'] = burst
+        burstavg['nburst'] = counts
+        burstavg['t64'] = t64
+        burstavg['tu'] = (t64 - np.datetime64('1970-01-01T00:00:00','ns')) / np.timedelta64(1,'s')
+        burstavg['t'] = np.asarray(datetime_from_datetime64(t64,self.timezone),dtype=object)
+        for k in groupstats.keys():
+            if k.startswith('rotvel_'):
+                burstavg_rotvel[k.replace('rotvel_','',1)] = groupstats[k]
+            elif(k not in ['first','last']):
+                burstavg[k] = groupstats[k]
 
         self.data_burstavg = burstavg
-
-        if True:
-            for ivar, v in enumerate(rotvel_vars):
-                burstavg_rotvel[v] = np.asarray(burstavg_rotvel[v])
-                self.rotvel_burstavg = burstavg_rotvel
+        if flag_rotvel:
+            self.rotvel_burstavg = burstavg_rotvel
 
 
-    def repair_phase_shift(self,vel=None,threshold=None, save = False):
+    def repair_phase_shift(self,vel=None,threshold=None, save = False, updown=None, chunksize=2**16):
         """Tries to repair a phase shift in pulse coherent measurements. It
-        assumes that the first measured value is correct.
+        assumes that the first measured value is correct. Velocities in
+        XYZ or ENU coordinates are rotated into beam coordinates, repaired
+        and rotated back.
 
+        Args:
+            vel: A beam velocity array (N,) or (N,ncells), the velocities v1, v2, v3 if None
+            threshold: The ambiguity velocity, the vertical velocity range of the header if None
+            save: Save the repaired velocities as data['v1_rep'] etc
+            updown: Instrument pointing downward, from the header if None
+            chunksize: The number of samples processed at once
+        Return:
+            List of the repaired velocities
         """
-        
-        if(vel == None):
-            vel = self.data
+        if(threshold is None):
+            # Compute threshold from header data
+            threshold = self.header['Vertical velocity range']
+
+        if(vel is None):
             logger.debug('repairing native velocity')
             coordinate_system = self.header['Coordinate system']
             vel_all = [self.data['v1'],self.data['v2'],self.data['v3']]
         else:
+            coordinate_system = 'BEAM'
             vel_all = [vel]
-            
-        vel_rep_all = []
-        for vel_tmp in vel_all:
-        # Compute threshold from header data
-            if( coordinate_system == 'BEAM'):
-                logger.debug('Using thresholds for beam coordinates')
-                # Get the factor for the beam from the vertical velocity
-                fac = np.linalg.inv(self.header['Transformation matrix'])[0,2]
-                threshold_tmp = self.header['Vertical velocity range']# * fac
-            else:
-                logger.debug('Unknown threshold, returning')
-                return
-
-            vel_rep = np.zeros(np.shape(vel_tmp))
-            for i in range(np.shape(vel_rep)[1]):
-                vel_rep[:,i] = self.repair_phase_shift_vector(vel_tmp[:,i],threshold_tmp)
-                
-            vel_rep_all.append(vel_rep)
 
+        if( coordinate_system == 'BEAM'):
+            logger.debug('Using thresholds for beam coordinates')
+        else:
+            logger.debug('Repairing in beam coordinates, rotating from and to {}'.format(coordinate_system))
+            if(updown == None):
+                updown = self.header['updown']
+            T = beam_matrix(self.header['Transformation matrix'],updown)
+
+        dtype = float_dtype(vel_all[0].dtype)
+        vel_rep_all = [np.zeros(np.shape(v),dtype=dtype) for v in vel_all]
+        vel_prev = None # The last repaired sample of the previous chunk
+        nsamples = np.shape(vel_all[0])[0]
+        for i0 in range(0,nsamples,chunksize):
+            i1 = min(i0 + chunksize,nsamples)
+            vel_chunk = [v[i0:i1] for v in vel_all]
+            if( coordinate_system != 'BEAM'):
+                if( coordinate_system == 'ENU'):
+                    hpr = [self.data['Heading'][i0:i1],self.data['Pitch'][i0:i1],self.data['Roll'][i0:i1]]
+                else:
+                    hpr = None
+                vel_beam = [np.zeros(np.shape(v),dtype=dtype) for v in vel_chunk]
+                rotate(vel_chunk,rotation_matrix(coordinate_system,'BEAM',T,hpr),vel_beam)
+                vel_chunk = vel_beam
+
+            vel_rep = repair_phase_shift_array(np.stack(vel_chunk,axis=1),threshold,vel_prev)
+            vel_prev = vel_rep[-1]
+            vel_rep = [vel_rep[:,i] for i in range(len(vel_chunk))]
+            if( coordinate_system != 'BEAM'):
+                rotate(vel_rep,rotation_matrix('BEAM',coordinate_system,T,hpr),[v[i0:i1] for v in vel_rep_all])
+            else:
+                for v,v_rep in zip(vel_rep,vel_rep_all):
+                    v_rep[i0:i1] = v
 
-        print('hallo',vel is self.data)
-        if((vel is self.data) and save):
+        if((vel is None) and save):
             logger.debug("Saving data as data['v1_rep'] etc")
             self.data['v1_rep'] = vel_rep_all[0]
             self.data['v2_rep'] = vel_rep_all[1]
             self.data['v3_rep'] = vel_rep_all[2]
 
+        return vel_rep_all
+
 
     def repair_phase_shift_vector(self,vel,threshold):
         """Tries to repair a phase shift in pulse coherent measurements. It
         assumes that the first measured value is correct.
 
         """
-
-        vel_rep = vel.copy()
-
-        vthresh = threshold - 0.3 * threshold
-        for i in range(1,len(vel)):
-            if((np.sign(vel_rep[i-1]) != np.sign(vel_rep[i])) and (abs(vel_rep[i-1]) > vthresh) and (abs(vel_rep[i]) > vthresh)):
-               #print('Phase shift!')
-               dv = threshold - abs(vel_rep[i])
-               vel_rep[i] =  np.sign(vel_rep[i-1]) * (threshold + dv)
-
-        return vel_rep    
+        return repair_phase_shift_array(vel,threshold)
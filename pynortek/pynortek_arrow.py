@@ -0,0 +1,301 @@
+import numpy as np
+import logging
+import sys
+import os
+import json
+from .pynortek_zarr import zarr_dimension, json_attribute
+
+# Setup logging module
+logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
+logger = logging.getLogger('pynortek')
+
+# The file formats of the arrow_dataset, format:file extension
+arrow_formats = {'ipc':'.arrows','parquet':'.parquet'}
+
+
+class arrow_variable():
+    """ A column of an arrow_group with the netCDF4.Variable interface used
+    by the writers of pynortek_binary. The rows not yet written as a
+    record batch are kept in memory.
+    """
+    def __init__(self, group, name, dtype, dimensions, fill_value=None):
+        if((len(dimensions) != 1) or (not group.dimensions[dimensions[0]].isunlimited())):
+            raise ValueError('Only variables of one unlimited dimension can be exported to arrow, {:s}:{}'.format(name,dimensions))
+        object.__setattr__(self,'_group',group)
+        object.__setattr__(self,'name',name)
+        object.__setattr__(self,'dtype',np.dtype(dtype))
+        object.__setattr__(self,'dimensions',tuple(dimensions))
+        object.__setattr__(self,'_attrs',{})
+        object.__setattr__(self,'_data',np.zeros(0,dtype=self.dtype))
+        object.__setattr__(self,'_emitted',0) # The rows written as record batches
+        object.__setattr__(self,'_extent',0) # The rows written into the variable
+
+    def __setattr__(self, name, value):
+        self.setncattr(name,value)
+
+    def setncattr(self, name, value):
+        self._attrs[name] = json_attribute(value)
+
+    def getncattr(self, name):
+        return self._attrs[name]
+
+    def ncattrs(self):
+        return list(self._attrs.keys())
+
+    def __getattr__(self, name):
+        try:
+            return self._attrs[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __len__(self):
+        return len(self._group.dimensions[self.dimensions[0]])
+
+    def __setitem__(self, key, value):
+        value = np.asarray(value)
+        if(isinstance(key,slice)):
+            start = 0 if key.start is None else int(key.start)
+            stop = start + (len(value) if value.ndim > 0 else 1) if key.stop is None else int(key.stop)
+        else:
+            start, stop = int(key), int(key) + 1
+        if(start < self._emitted):
+            raise ValueError('Rows of {:s} already exported, arrow streams are written sequentially'.format(self.name))
+
+        if(len(self._data) < stop - self._emitted): # Grow the buffer
+            nnew = max(stop - self._emitted,2 * len(self._data)) - len(self._data)
+            object.__setattr__(self,'_data',np.concatenate((self._data,np.zeros(nnew,dtype=self.dtype))))
+        self._data[start - self._emitted:stop - self._emitted] = value
+        object.__setattr__(self,'_extent',max(self._extent,stop))
+        dim = self._group.dimensions[self.dimensions[0]]
+        dim.size = max(dim.size,stop)
+        self._group.emit()
+
+    def __getitem__(self, key):
+        nrows = len(self) - self._emitted
+        data = np.zeros(nrows,dtype=self.dtype)
+        n = min(nrows,len(self._data))
+        data[:n] = self._data[:n]
+        return np.ma.masked_array(data,mask=np.arange(nrows) >= self._extent - self._emitted)[key]
+
+    def pop(self, nrows):
+        """ Returns the next nrows as an arrow array, rows not written are null
+        """
+        import pyarrow
+        data = np.zeros(nrows,dtype=self.dtype)
+        n = min(nrows,len(self._data))
+        data[:n] = self._data[:n]
+        mask = np.arange(nrows) >= (self._extent - self._emitted)
+        object.__setattr__(self,'_data',self._data[nrows:].copy())
+        object.__setattr__(self,'_emitted',self._emitted + nrows)
+        return pyarrow.array(data,mask=mask if np.any(mask) else None)
+
+
+class arrow_group():
+    """ A group of an arrow_dataset, written as one arrow stream (or parquet
+    file) with the variables as columns. A record batch (row group) is
+    written when all columns have at least batchsize new rows.
+    """
+    def __init__(self, dataset, name, path):
+        object.__setattr__(self,'_dataset',dataset)
+        object.__setattr__(self,'name',name)
+        object.__setattr__(self,'path',path)
+        object.__setattr__(self,'_attrs',{})
+        object.__setattr__(self,'_writer',None)
+        object.__setattr__(self,'_schema',None)
+        object.__setattr__(self,'_sink',None)
+        object.__setattr__(self,'groups',{})
+        object.__setattr__(self,'dimensions',{})
+        object.__setattr__(self,'variables',{})
+
+    def __setattr__(self, name, value):
+        self.setncattr(name,value)
+
+    def setncattr(self, name, value):
+        self._attrs[name] = json_attribute(value)
+
+    def getncattr(self, name):
+        return self._attrs[name]
+
+    def ncattrs(self):
+        return list(self._attrs.keys())
+
+    def __getattr__(self, name):
+        try:
+            return self._attrs[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def createGroup(self, name):
+        path = name if self.path == '' else self.path + '_' + name
+        grp = arrow_group(self._dataset,name,path)
+        self.groups[name] = grp
+        return grp
+
+    def createDimension(self, name, size=None):
+        dim = zarr_dimension(name,size)
+        self.dimensions[name] = dim
+        return dim
+
+    def createVariable(self, name, dtype, dimensions=(), zlib=True, chunksizes=None, fill_value=None):
+        if(isinstance(dimensions,str)):
+            dimensions = (dimensions,)
+        var = arrow_variable(self,name,dtype,dimensions,fill_value=fill_value)
+        self.variables[name] = var
+        return var
+
+    def columns(self):
+        """ The exported variables, the coordinate variable of the dimension (count) is not written by bin2nc
+        """
+        return [v for v in self.variables.values() if v.name not in self.dimensions.keys()]
+
+    def schema(self):
+        """ The arrow schema of the group, the units and the other attributes
+        of the variables are the metadata of the fields, the attributes of
+        the dataset, the info group and the group the metadata of the schema
+        """
+        import pyarrow
+        fields = []
+        for var in self.columns():
+            metadata = {k:str(v) for k,v in var._attrs.items()}
+            fields.append(pyarrow.field(var.name,pyarrow.from_numpy_dtype(var.dtype),metadata=metadata))
+        metadata = {'group':self.path}
+        metadata.update({k:json.dumps(v) for k,v in self._dataset._attrs.items()})
+        if('info' in self._dataset.groups.keys()):
+            metadata.update({'info:' + k:json.dumps(v) for k,v in self._dataset.groups['info']._attrs.items()})
+        metadata.update({k:json.dumps(v) for k,v in self._attrs.items()})
+        return pyarrow.schema(fields,metadata=metadata)
+
+    def emit(self, final=False):
+        """ Writes the rows written into all columns as a record batch if
+        there are at least batchsize rows, with final all rows
+        """
+        columns = self.columns()
+        if(len(columns) == 0):
+            return
+        emitted = columns[0]._emitted
+        if final:
+            nrows = max([len(v) for v in columns]) - emitted
+        else:
+            nrows = min([v._extent for v in columns]) - emitted
+            if(nrows < self._dataset.batchsize):
+                return
+        if(nrows <= 0):
+            return
+
+        import pyarrow
+        if(self._writer is None):
+            self._dataset.open_writer(self)
+        batch = pyarrow.record_batch([v.pop(nrows) for v in columns],schema=self._schema)
+        self._dataset.write_batch(self,batch)
+
+    def close_variables(self):
+        self.emit(final=True)
+        for grp in self.groups.values():
+            grp.close_variables()
+        if(self._writer is not None):
+            self._writer.close()
+            if(self._sink is not None):
+                self._sink.flush()
+                if(self._sink is not sys.stdout.buffer):
+                    self._sink.close()
+
+
+class arrow_dataset(arrow_group):
+    """ Exports the groups written with the netCDF4.Dataset interface (see
+    output_backends of pynortek_binary) as arrow IPC streams or parquet
+    files, one per group (packet type), e.g. advfile_vel.arrows and
+    advfile_sys.arrows for advfile.arrows. The field names and units are
+    the ones of the netCDF variables (the convert_vector_* tables).
+    Record batches are written (and flushed) as soon as batchsize rows
+    are decoded, IPC streams can be read while the conversion is
+    running. With fname '-' the vel group is written as IPC stream to
+    stdout.
+
+    Usage:
+       >>>reader = pyarrow.ipc.open_stream('advfile_vel.arrows')
+       >>>for batch in reader: ...
+
+    Args:
+        format: 'ipc' or 'parquet', see arrow_formats
+        batchsize: The number of rows of a record batch (row group)
+        groups: The groups to be exported, all if None (['vel'] for stdout)
+    """
+    def __init__(self, fname, mode='w', format='ipc', batchsize=2**16, groups=None):
+        import pyarrow
+        if(mode != 'w'):
+            raise ValueError('arrow_dataset can only be written (mode w)')
+        if(format not in arrow_formats.keys()):
+            raise ValueError('Unknown format {}, one of {}'.format(format,list(arrow_formats.keys())))
+        if((fname == '-') and (format != 'ipc')):
+            raise ValueError('Only the ipc format can be written to stdout')
+        arrow_group.__init__(self,self,'/','')
+        object.__setattr__(self,'filepath',fname)
+        object.__setattr__(self,'format',format)
+        object.__setattr__(self,'batchsize',batchsize)
+        if((groups is None) and (fname == '-')):
+            groups = ['vel']
+        object.__setattr__(self,'export_groups',groups)
+
+    def stream_name(self, grp):
+        """ The name of the file of a group
+        """
+        base, ext = os.path.splitext(self.filepath)
+        if(ext == ''):
+            ext = arrow_formats[self.format]
+        return base + '_' + grp.path + ext
+
+    def open_writer(self, grp):
+        import pyarrow
+        schema = grp.schema()
+        object.__setattr__(grp,'_schema',schema)
+        if((self.export_groups is not None) and (grp.path not in self.export_groups)):
+            writer = null_writer(schema)
+        elif(self.filepath == '-'):
+            logger.info('Writing group {:s} to stdout'.format(grp.path))
+            writer = pyarrow.ipc.new_stream(sys.stdout.buffer,schema)
+            object.__setattr__(grp,'_sink',sys.stdout.buffer)
+        elif(self.format == 'parquet'):
+            import pyarrow.parquet
+            logger.info('Writing group {:s} to {:s}'.format(grp.path,self.stream_name(grp)))
+            writer = pyarrow.parquet.ParquetWriter(self.stream_name(grp),schema,compression='zstd')
+        else:
+            logger.info('Writing group {:s} to {:s}'.format(grp.path,self.stream_name(grp)))
+            sink = pyarrow.OSFile(self.stream_name(grp),'wb')
+            writer = pyarrow.ipc.new_stream(sink,schema)
+            object.__setattr__(grp,'_sink',sink)
+
+        object.__setattr__(grp,'_writer',writer)
+
+    def write_batch(self, grp, batch):
+        if(self.format == 'parquet'):
+            grp._writer.write_batch(batch,row_group_size=len(batch))
+        else:
+            grp._writer.write_batch(batch)
+            if(grp._sink is not None):
+                grp._sink.flush()
+
+    def sync(self):
+        pass
+
+    def close(self):
+        logger.debug('Closing arrow export ' + str(self.filepath))
+        self.close_variables()
+
+
+class null_writer():
+    """ Writer of the groups not exported
+    """
+    def __init__(self, schema):
+        pass
+
+    def write_batch(self, batch, **kwargs):
+        pass
+
+    def close(self):
+        pass
+
+
+def parquet_dataset(fname, mode='w', batchsize=2**16, groups=None):
+    """ An arrow_dataset writing parquet files
+    """
+    return arrow_dataset(fname,mode,format='parquet',batchsize=batchsize,groups=groups)
@@ -9,7 +9,9 @@ import re
 import struct
 import netCDF4
 import argparse
+import json
 import time
+import warnings
 
 # Get the version
 version_file = pkg_resources.resource_filename('pynortek','VERSION')
@@ -18,4 +20,211 @@ with open(version_file) as version_f:
 
 # Setup logging module
 logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
-logger = logging.getLogger('pynortek')
\ No newline at end of file
+logger = logging.getLogger('pynortek')
+
+
+def count_columns(fname):
+    """ Returns the number of columns of the first non empty line of a text file
+    """
+    with open(fname) as f:
+        for l in f:
+            if(len(l.split()) > 0):
+                return len(l.split())
+
+    return 0
+
+
+def loadtxt_blocks(fname, usecols = None, blocksize = 2**23):
+    """ Reads a whitespace separated ASCII file block wise, yields 2D
+    float64 arrays of consecutive rows of about blocksize bytes. Used for
+    the conversion into netCDF, the memory needed does not depend on the
+    size of the file.
+    """
+    with open(fname) as f:
+        while True:
+            lines = f.readlines(blocksize)
+            if(len(lines) == 0):
+                break
+            with warnings.catch_warnings(): # Blocks of empty lines
+                warnings.simplefilter('ignore',UserWarning)
+                data = np.loadtxt(lines,usecols=usecols,ndmin=2)
+            if(len(data) > 0):
+                yield data
+
+
+def loadtxt_ascii(fname, dtype = np.float64, usecols = None):
+    """ Loads a whitespace separated ASCII file (as exported by the
+    Nortek software) into a 2D array with the C parser of np.loadtxt
+    (numpy >= 1.23), see test/benchmark_ascii.py. Integer columns
+    written as floats (e.g. 12.000) are parsed as float64 and checked
+    against the range of dtype.
+
+    Args:
+       dtype: The dtype of the returned array
+       usecols: Index or list of indices of the columns to be read, all if None
+    Returns:
+       A (rows x columns) array
+    """
+    if(isinstance(usecols,int)):
+        usecols = [usecols]
+    elif(usecols is not None):
+        usecols = list(usecols)
+
+    logger.debug('loadtxt_ascii(): Loading {:s}'.format(fname))
+    dtype = np.dtype(dtype)
+    with warnings.catch_warnings(): # Empty files are reported below
+        warnings.simplefilter('ignore',UserWarning)
+        try:
+            data = np.loadtxt(fname,dtype=dtype,usecols=usecols,ndmin=2)
+        except ValueError:
+            if(not np.issubdtype(dtype,np.integer)):
+                raise
+            data = np.loadtxt(fname,usecols=usecols,ndmin=2)
+            if((len(data) > 0) and ((data.min() < np.iinfo(dtype).min) or (data.max() > np.iinfo(dtype).max))):
+                raise ValueError('Data of {:s} exceeds the range of {:s}'.format(fname,str(dtype)))
+            data = data.astype(dtype)
+
+    if(len(data) == 0):
+        raise ValueError('No data found in {:s}'.format(fname))
+
+    return data
+
+
+#
+# Cache of parsed ASCII deployments
+#
+cache_manifest = 'manifest.json'
+
+
+def file_stat(fname):
+    """ The size and modification time of fname, used to check if a cache entry is valid
+    """
+    st = os.stat(fname)
+    return {'size':st.st_size,'mtime':st.st_mtime}
+
+
+def header_to_json(obj):
+    """ Converts the datetime and numpy objects of a parsed header into json serializable objects
+    """
+    if(isinstance(obj,dict)):
+        return {k:header_to_json(obj[k]) for k in obj.keys()}
+    elif(isinstance(obj,list)):
+        return [header_to_json(o) for o in obj]
+    elif(isinstance(obj,datetime.datetime)): # Saved without timezone, added again when read
+        return {'__datetime__':obj.replace(tzinfo=None).isoformat()}
+    elif(isinstance(obj,np.ndarray)):
+        return {'__ndarray__':obj.tolist()}
+    elif(isinstance(obj,np.generic)):
+        return obj.item()
+    else:
+        return obj
+
+
+def header_from_json(obj, timezone = pytz.UTC):
+    """ Inverse of header_to_json
+    """
+    if(isinstance(obj,dict)):
+        if('__datetime__' in obj.keys()):
+            return datetime.datetime.fromisoformat(obj['__datetime__']).replace(tzinfo=timezone)
+        elif('__ndarray__' in obj.keys()):
+            return np.asarray(obj['__ndarray__'])
+        else:
+            return {k:header_from_json(obj[k],timezone) for k in obj.keys()}
+    elif(isinstance(obj,list)):
+        return [header_from_json(o,timezone) for o in obj]
+    else:
+        return obj
+
+
+def cache_read(cachedir):
+    """ Reads the manifest of the cache in cachedir
+
+    Returns:
+       The manifest or None if not existing or not readable
+    """
+    fname = os.path.join(cachedir,cache_manifest)
+    try:
+        with open(fname) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning('Could not read cache manifest {}: {}'.format(fname,e))
+        return None
+
+    if(manifest.get('version') != version):
+        logger.debug('Cache of version {} ignored'.format(manifest.get('version')))
+        return None
+
+    return manifest
+
+
+def cache_header(manifest, fname_hdr, timezone = pytz.UTC):
+    """ Returns the cached header if fname_hdr has not changed, otherwise None
+    """
+    if(manifest is None):
+        return None
+
+    try:
+        if(manifest['hdr'] == file_stat(fname_hdr)):
+            logger.debug('Using cached header of {}'.format(fname_hdr))
+            return header_from_json(manifest['header'],timezone)
+    except Exception as e:
+        logger.debug('Cached header not usable: {}'.format(e))
+
+    return None
+
+
+def cache_rawdata(manifest, cachedir, files):
+    """ Loads the cached arrays of all files (dictionary suffix:filename)
+    which have not changed since caching, memory mapped and read only
+
+    Returns:
+       Dictionary suffix:array
+    """
+    rawdata = {}
+    if(manifest is None):
+        return rawdata
+
+    for suffix in files.keys():
+        try:
+            entry = manifest['files'][suffix]
+            if(entry['stat'] == file_stat(files[suffix])):
+                rawdata[suffix] = np.load(os.path.join(cachedir,entry['npy']),mmap_mode='r')
+                logger.debug('Using cached data of {}'.format(files[suffix]))
+        except Exception as e:
+            logger.debug('No cached data of {}: {}'.format(files[suffix],e))
+
+    return rawdata
+
+
+def cache_write(cachedir, fname_hdr, header, files, rawdata, cached = ()):
+    """ Writes the header and the arrays in rawdata into the cache and updates the manifest
+
+    Args:
+       files: Dictionary suffix:filename of the source files
+       rawdata: Dictionary suffix:array of the arrays to be written, None entries are not cached
+       cached: The suffixes already in the cache, kept in the manifest
+    """
+    os.makedirs(cachedir,exist_ok=True)
+    manifest = {'version':version,'hdr':file_stat(fname_hdr),
+                'header':header_to_json(header),'files':{}}
+    for suffix in files.keys():
+        npy = os.path.split(files[suffix])[-1] + '.npy'
+        fname_npy = os.path.join(cachedir,npy)
+        if(suffix in cached):
+            pass
+        elif(rawdata.get(suffix) is None):
+            continue
+        else:
+            logger.debug('Caching {}'.format(files[suffix]))
+            with open(fname_npy + '.tmp','wb') as f:
+                np.save(f,rawdata[suffix])
+            os.replace(fname_npy + '.tmp',fname_npy)
+
+        manifest['files'][suffix] = {'fname':files[suffix],'stat':file_stat(files[suffix]),'npy':npy}
+
+    fname = os.path.join(cachedir,cache_manifest)
+    with open(fname + '.tmp','w') as f:
+        json.dump(manifest,f,indent=1)
+    os.replace(fname + '.tmp',fname)
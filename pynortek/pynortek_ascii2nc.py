@@ -0,0 +1,316 @@
+import numpy as np
+import logging
+import sys
+import pytz
+import os
+import time
+import argparse
+from .pynortek import pynortek, datetime64_from_columns, utc_offset, wave_burst_index, aquadopp_keys
+from .pynortek_ascii import version, count_columns, loadtxt_blocks, loadtxt_ascii
+from .pynortek_binary import create_netcdf, create_group, convert_vector_velocity, write_info
+
+# Setup logging module
+logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
+logger = logging.getLogger('pynortek')
+
+# The columns of the ASCII files (names as listed in the .hdr file) and
+# the variables of the bin2nc groups they are written to, together with
+# the factor converting the ASCII units into the units of the binary
+# data (see convert_vector_system_data and convert_vector_velocity)
+ascii_sys_columns = {'Month':['month',1],'Day':['day',1],'Year':['year',1],
+                     'Hour':['hour',1],'Minute':['minute',1],'Second':['second',1],
+                     'Error code':['err',1],'Status code':['stat',1],
+                     'Battery voltage':['bat',10],      # V -> 0.1 V
+                     'Soundspeed':['SndVel',10],        # m/s -> 0.1 m/s
+                     'Heading':['Hdg',10],              # deg -> 0.1 deg
+                     'Pitch':['Pitch',10],
+                     'Roll':['Roll',10],
+                     'Temperature':['T',100],           # deg C -> 0.01 deg C
+                     'Analog input':['AnaIn',1]}
+ascii_vel_columns = {'Burst counter':['burst',1],'Ensemble counter':['Count',1],
+                     'Velocity (Beam1|X|East)':['v1',1],'Velocity (Beam2|Y|North)':['v2',1],
+                     'Velocity (Beam3|Z|Up)':['v3',1],
+                     'Amplitude (Beam1)':['a1',1],'Amplitude (Beam2)':['a2',1],'Amplitude (Beam3)':['a3',1],
+                     'Correlation (Beam1)':['c1',1],'Correlation (Beam2)':['c2',1],'Correlation (Beam3)':['c3',1],
+                     'Pressure':['p',1000],             # dbar -> 0.001 dbar
+                     'Analog input 1':['AnaIn1',1],'Analog input 2':['AnaIn2',1]}
+# The columns of the .sen file of a profiler written into the vel group
+ascii_profile_sen_columns = {'Burst counter':['burst',1],'Ensemble counter':['Count',1],'Pressure':['p',1000]}
+# The status bits of the system data, name:[mask,shift]
+status_bits = {'stat_power_level':[0b11000000,6],'stat_wakeup_state':[0b00110000,4],
+               'stat_Roll':[0b00001000,3],'stat_Pitch':[0b00000100,2],
+               'stat_Scaling':[0b00000010,1],'stat_Orientation':[0b00000001,0]}
+date_columns = ['Month','Day','Year','Hour','Minute','Second']
+
+
+def unixtime(t64):
+    """ Converts a datetime64 array into seconds since 1970-01-01 (the time of the bin2nc groups)
+    """
+    return (t64 - np.datetime64('1970-01-01T00:00:00','ns')) / np.timedelta64(1,'s')
+
+
+def column_mapping(columns, column_map):
+    """ Returns a list of [index, variable, factor] of the columns (name:number
+    as in the parsed header) found in column_map
+    """
+    mapping = []
+    for name in columns.keys():
+        if(name in column_map.keys()):
+            mapping.append([columns[name] - 1] + column_map[name])
+        else:
+            logger.debug('Column {} has no netCDF variable, skipping'.format(name))
+
+    return mapping
+
+
+def write_columns(grp, mapping, block, n):
+    """ Writes the mapped columns of block into the variables of grp starting at row n
+    """
+    for ind, var, factor in mapping:
+        if(var not in grp.variables.keys()):
+            continue
+        data = block[:,ind] * factor
+        if(grp.variables[var].dtype.kind in 'iu'): # Integer data in binary units
+            data = np.round(data)
+        grp.variables[var][n:n+len(block)] = data
+
+
+def burst_samples(burst, burst_last = None, sample_last = -1):
+    """ Returns the sample number within the burst of every burst counter,
+    burst_last and sample_last are the counter and sample number of the
+    sample before burst (previous block)
+    """
+    ind = np.arange(len(burst))
+    change = np.ones(len(burst),dtype=bool)
+    change[1:] = burst[1:] != burst[:-1]
+    if(burst_last is not None) and (len(burst) > 0):
+        change[0] = burst[0] != burst_last
+    start = np.maximum.accumulate(np.where(change,ind,0))
+    sample = ind - start
+    if(len(burst) > 0) and (change[0] == False): # Burst continued from the previous block
+        nfirst = np.argmax(change) if np.any(change) else len(burst)
+        sample[:nfirst] += sample_last + 1
+
+    return sample
+
+
+def samplingrate_from_header(header):
+    """ Returns the sampling rate (Hz) found in the user setup of the header, None if not found
+    """
+    try:
+        return float(header['User setup']['Sampling rate'].split()[0])
+    except Exception:
+        return None
+
+
+def ascii2nc(filename, fname_nc, timezone = pytz.UTC, samplingrate = None, blocksize = 2**23, zlib = True):
+    """ Converts the ASCII export of a deployment into a netCDF file with
+    the group layout of bin2nc. The files are read and written block
+    wise, the memory needed does not depend on the size of the files.
+    The system data (.sen) is written to the sys group, the Vector data
+    (.dat) and the profiler data (.v1, .a1, ...) to the vel group,
+    profiler data has the additional dimension cell. The wave files are
+    not converted.
+
+    Args:
+       filename: The deployment name, i.e. the .hdr file without the suffix
+       fname_nc: Name of the netCDF file
+       timezone: The timezone of the instrument clock, the time in the netCDF file is UTC
+       samplingrate: Sampling rate (Hz) of the Vector velocities, taken from the header if None
+       blocksize: The number of bytes parsed at once
+    Returns:
+       A dictionary with the number of rows written per group
+    """
+    _tstart = time.time()
+
+    # Parses the header and finds the files, nothing is loaded in lazy mode
+    deployment = pynortek(filename,verbosity=logger.getEffectiveLevel(),timezone=timezone,lazy=True)
+    header = deployment.header
+    files = deployment.files
+    if(samplingrate is None):
+        samplingrate = samplingrate_from_header(header)
+
+    burst_sampling = header.get('Burst sampling',False)
+    profiler_keys = [k for k in aquadopp_keys if k in files.keys()]
+    dataset = create_netcdf(fname_nc,vel=False,imu=False)
+    dataset.history += '\n' + 'Converted from the ASCII export ' + deployment.filename_hdr
+    T = header.get('Transformation matrix')
+    write_info(dataset,{'device_type':'Vector' if 'dat' in files.keys() else 'Profiler',
+                        'coordinate_system':header.get('Coordinate system'),
+                        'samplingrate':samplingrate,
+                        'orientation':header.get('Orientation'),
+                        'vertical_velocity_range':header.get('Vertical velocity range'),
+                        'transformation_matrix':None if T is None else np.ravel(T)})
+    velgrp = None
+    rows = {}
+    if('dat' in files.keys()): # Vector
+        velgrp = create_group(dataset,convert_vector_velocity(None,units=True),'vel',zlib=zlib)
+    elif(len(profiler_keys) > 0): # Profiler
+        ncells = count_columns(files[profiler_keys[0]]) - (2 if burst_sampling else 0)
+        velgrp = create_profile_group(dataset,ncells,deployment.distance(),zlib=zlib)
+
+    if('sen' in files.keys()):
+        logger.info('Converting {}'.format(files['sen']))
+        profgrp = velgrp if ('dat' not in files.keys()) else None
+        rows['sys'] = sen2nc(dataset.groups['sys'],files['sen'],header['sensors'],timezone,profgrp,blocksize)
+
+    if('dat' in files.keys()):
+        logger.info('Converting {}'.format(files['dat']))
+        if(samplingrate is None):
+            raise ValueError('Sampling rate not found in the header, use the samplingrate argument')
+        burst_start = None
+        if('vhd' in files.keys()): # Burst sampling, the start time of the bursts
+            vhd = loadtxt_ascii(files['vhd'])
+            columns = header['velocity_header']
+            t64 = datetime64_from_columns(*[vhd[:,columns[k]-1] for k in date_columns])
+            burst_start = [vhd[:,columns['Burst counter']-1],unixtime(t64 - utc_offset(t64,timezone))]
+        rows['vel'] = dat2nc(velgrp,files['dat'],header['velocity_data'],samplingrate,header,
+                             timezone,burst_start,blocksize)
+
+    for key in profiler_keys:
+        logger.info('Converting {}'.format(files[key]))
+        usecols = None
+        if burst_sampling: # Skip the burst and ensemble counter
+            usecols = list(range(2,ncells + 2))
+        n = 0
+        for block in loadtxt_blocks(files[key],usecols=usecols,blocksize=blocksize):
+            velgrp.variables[key][n:n+len(block),:] = block
+            n += len(block)
+        rows['vel'] = n
+
+    dataset.close()
+    logger.info('Conversion took {:f} seconds.'.format(time.time() - _tstart))
+    return rows
+
+
+def create_profile_group(dataset, ncells, distance, zlib = True, chunkrows = 1024):
+    """ Creates the vel group of profiler data, the velocities, amplitudes and
+    correlations have the dimensions (count,cell)
+    """
+    conv_data = convert_vector_velocity(None,units=True)
+    package = {'units':{},'dtype':{}}
+    for key in ['Count','p','burst','burstsample']:
+        package['units'][key] = conv_data['units'][key]
+        package['dtype'][key] = conv_data['dtype'][key]
+
+    grp = create_group(dataset,package,'vel',zlib=zlib)
+    grp.createDimension('cell',ncells)
+    for key in aquadopp_keys:
+        var = grp.createVariable(key,conv_data['dtype'][key],('count','cell'),zlib=zlib,chunksizes=(chunkrows,ncells))
+        var.units = conv_data['units'][key]
+
+    if('dis_vertical' in distance.keys()):
+        var = grp.createVariable('dis_vertical','f',('cell'))
+        var.units = 'vertical distance of the cell centers from the head (m)'
+        var[:] = distance['dis_vertical']
+    if('dis_beam' in distance.keys()):
+        var = grp.createVariable('dis_beam','f',('cell'))
+        var.units = 'distance of the cell centers from the head along the beam (m)'
+        var[:] = distance['dis_beam']
+
+    return grp
+
+
+def sen2nc(sysgrp, fname, columns, timezone, profgrp = None, blocksize = 2**23):
+    """ Writes the system data of a .sen file into the sys group, and the
+    time, pressure and counters into profgrp (profiler)
+
+    Return:
+       The number of rows written
+    """
+    mapping = column_mapping(columns,ascii_sys_columns)
+    if(profgrp is not None):
+        mapping_prof = column_mapping(columns,ascii_profile_sen_columns)
+    ind_date = [columns[k] - 1 for k in date_columns]
+    ind_stat = columns.get('Status code')
+    n = 0
+    burst_last = None
+    sample_last = -1
+    for block in loadtxt_blocks(fname,blocksize=blocksize):
+        t64 = datetime64_from_columns(*[block[:,i] for i in ind_date])
+        tu = unixtime(t64 - utc_offset(t64,timezone))
+        sysgrp.variables['time'][n:n+len(block)] = tu
+        write_columns(sysgrp,mapping,block,n)
+        if(ind_stat is not None):
+            stat = block[:,ind_stat - 1].astype(np.int64)
+            for var, (mask, shift) in status_bits.items():
+                sysgrp.variables[var][n:n+len(block)] = (stat & mask) >> shift
+
+        if(profgrp is not None):
+            profgrp.variables['time'][n:n+len(block)] = tu
+            write_columns(profgrp,mapping_prof,block,n)
+            if('Burst counter' in columns.keys()):
+                burst = block[:,columns['Burst counter'] - 1]
+                sample = burst_samples(burst,burst_last,sample_last)
+                profgrp.variables['burstsample'][n:n+len(block)] = sample
+                burst_last = burst[-1]
+                sample_last = sample[-1]
+
+        n += len(block)
+
+    return n
+
+
+def dat2nc(velgrp, fname, columns, samplingrate, header, timezone = pytz.UTC, burst_start = None, blocksize = 2**23):
+    """ Writes the velocity data of a Vector .dat file into the vel group.
+    The time is the start time of the burst (burst_start, [burst counters,
+    unix time] of the .vhd file) or the time of the first measurement
+    (continous sampling) plus the sample number divided by the sampling rate
+
+    Return:
+       The number of rows written
+    """
+    mapping = column_mapping(columns,ascii_vel_columns)
+    dt = 1 / samplingrate
+    if(burst_start is None):
+        tfirst = header['Time of first measurement'].replace(tzinfo=None)
+        t64 = np.asarray([np.datetime64(tfirst,'ns')])
+        tfirst = unixtime(t64 - utc_offset(t64,timezone))[0]
+    n = 0
+    burst_last = None
+    sample_last = -1
+    for block in loadtxt_blocks(fname,blocksize=blocksize):
+        burst = block[:,columns['Burst counter'] - 1]
+        sample = burst_samples(burst,burst_last,sample_last)
+        burst_last = burst[-1]
+        sample_last = sample[-1]
+        if(burst_start is None):
+            tu = tfirst + np.arange(n,n + len(block)) * dt
+        else:
+            tu = burst_start[1][wave_burst_index(burst_start[0],burst)] + sample * dt
+
+        velgrp.variables['time'][n:n+len(block)] = tu
+        velgrp.variables['burstsample'][n:n+len(block)] = sample
+        write_columns(velgrp,mapping,block,n)
+        n += len(block)
+
+    return n
+
+
+def asc2nc():
+    """ A function call for a command line based conversion of the ASCII export of a deployment to a netCDF file. Basically a wrapper for ascii2nc
+    """
+    in_help         = 'The deployment name, i.e. the .hdr file with or without the suffix'
+    nc_help         = 'Name of the netCDF output file (typically deployment.nc)'
+    tz_help         = 'The timezone of the instrument clock, e.g. Europe/Berlin (default UTC)'
+    fs_help         = 'The sampling rate (Hz) of the Vector velocities, taken from the header if not given'
+    blocksize_help  = 'The number of bytes read at once'
+    parser = argparse.ArgumentParser(description='Convert the ASCII export of a Nortek deployment into a netCDF file')
+    parser.add_argument('--version', action='version', version='%(prog)s ' + version)
+    parser.add_argument('--timezone', default='UTC', help=tz_help)
+    parser.add_argument('--samplingrate', type=float, help=fs_help)
+    parser.add_argument('--blocksize', type=float, default=2**23, help=blocksize_help)
+    parser.add_argument('filename',help=in_help)
+    parser.add_argument('filename_nc',help=nc_help)
+    args = parser.parse_args()
+
+    filename = args.filename
+    if(filename.lower().endswith('.hdr')):
+        filename = filename[:-4]
+
+    if(os.path.isfile(args.filename_nc)):
+        logger.info('Target nc file is existing, will quit now')
+        return
+
+    ascii2nc(filename,args.filename_nc,timezone=pytz.timezone(args.timezone),
+             samplingrate=args.samplingrate,blocksize=int(args.blocksize))
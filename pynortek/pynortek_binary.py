@@ -10,6 +10,12 @@ import struct
 import netCDF4
 import argparse
 import time
+import json
+import cProfile
+import tracemalloc
+from .pynortek_overview import overview_writer, overview_variables
+from .pynortek_zarr import zarr_dataset
+from .pynortek_arrow import arrow_dataset, parquet_dataset
 
 # Get the version
 version_file = pkg_resources.resource_filename('pynortek','VERSION')
@@ -183,8 +189,13 @@ def convert_vector_vectrino_probe_check(data,apply_unit_factor = False, scaling
     #print('End Vectir velocity header')    
 
 
-def convert_vector_IMU(data,apply_unit_factor = False,units = False, scaling = 1.0,burst_info = 0):
+# The fields of the IMU package decoded together
+imu_delta_fields = set(['DeltaAngleX','DeltaAngleY','DeltaAngleZ','DeltaVelX','DeltaVelY','DeltaVelZ'])
+imu_orientation_fields = set(['M11','M12','M13','M21','M22','M23','M31','M32','M33','pitch','roll','yaw'])
+
+def convert_vector_IMU(data,apply_unit_factor = False,units = False, scaling = 1.0,burst_info = 0,fields = None):
     """ Converts binary data in a vector velocity data structure
+    fields: The fields needed, the delta angles/velocities, the orientation matrix and pitch/roll/yaw are only decoded if needed, all if None
     """
     conv_data = {}
     if units:
@@ -240,32 +251,26 @@ def convert_vector_IMU(data,apply_unit_factor = False,units = False, scaling = 1
     
     conv_data['EnsCnt'] = data[4]
     conv_data['AHRSId'] = data[5]
-    conv_data['DeltaAngleX'] = struct.unpack('<f', data[6:10])[0] # Little endian
-    conv_data['DeltaAngleY'] = struct.unpack('<f', data[10:14])[0] # Little endian
-    conv_data['DeltaAngleZ'] = struct.unpack('<f', data[14:18])[0] # Little endian
-    conv_data['DeltaVelX'] = struct.unpack('<f', data[18:22])[0] # Little endian
-    conv_data['DeltaVelY'] = struct.unpack('<f', data[22:26])[0] # Little endian
-    conv_data['DeltaVelZ'] = struct.unpack('<f', data[26:30])[0] # Little endian
-    conv_data['M11']   = struct.unpack('<f', data[30:34])[0] # Little endian
-    conv_data['M12']   = struct.unpack('<f', data[34:38])[0] # Little endian
-    conv_data['M13']   = struct.unpack('<f', data[38:42])[0] # Little endian
-    conv_data['M21']   = struct.unpack('<f', data[42:46])[0] # Little endian
-    conv_data['M22']   = struct.unpack('<f', data[46:50])[0] # Little endian
-    conv_data['M23']   = struct.unpack('<f', data[50:54])[0] # Little endian
-    conv_data['M31']   = struct.unpack('<f', data[54:58])[0] # Little endian
-    conv_data['M32']   = struct.unpack('<f', data[58:62])[0] # Little endian
-    conv_data['M33']   = struct.unpack('<f', data[62:66])[0] # Little endian
-    conv_data['pitch'] = np.arcsin(conv_data['M13'])/2/np.pi*360
-    conv_data['roll']  = np.arctan2(conv_data['M23'],conv_data['M33'])/2/np.pi*360
-    conv_data['yaw']   = np.arctan2(conv_data['M12'],conv_data['M11'])/2/np.pi*360
+    if((fields is None) or (not imu_delta_fields.isdisjoint(fields))):
+        delta = struct.unpack('<6f', data[6:30]) # Little endian
+        for key, value in zip(['DeltaAngleX','DeltaAngleY','DeltaAngleZ','DeltaVelX','DeltaVelY','DeltaVelZ'],delta):
+            conv_data[key] = value
+    if((fields is None) or (not imu_orientation_fields.isdisjoint(fields))):
+        M = struct.unpack('<9f', data[30:66]) # Little endian
+        for key, value in zip(['M11','M12','M13','M21','M22','M23','M31','M32','M33'],M):
+            conv_data[key] = value
+        conv_data['pitch'] = np.arcsin(conv_data['M13'])/2/np.pi*360
+        conv_data['roll']  = np.arctan2(conv_data['M23'],conv_data['M33'])/2/np.pi*360
+        conv_data['yaw']   = np.arctan2(conv_data['M12'],conv_data['M11'])/2/np.pi*360
     conv_data['timer'] = struct.unpack('<i', data[66:70])[0] # Little endian
     conv_data['burst_num']         = burst_info[0]
     conv_data['burst_sample']      = burst_info[1]
     conv_data['burst_startdate']   = burst_info[2]    
     return conv_data
 
-def convert_vector_velocity(data,apply_unit_factor = False,units = False, scaling = 1.0,burst_info = 0):
+def convert_vector_velocity(data,apply_unit_factor = False,units = False, scaling = 1.0,burst_info = 0,fields = None):
     """ Converts binary data in a vector velocity data structure
+    fields: The fields needed, the velocities are only decoded if one of v1, v2, v3 is in fields, all if None
     """
     #print('Vector velocity data')
     #print(data)
@@ -310,9 +315,11 @@ def convert_vector_velocity(data,apply_unit_factor = False,units = False, scalin
     conv_data['AnaIn2'] = data[2] + 256 * data[5]
     conv_data['AnaIn1'] = data[8] + 256 * data[9]
     conv_data['p']      = data[4] * 65536 + data[7] * 256 + data[6] # [0.001 dbar]
-    conv_data['v1']     = struct.unpack('<h', data[10:12])[0] * scaling
-    conv_data['v2']     = struct.unpack('<h', data[12:14])[0] * scaling
-    conv_data['v3']     = struct.unpack('<h', data[14:16])[0] * scaling
+    if((fields is None) or ('v1' in fields) or ('v2' in fields) or ('v3' in fields)):
+        v1, v2, v3 = struct.unpack('<hhh', data[10:16])
+        conv_data['v1']     = v1 * scaling
+        conv_data['v2']     = v2 * scaling
+        conv_data['v3']     = v3 * scaling
     conv_data['a1']     = data[16] # amplitude beam1 (counts)
     conv_data['a2']     = data[17] # amplitude beam2 (counts)
     conv_data['a3']     = data[18] # amplitude beam3 (counts)
@@ -509,14 +516,41 @@ nortek_packages = [package_aquadopp_velocity,
 
 
 
-def convert_bin(data, apply_unit_factor = False, statistics = True, burst_num=0,burst_sample=0,burstIMU_sample=0,burst_startdate=0):
+def create_metrics():
+    """Creates a dictionary for the timing and counters of a conversion,
+    see bin2nc and convert_bin
+    """
+    metrics = {}
+    # Cumulative time in seconds of the conversion stages
+    metrics['time'] = {'time_range':0.0,'read':0.0,'scan':0.0,'checksum':0.0,'decode':0.0,
+                       'timestamp':0.0,'netcdf':0.0,'logfile':0.0,'total':0.0}
+    metrics['bytes_read']        = 0
+    metrics['packages']          = {} # Number of packages per type
+    metrics['bytes']             = {} # Number of bytes per package type
+    metrics['checksum_failures'] = {} # Number of checksum failures per package type
+    metrics['resync_skips']      = 0 # Number of times the package sync was lost
+    metrics['resync_bytes']      = 0 # Number of bytes skipped while searching for packages
+    return metrics
+
+
+def convert_bin(data, apply_unit_factor = False, statistics = True, burst_num=0,burst_sample=0,burstIMU_sample=0,burst_startdate=0,metrics=None,decode=None,fields=None,decimate=1):
     """ Converts a binary data stream into a list of packages (dictionaries)
     offset: The offset of the binary data given with respect to the whole datastream
+    metrics: A dictionary created with create_metrics(), updated with the time spent in scanning, checksum calculation and decoding and the package counters
+    decode: The names of the packages to be decoded (e.g. ['Vec sys','Vec vel']), the other packages are skipped (not returned), all if None
+    fields: Dictionary of package name:list of fields passed to the convert functions of Vec vel and IMU, see convert_vector_velocity
+    decimate: Only every decimate-th sample (within a burst) of the Vec vel and IMU packages is decoded, the others are returned as {'decimated':True} packages with the burst information (needed for the timestamps)
     """
     scaling = np.nan # The scaling of the data (depends on the status bit in the system package
     conv_data_all = []
     i = 0
     ilast = 0 # Index after of the last found package
+    FLAG_METRICS = metrics is not None
+    if FLAG_METRICS:
+        _tstart = time.perf_counter()
+        _tchecksum = 0.0
+        _tdecode = 0.0
+        _iskip = None # Start of bytes not belonging to a package
     if(statistics):
         statistic_dict = {}
         statistic_dict['packages'] = []
@@ -547,33 +581,80 @@ def convert_bin(data, apply_unit_factor = False, statistics = True, burst_num=0,
 
                 if((i+psize) < len(data)): # Do we have enough data for the package?
                     data_package = data[i:i+psize]
-
+                    FLAG_SKIP = (decode is not None) and (package['name'] not in decode)
+                    FLAG_DECIMATED = False
+                    if(decimate > 1):
+                        if(package['name'] == 'Vec vel'):
+                            FLAG_DECIMATED = (burst_sample % decimate) != 0
+                        elif(package['name'] == 'IMU'):
+                            FLAG_DECIMATED = (burstIMU_sample % decimate) != 0
+
+                    if FLAG_METRICS:
+                        _t0 = time.perf_counter()
+                    FLAG_CHECKSUM=True
+                    if((FLAG_SKIP == False) and (FLAG_DECIMATED == False)):
+                        checksum = int.from_bytes(data[i+psize-2:i+psize], byteorder='little')
+                        checksum_calc = calc_checksum(data[i:i+psize-2])
+                        FLAG_CHECKSUM=False
+                        if(checksum == checksum_calc):
+                            FLAG_CHECKSUM=True
+
+                    if FLAG_METRICS:
+                        _t1 = time.perf_counter()
+                        _tchecksum += _t1 - _t0
+                        name = package['name']
+                        metrics['packages'][name] = metrics['packages'].get(name,0) + 1
+                        metrics['bytes'][name] = metrics['bytes'].get(name,0) + psize
+                        if(FLAG_CHECKSUM == False):
+                            metrics['checksum_failures'][name] = metrics['checksum_failures'].get(name,0) + 1
+                        if(_iskip is not None): # Found a package after skipping bytes
+                            metrics['resync_skips'] += 1
+                            metrics['resync_bytes'] += i - _iskip
+                            _iskip = None
                         
-                    checksum = int.from_bytes(data[i+psize-2:i+psize], byteorder='little')
-                    checksum_calc = calc_checksum(data[i:i+psize-2])
-                    FLAG_CHECKSUM=False
-                    if(checksum == checksum_calc):
-                        FLAG_CHECKSUM=True
-
+                    # Skipped packages, only the sample counters are updated
+                    if FLAG_SKIP:
+                        if(package['name'] == 'Vec vel'):
+                            burst_sample += 1
+                        elif(package['name'] == 'IMU'):
+                            burstIMU_sample += 1
+                        if(statistics):
+                            statistic_dict['packages'].append([i,i+psize,npi,None])
+                            statistic_dict['package_num'][npi] += 1
+                        i = i+psize
+                        ilast = i
+                        FOUND_PACKAGE = True
+                        break
 
-                        
-                        
                     # Convert the data and update sample counters
                     if package['function'] is not None:
                         # Add the burst to the velocity package
                         if(package['name'] == 'Vec vel'):
-                            conv_data = package['function'](data_package, apply_unit_factor = apply_unit_factor, scaling = scaling, burst_info = [burst_num,burst_sample,burst_startdate])
+                            if FLAG_DECIMATED:
+                                conv_data = {'decimated':True,'burst_num':burst_num,'burst_sample':burst_sample,'burst_startdate':burst_startdate}
+                            elif(fields is None):
+                                conv_data = package['function'](data_package, apply_unit_factor = apply_unit_factor, scaling = scaling, burst_info = [burst_num,burst_sample,burst_startdate])
+                            else:
+                                conv_data = package['function'](data_package, apply_unit_factor = apply_unit_factor, scaling = scaling, burst_info = [burst_num,burst_sample,burst_startdate], fields = fields.get(package['name']))
                             burst_sample += 1
                         elif(package['name'] == 'IMU'):
-                            conv_data = package['function'](data_package, apply_unit_factor = apply_unit_factor, scaling = scaling, burst_info = [burst_num,burstIMU_sample,burst_startdate])
+                            if FLAG_DECIMATED:
+                                conv_data = {'decimated':True,'burst_num':burst_num,'burst_sample':burstIMU_sample,'burst_startdate':burst_startdate}
+                            elif(fields is None):
+                                conv_data = package['function'](data_package, apply_unit_factor = apply_unit_factor, scaling = scaling, burst_info = [burst_num,burstIMU_sample,burst_startdate])
+                            else:
+                                conv_data = package['function'](data_package, apply_unit_factor = apply_unit_factor, scaling = scaling, burst_info = [burst_num,burstIMU_sample,burst_startdate], fields = fields.get(package['name']))
                             burstIMU_sample += 1                           
                         else:
                             conv_data = package['function'](data_package, apply_unit_factor = apply_unit_factor, scaling = scaling)
 
                     else:
-                        print('No function available for package:' + package['name'])
+                        logger.warning('No function available for package:' + package['name'])
                         conv_data = None
 
+                    if FLAG_METRICS:
+                        _tdecode += time.perf_counter() - _t1
+
                     # New burst
                     if(package['name'] == 'Vector velocity header'):
                         burst_num += 1 # The burst number
@@ -619,8 +700,17 @@ def convert_bin(data, apply_unit_factor = False, statistics = True, burst_num=0,
                     break
                 
         if(FOUND_PACKAGE == False): # Try next byte
+            if(FLAG_METRICS and (_iskip is None)):
+                _iskip = i
             i += 1
 
+    if FLAG_METRICS:
+        # Skipped bytes at the end of the data are scanned again with the next chunk
+        _tall = time.perf_counter() - _tstart
+        metrics['time']['checksum'] += _tchecksum
+        metrics['time']['decode'] += _tdecode
+        metrics['time']['scan'] += _tall - _tchecksum - _tdecode
+
     ret_dict = {'packages':conv_data_all, 'ilast':ilast,'data_rest':data[ilast:],'burst_num':burst_num,'burst_sample':burst_sample,'burstIMU_sample':burstIMU_sample,'burst_startdate':burst_startdate}
     if(statistics):
         ret_dict['statistics'] = statistic_dict
@@ -684,7 +774,7 @@ def add_timestamp(packages,num_dates = 2):
                         date_vel = date0 + itmp * datetime.timedelta(seconds=dt_vel)
                         packages[iv]['date'] = date_vel
                 else:
-                    print('Time difference too big')
+                    logger.warning('Time difference too big')
 
 
                     
@@ -742,25 +832,60 @@ def add_timestamp_sys(packages,samplingrate,burst_sample=-10e6,burstIMU_sample=-
     return {'packages':packages,'timeinfo':[date_sys,burst_sample,burstIMU_sample]}
 
 
-def create_netcdf(fname, vel=True, imu=True):
+# The output backends of create_netcdf, a function or class returning a
+# dataset with the netCDF4.Dataset interface used by the writers
+# (createGroup, createDimension, createVariable, slice writes of the
+# variables, attributes). Additional backends can be added
+output_backends = {'netcdf':netCDF4.Dataset,'zarr':zarr_dataset,'arrow':arrow_dataset,'parquet':parquet_dataset}
+
+def create_netcdf(fname, vel=True, imu=True, layout='flat', samplesperburst=0, samplingrate=1.0, backend='netcdf', groups=None, variables=None, decimate=1):
+    """Creates the netCDF file and the groups of the data
+    Arguments:
+       groups: The groups to be created (sys, vel, imu), all if None (vel and imu only if the vel and imu flags are set)
+       variables: The variables of the groups (time is always created), all if None
+       layout: 'flat' (the vel and imu variables have the dimension count) or 'burst' (dimensions burst and sample, see create_burst_group)
+       samplesperburst, samplingrate: The size of the sample dimension and the sampling rate of the burst layout
+       backend: The output format, one of output_backends ('netcdf', 'zarr', 'arrow' or 'parquet')
+       decimate: The decimation of the burst layout, see create_burst_group
+    """
     logger.info('Creating netcdf with IMU:' + str(imu))
     zlib = True # compression
-    dataset = netCDF4.Dataset(fname, 'w')
+    dataset = output_backends[backend](fname, 'w')
     dataset.history = str(datetime.datetime.now()) + ': Pynortek version ' + version
     grpinfo = dataset.createGroup('info')
     conv_data = convert_vector_system_data(None,units = True)    
-    sysgrp = create_group(dataset,conv_data,'sys')
+    if(groups is not None):
+        vel = vel and ('vel' in groups)
+        imu = imu and ('imu' in groups)
+    if((groups is None) or ('sys' in groups)):
+        sysgrp = create_group(dataset,conv_data,'sys',variables=variables)
     if vel:    
         conv_data = convert_vector_velocity(None,units = True)
-        create_group(dataset,conv_data,'vel')
+        if(layout == 'burst'):
+            create_burst_group(dataset,conv_data,'vel',samplesperburst,samplingrate,variables=variables,decimate=decimate)
+        else:
+            create_group(dataset,conv_data,'vel',variables=variables)
     if imu:
         conv_data = convert_vector_IMU(None,units = True)    
-        imugrp = create_group(dataset,conv_data,'imu',time=True)        
+        if(layout == 'burst'):
+            imugrp = create_burst_group(dataset,conv_data,'imu',samplesperburst,samplingrate,variables=variables,decimate=decimate)
+        else:
+            imugrp = create_group(dataset,conv_data,'imu',time=True,variables=variables)        
 
     return dataset
 
-def create_group(dataset,package,group_name,zlib = True,time=True):
+def write_info(dataset,info):
+    """Writes the configuration of the instrument (e.g. the coordinate
+    system) as attributes of the info group, None values are skipped
+    """
+    grpinfo = dataset.groups['info']
+    for key in info.keys():
+        if(info[key] is not None):
+            grpinfo.setncattr(key,info[key])
+
+def create_group(dataset,package,group_name,zlib = True,time=True,variables=None):
     """Creates a group for a specific datatype into the dataset
+    variables: The variables to be created, all variables of package if None
     """
     grp = dataset.createGroup(group_name)
     grp.createDimension('count', 0)
@@ -774,192 +899,183 @@ def create_group(dataset,package,group_name,zlib = True,time=True):
             pass
         else:
             dtype = package['dtype'][key]
-            if(dtype is not None):
-                logger.info('Creating variable with type',key,dtype)
+            if((dtype is not None) and ((variables is None) or (key in variables))):
+                logger.info('Creating variable {} with type {}'.format(key,dtype))
                 varnc = grp.createVariable(key, dtype, ('count'),zlib=zlib)
                 unit = package['units'][key]
                 varnc.units = unit
 
     return grp        
 
-def add_packages_to_netcdf(dataset,packages):
+def create_burst_group(dataset,package,group_name,samplesperburst,samplingrate,zlib = True,nbursts_chunk = None,variables = None,decimate = 1):
+    """Creates a group for a specific datatype with the variables as
+    (burst,sample) arrays, bursts with less samples are padded with
+    the fill value. The time of the samples is the start time of the
+    burst (time) plus the time since the start (sample_time), the
+    number of samples of the bursts is in nsamples.
+    Arguments:
+       nbursts_chunk: The number of bursts in a storage chunk, about 4096 samples if None
+       variables: The variables to be created, all variables of package if None
+       decimate: Only every decimate-th sample of a burst is stored, the sample dimension has samplesperburst/decimate samples
+    """
+    nsample = (samplesperburst + decimate - 1) // decimate
+    if(nbursts_chunk is None):
+        nbursts_chunk = max(1,4096 // nsample)
+
+    grp = dataset.createGroup(group_name)
+    grp.layout = 'burst'
+    grp.decimate = decimate
+    grp.createDimension('burst', 0)
+    grp.createDimension('sample', nsample)
+    varnc = grp.createVariable('burst', 'i', ('burst'),zlib=zlib)
+    varnc.units = package['units']['burst']
+    varnc = grp.createVariable('nsamples', 'i', ('burst'),zlib=zlib)
+    varnc.units = 'The number of samples of the burst'
+    varnc = grp.createVariable('time', 'd', ('burst'),zlib=zlib)
+    varnc.units = 'seconds since 1970-01-01 00:00:00'
+    varnc.long_name = 'start time of the burst'
+    varnc = grp.createVariable('sample_time', 'd', ('sample'))
+    varnc.units = 's'
+    varnc.long_name = 'time since the start of the burst'
+    varnc[:] = np.arange(nsample) * decimate / samplingrate
+    for key in package['units'].keys():
+        dtype = package['dtype'][key]
+        if((dtype is not None) and (key not in ['burst','burstsample']) and ((variables is None) or (key in variables))):
+            logger.info('Creating variable {} with type {}'.format(key,dtype))
+            # The fill value is set explicitly, so that readers mask the padding
+            varnc = grp.createVariable(key, dtype, ('burst','sample'),zlib=zlib,chunksizes=(nbursts_chunk,nsample),
+                                       fill_value=netCDF4.default_fillvals[np.dtype(dtype).str[1:]])
+            varnc.units = package['units'][key]
+
+    return grp
+
+def add_bursts_to_netcdf(grp,data,t,burst,sample):
+    """Writes the samples into a group created by create_burst_group
+    Arguments:
+       data: Dictionary of the variables, lists of the samples
+       t: The time of the samples (seconds since 1970)
+       burst, sample: The burst number and the sample number within the burst of the samples
+    Samples of a decimated group (see create_burst_group) are stored at sample/decimate.
+    """
+    burst = np.asarray(burst,dtype=np.int64)
+    sample = np.asarray(sample,dtype=np.int64)
+    decimate = int(grp.getncattr('decimate')) if ('decimate' in grp.ncattrs()) else 1
+    t = np.asarray(t,dtype=np.float64)
+    if(len(burst) == 0):
+        return
+    nbursts = len(grp.dimensions['burst'])
+    nsample = len(grp.dimensions['sample'])
+    sample_time = grp.variables['sample_time'][:]
+    if(nbursts == 0):
+        burst_first = burst.min()
+    else:
+        burst_first = int(grp.variables['burst'][0])
+
+    rows = burst - burst_first
+    keep = (sample >= 0) & (sample // decimate < nsample) & (rows >= 0) & ((sample % decimate) == 0)
+    if(np.any(~keep)):
+        logger.warning('{:d} samples outside of the burst layout, not written'.format(np.sum(~keep)))
+
+    arrays = {k:np.asarray(data[k])[keep] for k in data.keys()}
+    rows = rows[keep]
+    sample = sample[keep] // decimate
+    t = t[keep]
+    # Runs of consecutive samples of the same burst are written at once
+    newrun = np.ones(len(rows),dtype=bool)
+    newrun[1:] = (rows[1:] != rows[:-1]) | (sample[1:] != sample[:-1] + 1)
+    starts = np.flatnonzero(newrun)
+    ends = np.append(starts[1:],len(rows))
+    for i0, i1 in zip(starts,ends):
+        row = rows[i0]
+        s0 = sample[i0]
+        s1 = sample[i1-1] + 1
+        for k in arrays.keys():
+            grp.variables[k][row,s0:s1] = arrays[k][i0:i1]
+
+        if(row >= len(grp.dimensions['burst'])):
+            nsamples = s1
+        else:
+            nsamples = max(s1,np.ma.filled(grp.variables['nsamples'][row],0))
+        grp.variables['nsamples'][row] = nsamples
+        grp.variables['burst'][row] = row + burst_first
+        grp.variables['time'][row] = t[i0] - sample_time[s0]
+
+# The groups of the sample packages
+package_groups = {'Vec vel':'vel','IMU':'imu'}
+# The package keys of the variables calculated by pynortek
+package_keys = {'burst':'burst_num','burstsample':'burst_sample'}
+
+def package_columns(grp):
+    """The variables of a group filled from the packages, the time and the
+    variables of the burst layout (burst, nsamples, sample_time) are
+    written separately
+    """
+    if('sample' in grp.dimensions.keys()): # The burst layout
+        return [k for k in grp.variables.keys() if grp.variables[k].dimensions == ('burst','sample')]
+    else:
+        return [k for k in grp.variables.keys() if k not in ['count','time']]
+
+def add_packages_to_netcdf(dataset,packages,overview=None):
+    """Writes the packages into the groups of the dataset, packages of
+    groups and variables not in the dataset (see create_netcdf) are skipped
+    """
     #for grp in rootgrp.groups:
-    velgrp = dataset.groups['vel']
-    # Velocity veriables
-    tvel_tmp = []    
-    v1_tmp = []
-    v2_tmp = []
-    v3_tmp = []
-    a1_tmp = []
-    a2_tmp = []
-    a3_tmp = []
-    c1_tmp = []
-    c2_tmp = []
-    c3_tmp = []
-    burst_tmp = []
-    burstsample_tmp = []        
-    Count_tmp = []    
-    ana1_tmp = []
-    ana2_tmp = []
-    p_tmp = []
-    # IMU
-    timu_tmp = []        
-    EnsCnt_tmp  = []
-    AHRSId_tmp  = []
-    DeltaAngleX_tmp  = []
-    DeltaAngleY_tmp = []
-    DeltaAngleZ_tmp = []
-    DeltaVelX_tmp = []
-    DeltaVelY_tmp = []
-    DeltaVelZ_tmp = []
-    M11_tmp = []
-    M12_tmp = []
-    M13_tmp = []
-    M21_tmp = []
-    M22_tmp = []
-    M23_tmp = []
-    M31_tmp = []
-    M32_tmp = []
-    M33_tmp = []
-    pitch_tmp = []
-    yaw_tmp = []
-    roll_tmp = []
-    imutimer_tmp = []
-    burstIMU_tmp = []
-    burstsampleIMU_tmp = []            
-    
+    sysgrp = dataset.groups.get('sys')
+    # The lists of the variables of the vel and IMU group, the time and the burst information
+    columns = {}
+    for name, group in package_groups.items():
+        if(group in dataset.groups.keys()):
+            keys = package_columns(dataset.groups[group])
+            columns[name] = {k:[] for k in keys + ['time','burst_num','burst_sample'] if k not in package_keys.keys()}
+
     for i,p in enumerate(packages):
         if(p['name'] == 'Vec sys'): # Vector system data
             #print('Vector system')
-            sysgrp = dataset.groups['sys']
+            if(sysgrp is None):
+                continue
             n = len(sysgrp.variables['count'])
             #print('Length sysgrp',n)
             ttmp = netCDF4.date2num(p['date'],sysgrp.variables['time'].units)
             sysgrp.variables['time'][n] = ttmp            
             for key in p.keys():
                 if( (type(p[key]) == int) or (type(p[key]) == float) ):
-                    var = sysgrp.variables[key]
-                    var[n] = p[key]
-                
-                  
-        if(p['name'] == 'Vec vel'): # Velocity
+                    if(key in sysgrp.variables.keys()):
+                        var = sysgrp.variables[key]
+                        var[n] = p[key]
+
+        elif(p['name'] in columns.keys()): # Velocity and IMU
             #print(i)
+            cols = columns[p['name']]
             try:
-                p['date']
-                HAS_DATE = True                
-            except:
-                HAS_DATE = False
-
-            if HAS_DATE:
-                ttmp = netCDF4.date2num(p['date'],velgrp.variables['time'].units)
-            else:
+                ttmp = netCDF4.date2num(p['date'],dataset.groups[package_groups[p['name']]].variables['time'].units)
+            except KeyError:
                 #print('No Date')                
                 ttmp = -9999
 
-            #print(ttmp,p['v1'])
-            tvel_tmp.append(ttmp)
-            v1_tmp.append(p['v1'])
-            v2_tmp.append(p['v2'])
-            v3_tmp.append(p['v3'])
-            a1_tmp.append(p['a1'])
-            a2_tmp.append(p['a2'])
-            a3_tmp.append(p['a3'])
-            c1_tmp.append(p['c1'])
-            c2_tmp.append(p['c2'])
-            c3_tmp.append(p['c3'])
-            burst_tmp.append(p['burst_num'])
-            burstsample_tmp.append(p['burst_sample'])                        
-            Count_tmp.append(p['Count'])            
-            ana1_tmp.append(p['AnaIn1'])
-            ana2_tmp.append(p['AnaIn2'])
-            p_tmp.append(p['p'])
-        if(p['name'] == 'IMU'): # IMU
-            #print(i)
-            imugrp = dataset.groups['imu']            
-            try:
-                p['date']
-                HAS_DATE = True                
-            except:
-                HAS_DATE = False
+            for key in cols.keys():
+                if(key == 'time'):
+                    cols[key].append(ttmp)
+                else:
+                    cols[key].append(p[key])
 
-            if HAS_DATE:
-                ttmp = netCDF4.date2num(p['date'],imugrp.variables['time'].units)
-            else:
-                #print('No Date')                
-                ttmp = -9999            
-
-            timu_tmp.append(ttmp)        
-            EnsCnt_tmp.append(p['EnsCnt'])
-            AHRSId_tmp.append(p['AHRSId'])
-            DeltaAngleX_tmp.append(p['DeltaAngleX'])
-            DeltaAngleY_tmp.append(p['DeltaAngleY'])
-            DeltaAngleZ_tmp.append(p['DeltaAngleZ'])
-            DeltaVelX_tmp.append(p['DeltaVelX'])
-            DeltaVelY_tmp.append(p['DeltaVelY'])
-            DeltaVelZ_tmp.append(p['DeltaVelZ'])
-            M11_tmp.append(p['M11'])
-            M12_tmp.append(p['M12'])
-            M13_tmp.append(p['M13'])
-            M21_tmp.append(p['M21'])
-            M22_tmp.append(p['M22'])
-            M23_tmp.append(p['M23'])
-            M31_tmp.append(p['M31'])
-            M32_tmp.append(p['M32'])
-            M33_tmp.append(p['M33'])
-            pitch_tmp.append(p['pitch'])
-            yaw_tmp.append(p['yaw'])
-            roll_tmp.append(p['roll'])
-            imutimer_tmp.append(p['timer'])
-            burstIMU_tmp.append(p['burst_num'])
-            burstsampleIMU_tmp.append(p['burst_sample'])                                    
-
-    # Fill the velocities
-    n = len(velgrp.variables['count'])
-    nn = len(v1_tmp) + n
-    velgrp.variables['time'][n:nn] = tvel_tmp    
-    velgrp.variables['v1'][n:nn] = v1_tmp
-    velgrp.variables['v2'][n:nn] = v2_tmp
-    velgrp.variables['v3'][n:nn] = v3_tmp
-    velgrp.variables['a1'][n:nn] = a1_tmp
-    velgrp.variables['a2'][n:nn] = a2_tmp
-    velgrp.variables['a3'][n:nn] = a3_tmp
-    velgrp.variables['c1'][n:nn] = c1_tmp
-    velgrp.variables['c2'][n:nn] = c2_tmp
-    velgrp.variables['c3'][n:nn] = c3_tmp
-    velgrp.variables['burst'][n:nn] = burst_tmp
-    velgrp.variables['burstsample'][n:nn] = burstsample_tmp        
-    velgrp.variables['Count'][n:nn] = Count_tmp    
-    velgrp.variables['AnaIn1'][n:nn] = ana1_tmp
-    velgrp.variables['AnaIn2'][n:nn] = ana2_tmp
-    velgrp.variables['p'][n:nn] = p_tmp
-    # If we have IMU data
-    if(len(AHRSId_tmp)>0):
-        n = len(imugrp.variables['count'])        
-        nn = len(DeltaAngleX_tmp) + n
-        imugrp.variables['time'][n:nn] = timu_tmp    
-        imugrp.variables['EnsCnt'][n:nn] = EnsCnt_tmp
-        imugrp.variables['AHRSId'][n:nn] = AHRSId_tmp
-        imugrp.variables['DeltaAngleX'][n:nn] = DeltaAngleX_tmp
-        imugrp.variables['DeltaAngleY'][n:nn] = DeltaAngleY_tmp
-        imugrp.variables['DeltaAngleZ'][n:nn] = DeltaAngleZ_tmp
-        imugrp.variables['DeltaVelX'][n:nn] = DeltaVelX_tmp
-        imugrp.variables['DeltaVelY'][n:nn] = DeltaVelY_tmp
-        imugrp.variables['DeltaVelZ'][n:nn] = DeltaVelZ_tmp
-        imugrp.variables['timer'][n:nn] = imutimer_tmp
-        imugrp.variables['M11'][n:nn]   = M11_tmp
-        imugrp.variables['M12'][n:nn]   = M12_tmp
-        imugrp.variables['M13'][n:nn]   = M13_tmp
-        imugrp.variables['M21'][n:nn]   = M21_tmp
-        imugrp.variables['M22'][n:nn]   = M22_tmp
-        imugrp.variables['M23'][n:nn]   = M23_tmp
-        imugrp.variables['M31'][n:nn]   = M31_tmp
-        imugrp.variables['M32'][n:nn]   = M32_tmp
-        imugrp.variables['M33'][n:nn]   = M33_tmp
-        imugrp.variables['pitch'][n:nn] = pitch_tmp 
-        imugrp.variables['roll'][n:nn]  = roll_tmp 
-        imugrp.variables['yaw'][n:nn]   = yaw_tmp
-        imugrp.variables['burst'][n:nn] = burstIMU_tmp
-        imugrp.variables['burstsample'][n:nn] = burstsampleIMU_tmp                
+    for name, cols in columns.items():
+        grp = dataset.groups[package_groups[name]]
+        if(len(cols['time']) == 0):
+            continue
+
+        # The min/max/mean decimation levels
+        if(overview is not None):
+            overview.add(package_groups[name],cols['time'],cols)
+
+        if('sample' in grp.dimensions.keys()): # The burst layout
+            data = {k:cols[k] for k in cols.keys() if k not in ['time','burst_num','burst_sample']}
+            add_bursts_to_netcdf(grp,data,cols['time'],cols['burst_num'],cols['burst_sample'])
+        else:
+            n = len(grp.variables['count'])
+            nn = len(cols['time']) + n
+            grp.variables['time'][n:nn] = cols['time']
+            for key in package_columns(grp):
+                grp.variables[key][n:nn] = cols[package_keys.get(key,key)]
 
 def print_user_config(usr_cfg,device='vector'):
     print('Sampling mode: ' + usr_cfg['sampling_mode'])
@@ -983,7 +1099,7 @@ def find_time_range(fname):
     been found as well as the first and last time package
     """
     fsize = os.path.getsize(fname)    
-    print(fname,'size',fsize)
+    logger.info('{:s} size {:d}'.format(fname,fsize))
     f = open(fname,'rb')    
     chunk = 4096*10
     package_tmp  = [] 
@@ -1060,16 +1176,105 @@ def find_time_range(fname):
     return ret_data
 
 
+def next_dated_package(f, pos, fsize, packages, chunk = 4096*10):
+    """Returns the offset and the date of the first package of packages
+    (fixed size packages with a date, e.g. package_vector_sytem) with a
+    valid checksum at or after pos
+    Returns:
+       [offset,date], [None,None] if no package was found
+    """
+    while(pos < fsize):
+        f.seek(pos)
+        data = f.read(chunk)
+        found = None
+        for package in packages:
+            sync = package['sync'] + package['id']
+            psize = package['size']
+            i = data.find(sync)
+            while((i >= 0) and (i + psize <= len(data))):
+                checksum = int.from_bytes(data[i+psize-2:i+psize], byteorder='little')
+                if(checksum == calc_checksum(data[i:i+psize-2])):
+                    if((found is None) or (i < found[0])):
+                        found = [i,package]
+                    break
+                i = data.find(sync,i+1)
+
+        if(found is not None):
+            i, package = found
+            conv_data = package['function'](data[i:i+package['size']])
+            return [pos + i,conv_data['date']]
+        if(len(data) < chunk):
+            break
+        pos += chunk - 64 # Packages at the border are found in the next chunk
+
+    return [None,None]
+
+
+def find_offset(fname, date, packages = None, chunk = 4096*10):
+    """Finds the offset of a package before date by bisection of the
+    file with the times of the sys packages (or the velocity headers
+    in burst mode). The packages between the offset and date are
+    less than chunk bytes.
+    Arguments:
+       packages: The packages used, [package_vector_sytem] if None
+    Returns:
+       The offset of a package with a date before date, 0 if date is before the first package
+    """
+    if(packages is None):
+        packages = [package_vector_sytem]
+    fsize = os.path.getsize(fname)
+    lo = 0
+    hi = fsize
+    with open(fname,'rb') as f:
+        while((hi - lo) > chunk):
+            mid = (lo + hi) // 2
+            offset, date_package = next_dated_package(f,mid,fsize,packages,chunk)
+            if((offset is None) or (offset >= hi) or (date_package >= date)):
+                hi = mid
+            else:
+                lo = offset
+
+    return lo
+
+
+def select_packages(packages, start = None, end = None):
+    """Removes the decimated packages (see convert_bin) and the packages
+    with a date outside of [start,end]
+    """
+    packages_sel = []
+    for p in packages:
+        if('decimated' in p.keys()):
+            continue
+        if('date' in p.keys()):
+            if((start is not None) and (p['date'] < start)):
+                continue
+            if((end is not None) and (p['date'] > end)):
+                continue
+        packages_sel.append(p)
+
+    return packages_sel
+
+
 #def bin2nc(fnames_in,fname_nc,chunksize = 4096*2000, nbytes=None):
-def bin2nc(fnames_in,fname_nc,chunksize = 4096*2000, nbytes=None, logfile=True):
+def bin2nc(fnames_in,fname_nc,chunksize = 4096*2000, nbytes=None, logfile=True, layout='flat', overview=None, backend='netcdf', groups=None, variables=None, start=None, end=None, decimate=1):
     """ Converts binary files to a netCDF
     Arguments:
        chunksize: The number of bytes read at once
        nbytes: The number of bytes to be read from file
+       layout: 'flat' or 'burst' (vel and imu as (burst,sample) arrays, burst mode only), see create_netcdf
+       overview: Writes min/max/mean decimation levels of the velocities, pressure, amplitudes, correlations and IMU attitude into the overview group, True for the default levels or a list of levels, see overview_writer
+       backend: 'netcdf', 'zarr' (a zarr store with the groups and variables of the netCDF file, chunks are compressed and written in parallel), 'arrow' (an arrow IPC stream per group, fname_nc '-' for the vel group to stdout) or 'parquet' (a parquet file per group), see output_backends
+       groups: The groups to be written (sys, vel, imu), all if None, packages of other groups are not decoded
+       variables: The variables to be written (e.g. ['v1','v2','v3','p']), all if None, groups without any of the variables are not written
+       start, end: The time window (datetime) to be written, the files are read from a sys package (velocity header in burst mode) before start, found by bisection, and are read until end
+       decimate: Only every decimate-th sample of the vel and imu group (within a burst) is decoded and written
+    Returns:
+       A dictionary with the time spent in the conversion stages and package counters, see create_metrics()
     """
 
 
     _tstart = time.time()    
+    metrics = create_metrics()
     date_ranges = []
     date_first = []
     packages_read = 0
@@ -1085,7 +1290,9 @@ def bin2nc(fnames_in,fname_nc,chunksize = 4096*2000, nbytes=None, logfile=True):
 
     # Find the time range of all files and the configuration
     for fname in fnames_in:
+        _t0 = time.perf_counter()
         drange = find_time_range(fname)
+        metrics['time']['time_range'] += time.perf_counter() - _t0
         date_ranges.append(drange)
         date_first.append(drange['first'])
         logger.info(drange['fname'] + ':' + str(drange['first']) + ' - ' + str(drange['last']))
@@ -1118,12 +1325,57 @@ def bin2nc(fnames_in,fname_nc,chunksize = 4096*2000, nbytes=None, logfile=True):
         logger.fatal('At the moment only Vector binary files a supported, exiting now.')
         return
 
+    # The selection of groups and variables, packages of groups not written are not decoded
+    groups_write = ['sys','vel','imu'] if groups is None else list(groups)
+    if(variables is not None):
+        tables = {'sys':convert_vector_system_data(None,units = True),'vel':convert_vector_velocity(None,units = True),
+                  'imu':convert_vector_IMU(None,units = True)}
+        for group in list(groups_write):
+            if(not any([v in tables[group]['units'].keys() for v in variables])):
+                logger.info('Group {:s} has none of the variables {}, not written'.format(group,variables))
+                groups_write.remove(group)
+    decode = None
+    fields = None
+    if((groups is not None) or (variables is not None)):
+        decode = ['Vec sys','Vector velocity header'] # Needed for the timestamps
+        if('vel' in groups_write):
+            decode.append('Vec vel')
+        if('imu' in groups_write):
+            decode.append('IMU')
+        logger.info('Writing groups {}, decoding packages {}'.format(groups_write,decode))
+    if(variables is not None):
+        fields = {'Vec vel':variables,'IMU':variables}
+    SAVE_VEL = (decode is None) or ('Vec vel' in decode) # Packages are written up to the last velocity package with a timestamp
+    if(decimate > 1):
+        logger.info('Decimating the vel and imu data by {:d}'.format(decimate))
+
     #print_user_config(user_cfg)
     HAS_DATA = True # TODO: Here we can check if we have valid data (i.e. datasets and the same headers/heads/sensors
     if(HAS_DATA):
         # Create netCDF file
-        logger.info('Creating netcdf file: ' + fname_nc)
-        dataset = create_netcdf(fname_nc,imu=HAS_IMU)
+        logger.info('Creating {:s} file: {:s}'.format(backend,fname_nc))
+        _t0 = time.perf_counter()
+        if((layout == 'burst') and (samplesperburst == 0)):
+            logger.warning('Burst layout needs burst sampling, using the flat layout')
+            layout = 'flat'
+        if((layout == 'burst') and (backend in ['arrow','parquet'])):
+            logger.warning('The {:s} export is a table per group, using the flat layout'.format(backend))
+            layout = 'flat'
+        dataset = create_netcdf(fname_nc,imu=HAS_IMU,layout=layout,samplesperburst=samplesperburst,samplingrate=samplingrate,backend=backend,
+                                groups=groups_write,variables=variables,decimate=decimate)
+        write_info(dataset,{'device_type':device_type,'coordinate_system':user_cfg['coordinate_system'],
+                            'samplingrate':samplingrate,'samplesperburst':samplesperburst,
+                            'MeasInterval':user_cfg['MeasInterval'],'layout':layout})
+        ov = None
+        if(overview is not None) and (overview is not False):
+            ovvariables = {}
+            for group in overview_variables.keys():
+                if(group in dataset.groups.keys()):
+                    ovvariables[group] = [k for k in overview_variables[group] if k in dataset.groups[group].variables.keys()]
+            ov = overview_writer(dataset,levels=None if overview is True else overview,
+                                 variables={k:v for k,v in ovvariables.items() if len(v) > 0})
+            logger.info('Writing overview levels {}'.format(ov.levels))
+        metrics['time']['netcdf'] += time.perf_counter() - _t0
         if(logfile): # Creating logfiles 
             logger.info('Opening a logfile')
             fstat = open(fname_nc + '.log','w')
@@ -1140,19 +1392,38 @@ def bin2nc(fnames_in,fname_nc,chunksize = 4096*2000, nbytes=None, logfile=True):
     # Sort the datasets and read them in in the correct order
     ind_sorted = np.argsort(date_first)
     bytes_read_total = 0
+    WINDOW_END = False # The end of the time window was reached
     for ind_sort in ind_sorted:
         fname = date_ranges[ind_sort]['fname']
         fsize = date_ranges[ind_sort]['fsize'] # file size
+        if(((start is not None) and (date_ranges[ind_sort]['last'] < start)) or ((end is not None) and (date_ranges[ind_sort]['first'] > end))):
+            logger.info('Skipping {:s}, outside of the time window'.format(fname))
+            continue
+        if WINDOW_END:
+            break
+        fstart = 0 # The offset the file is read from
+        if((start is not None) and (date_ranges[ind_sort]['first'] < start)):
+            _t0 = time.perf_counter()
+            if(timestampmode == 'burst'): # The burst start is needed for the timestamps
+                fstart = find_offset(fname,start,[package_vector_velocity_header])
+            else:
+                fstart = find_offset(fname,start,[package_vector_sytem])
+            metrics['time']['time_range'] += time.perf_counter() - _t0
+            logger.info('Time window starts at byte {:d} of {:s}'.format(fstart,fname))
         logger.info('Opening:' + fname)
         f = open(fname,'rb')
+        f.seek(fstart)
         chunk = chunksize
         package_all  = []
         package_tmp  = []
         bytes_read = 0        
         i = 0
         while True:
-            offset = i * chunk
+            offset = fstart + i * chunk
+            _t0 = time.perf_counter()
             data = f.read(chunk)
+            metrics['time']['read'] += time.perf_counter() - _t0
+            metrics['bytes_read'] += len(data)
             bytes_read += len(data)            
             bytes_read_total += len(data)
             #if i > 10:
@@ -1166,7 +1437,8 @@ def bin2nc(fnames_in,fname_nc,chunksize = 4096*2000, nbytes=None, logfile=True):
                 data = package_data['data_rest'] + data
 
             # Convert the data
-            package_data     = convert_bin(data,statistics = True,burst_num=burst_num,burst_sample=burst_sample,burstIMU_sample=burstIMU_sample,burst_startdate=burst_startdate)
+            package_data     = convert_bin(data,statistics = True,burst_num=burst_num,burst_sample=burst_sample,burstIMU_sample=burstIMU_sample,burst_startdate=burst_startdate,metrics=metrics,
+                                           decode=decode,fields=fields,decimate=decimate)
             burst_num        = package_data['burst_num'] # update the bursts
             burst_sample     = package_data['burst_sample'] # update the bursts
             burstIMU_sample  = package_data['burstIMU_sample'] # update the bursts
@@ -1183,6 +1455,7 @@ def bin2nc(fnames_in,fname_nc,chunksize = 4096*2000, nbytes=None, logfile=True):
                 pass
             # Writing the data to logfile
             if logfile:
+                _t0 = time.perf_counter()
                 for k in range(len(package_data['statistics']['packages'])):
                     packnum = package_data['statistics']['packages'][k][2]
                     binoff  = package_data['statistics']['packages'][k][0]
@@ -1197,11 +1470,14 @@ def bin2nc(fnames_in,fname_nc,chunksize = 4096*2000, nbytes=None, logfile=True):
                     fstr = '{:010d} {:010d} {:s} {:s}\n'.format(packages_read + k,binoff + offset, packname,dstr)
                     fstat.write(fstr)
 
+                metrics['time']['logfile'] += time.perf_counter() - _t0
+
             packages_read   += len(package_data['statistics']['packages'])
             
             package_tmp.extend(package_data['packages'])
             HAVETIME = False
             if(len(package_tmp)>0):
+                _t0 = time.perf_counter()
                 if timestampmode == 'burst':
                     package_tmp = add_timestamp_burst(package_tmp, samplingrate)
                 if timestampmode == 'sys':
@@ -1232,8 +1508,10 @@ def bin2nc(fnames_in,fname_nc,chunksize = 4096*2000, nbytes=None, logfile=True):
                             break
 
 
+                metrics['time']['timestamp'] += time.perf_counter() - _t0
                 # Writing a timestamp debug file
                 if logfile:
+                    _t0 = time.perf_counter()
                     for p in package_tmp:
                         try:
                             dstr = p['name'] + '\t ' + str(p['date'])
@@ -1242,22 +1520,34 @@ def bin2nc(fnames_in,fname_nc,chunksize = 4096*2000, nbytes=None, logfile=True):
 
                         dstr += '\n'
                         ftime.write(dstr)
+
+                    metrics['time']['logfile'] += time.perf_counter() - _t0
                         
                 # Adding the packages to netcdf
-                for isave in range(len(package_tmp)-1,-1,-1): # Put only datasets with timestamp
-                    p = package_tmp[isave]
-                    if(p['name'] == 'Vec vel'): # A time stamp package            
-                        try:
-                            p['date']
-                            break
-                        except:
-                            pass
+                if(SAVE_VEL):
+                    for isave in range(len(package_tmp)-1,-1,-1): # Put only datasets with timestamp
+                        p = package_tmp[isave]
+                        if(p['name'] == 'Vec vel'): # A time stamp package            
+                            try:
+                                p['date']
+                                break
+                            except:
+                                pass
+                else: # No velocity packages decoded, the timestamps of the sys and IMU packages are complete
+                    isave = len(package_tmp)
                         
                 if(isave > 0):
                     package_save = package_tmp[:isave]
                     package_tmp  = package_tmp[isave:]
+                    if((decimate > 1) or (start is not None) or (end is not None)):
+                        if(end is not None):
+                            dates = [p['date'] for p in package_save if 'date' in p.keys()]
+                            WINDOW_END = (len(dates) > 0) and (max(dates) > end)
+                        package_save = select_packages(package_save,start,end)
                     logger.info('Packages read {:010d}, writing to nc'.format(packages_read))
-                    add_packages_to_netcdf(dataset,package_save)
+                    _t0 = time.perf_counter()
+                    add_packages_to_netcdf(dataset,package_save,overview=ov)
+                    metrics['time']['netcdf'] += time.perf_counter() - _t0
                     logger.info('nc write done')
 
 
@@ -1265,11 +1555,14 @@ def bin2nc(fnames_in,fname_nc,chunksize = 4096*2000, nbytes=None, logfile=True):
             # Only read part of the dataset
             if(nbytes is not None):
                 if(bytes_read_total >= nbytes):
-                    print('Number of bytes read threshold reached')
+                    logger.info('Number of bytes read threshold reached')
                     break
-            if(bytes_read_total >= fsize):
-                print('End of file reached')
+            if((fstart + bytes_read) >= fsize):
+                logger.info('End of file reached')
                 break                
+            if WINDOW_END:
+                logger.info('End of the time window reached')
+                break
             #if(len(data) < chunk):
             #    print('too small for chunk')
             #    break
@@ -1278,16 +1571,25 @@ def bin2nc(fnames_in,fname_nc,chunksize = 4096*2000, nbytes=None, logfile=True):
         logger.info('Closing file')
         f.close()
         
+    _t0 = time.perf_counter()
+    if(ov is not None):
+        ov.close()
     dataset.close()
-    if True: # Close statistics file
+    metrics['time']['netcdf'] += time.perf_counter() - _t0
+    if logfile: # Close statistics file
         fstat.close()
 
-    if True: # Close statistics file
+    if logfile: # Close statistics file
         ftime.close()        
 
     _tdone = time.time()
     dt_nc = _tdone - _tstart
     logger.info('Conversion took {:f} seconds.'.format(dt_nc))
+    metrics['time']['total'] = dt_nc
+    for stage in metrics['time'].keys():
+        logger.info('Stage {:s}: {:f} seconds'.format(stage,metrics['time'][stage]))
+
+    return metrics
 
 
 def vecinfo(fnames_in):
@@ -1315,14 +1617,38 @@ def vec2nc():
     nbytes_help     = 'Read only number of bytes of the total length of all datasets'
     logfile_help    = 'Creates logfiles containing the data packages found in the binary file and the calculated time of the velocity and IMU packages'    
     info_help       = 'Prints useful information about files'
+    profile_help    = 'Writes the time spent in the conversion stages and the package counters as json into the given file'
+    cprofile_help   = 'Profiles the conversion with cProfile, the statistics are written into PROFILE.prof (needs --profile)'
+    tracemalloc_help= 'Traces memory allocations with tracemalloc, the largest allocations are written into PROFILE.tracemalloc.txt (needs --profile)'
+    layout_help     = 'flat: vel and imu data as one series (default), burst: as (burst,sample) arrays (burst mode only)'
+    backend_help    = 'netcdf: a netCDF4 file (default), zarr: a zarr store with the same groups and variables, written in parallel, arrow: an arrow IPC stream per group (filename_nc - writes the vel group to stdout), parquet: a parquet file per group'
+    groups_help     = 'Comma separated list of the groups to be written (sys,vel,imu), packages of the other groups are not decoded'
+    vars_help       = 'Comma separated list of the variables to be written (e.g. v1,v2,v3,p), groups without any of the variables are not written'
+    start_help      = 'Start of the time window to be written (ISO format, e.g. 2020-01-01T12:00:00), the file is read from a sys package before start'
+    end_help        = 'End of the time window to be written (ISO format)'
+    decimate_help   = 'Writes only every DECIMATE-th sample (within a burst) of the vel and imu group'
+    overview_help   = 'Writes min/max/mean decimation levels (by 64, 4096 and 262144 samples) of the velocities, pressure, amplitudes, correlations and IMU attitude into the overview group'
     parser = argparse.ArgumentParser(description='Convert a Nortek .VEC file binary Vector file into netCDF file')
     parser.add_argument('--version', action='version', version='%(prog)s ' + version)
     parser.add_argument('--nbytes', help=nbytes_help)
     parser.add_argument('--info', action='store_true', help=info_help)
     parser.add_argument('--logfile', action='store_true', help=logfile_help)    
+    parser.add_argument('--profile', help=profile_help)
+    parser.add_argument('--cprofile', action='store_true', help=cprofile_help)
+    parser.add_argument('--tracemalloc', action='store_true', help=tracemalloc_help)
+    parser.add_argument('--layout', default='flat', choices=['flat','burst'], help=layout_help)
+    parser.add_argument('--overview', action='store_true', help=overview_help)
+    parser.add_argument('--groups', help=groups_help)
+    parser.add_argument('--vars', help=vars_help)
+    parser.add_argument('--start', type=datetime.datetime.fromisoformat, help=start_help)
+    parser.add_argument('--end', type=datetime.datetime.fromisoformat, help=end_help)
+    parser.add_argument('--decimate', type=int, default=1, help=decimate_help)
+    parser.add_argument('--backend', default='netcdf', choices=list(output_backends.keys()), help=backend_help)
     parser.add_argument('filename_bin',nargs='+',help=in_help)
     parser.add_argument('filename_nc',help=nc_help)        
     args = parser.parse_args()
+    if((args.cprofile or args.tracemalloc) and (args.profile is None)):
+        parser.error('--cprofile and --tracemalloc need --profile')
 
     filename_bin = args.filename_bin
     filename_nc = args.filename_nc
@@ -1336,6 +1662,15 @@ def vec2nc():
     else:
         nbytes = None
 
+    # The selection of groups, variables and the time window
+    groups = None
+    if(args.groups is not None):
+        groups = args.groups.split(',')
+    variables = None
+    if(args.vars is not None):
+        variables = args.vars.split(',')
+    selection = {'groups':groups,'variables':variables,'start':args.start,'end':args.end,'decimate':args.decimate}
+
     # Just print information
     if(args.info):
         vecinfo(filename_bin)
@@ -1345,9 +1680,38 @@ def vec2nc():
         logger.info('Will write logfiles')
 
     if(filename_nc is not None):
-        if(os.path.isfile(filename_nc) ):
+        if(os.path.exists(filename_nc) ):
             logger.info('Target nc file is existing, will quit now')
             return
 
         logger.info('Start converting file(s)')
-        bin2nc(filename_bin,filename_nc,nbytes = nbytes,logfile=args.logfile)
+        if(args.profile is None):
+            bin2nc(filename_bin,filename_nc,nbytes = nbytes,logfile=args.logfile,layout=args.layout,overview=args.overview,backend=args.backend,**selection)
+            return
+
+        if args.tracemalloc:
+            tracemalloc.start()
+        if args.cprofile:
+            profiler = cProfile.Profile()
+            profiler.enable()
+
+        metrics = bin2nc(filename_bin,filename_nc,nbytes = nbytes,logfile=args.logfile,layout=args.layout,overview=args.overview,backend=args.backend,**selection)
+
+        if args.cprofile:
+            profiler.disable()
+            profiler.dump_stats(args.profile + '.prof')
+            logger.info('Wrote cProfile statistics to ' + args.profile + '.prof')
+        if args.tracemalloc:
+            size, peak = tracemalloc.get_traced_memory()
+            metrics['tracemalloc_peak'] = peak
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            with open(args.profile + '.tracemalloc.txt','w') as ftrace:
+                ftrace.write('Peak traced memory: {:d} bytes\n'.format(peak))
+                for stat in snapshot.statistics('lineno')[:50]:
+                    ftrace.write(str(stat) + '\n')
+            logger.info('Wrote tracemalloc statistics to ' + args.profile + '.tracemalloc.txt')
+
+        with open(args.profile,'w') as fprofile:
+            json.dump(metrics,fprofile,indent=1)
+        logger.info('Wrote conversion metrics to ' + args.profile)
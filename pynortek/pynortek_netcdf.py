@@ -0,0 +1,393 @@
+import numpy as np
+import logging
+import sys
+import netCDF4
+from .pynortek import navg_stream, groups_from_labels, group_statistics, repair_phase_shift_array, beam_matrix, rotation_matrix, rotate, float_dtype, coordinate_systems
+
+# Setup logging module
+logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
+logger = logging.getLogger('pynortek')
+
+# Variables of the bin2nc groups not averaged by default
+index_variables = ['count','time','burst','burstsample','Count']
+# Variables not masked by the correlation threshold of burst_avg
+unmasked_variables = ['p','Pressure','AnaIn1','AnaIn2']
+# The scaling of the attitude in the sys group (0.1 deg)
+attitude_factor = 0.1
+
+
+class pynortek_nc():
+    """ Processes a netCDF file created by bin2nc or ascii2nc chunk wise
+    with the analysis of the pynortek class (rot_vel, navg, burst_avg,
+    repair_phase_shift). Only one chunk of the data is in memory at a
+    time, the chunks are multiples of the storage chunks of the
+    file. The results are written as new variables into the file
+    (opened with mode='a') or into a new file (fname_out).
+
+    Usage:
+       >>>nc = pynortek_nc('advfile.nc',mode='a')
+       >>>nc.rot_vel('ENU') # Adds u, v, w to the vel group
+       >>>nc.navg(16*60,fname_out='advfile_navg.nc')
+       >>>nc.close()
+
+    """
+    def __init__(self, fname, mode='r', chunksize=2**16, T=None, coordinate_system=None, updown=None, threshold=None):
+        """
+        Args:
+            fname: The netCDF file
+            mode: 'r' or 'a', 'a' is needed to write the results into the file
+            chunksize: The approximate number of samples processed at once, rounded to the storage chunks
+            T: The transformation matrix BEAM to XYZ, from the info group if None (ascii2nc)
+            coordinate_system: The coordinate system of the velocities, from the info group if None
+            updown: Instrument pointing downward, from the info group or the status of the system data if None
+            threshold: The ambiguity velocity for repair_phase_shift, from the info group if None
+        """
+        self.fname = fname
+        self.dataset = netCDF4.Dataset(fname,mode)
+        self.chunksize = chunksize
+        info = {}
+        if('info' in self.dataset.groups.keys()):
+            grpinfo = self.dataset.groups['info']
+            info = {k:grpinfo.getncattr(k) for k in grpinfo.ncattrs()}
+
+        self.info = info
+        if((T is None) and ('transformation_matrix' in info.keys())):
+            T = np.reshape(info['transformation_matrix'],(3,3))
+        self.T = T
+        if(coordinate_system is None):
+            coordinate_system = info.get('coordinate_system')
+        if(coordinate_system is not None) and (coordinate_system not in coordinate_systems):
+            raise ValueError('Unknown coordinate system {}, choose one of {}'.format(coordinate_system,coordinate_systems))
+        self.coordinate_system = coordinate_system
+        if(updown is None):
+            updown = self.orientation_down()
+        self.updown = updown
+        if(threshold is None):
+            threshold = info.get('vertical_velocity_range')
+        self.threshold = threshold
+        self.t_sys = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
+
+    def close(self):
+        self.dataset.close()
+
+    def orientation_down(self):
+        """ Returns True if the instrument is pointing downward, found in
+        the info group or the first status of the system data
+        """
+        if('orientation' in self.info.keys()):
+            return 'DOWN' in self.info['orientation']
+        try:
+            return bool(self.dataset.groups['sys'].variables['stat_Orientation'][0] == 1)
+        except Exception:
+            logger.debug('Orientation not found, assuming upward looking')
+            return False
+
+    def chunk_ranges(self, group='vel', variables=None, by='time', chunksize=None):
+        """ Returns the [i0,i1] index ranges of the chunks of a group
+
+        Args:
+            variables: The variables read, their storage chunks define the alignment of the chunks
+            by: 'time' (chunks of chunksize samples, multiples of the storage chunks) or 'burst' (the chunks end at the end of a burst)
+            chunksize: The approximate number of samples of a chunk, self.chunksize if None
+        """
+        grp = self.dataset.groups[group]
+        if('count' not in grp.dimensions.keys()):
+            raise ValueError('Group {} has no count dimension, the burst layout is not supported'.format(group))
+        if(chunksize is None):
+            chunksize = self.chunksize
+        if(variables is None):
+            variables = list(grp.variables.keys())
+
+        nsamples = len(grp.dimensions['count'])
+        storage = [1]
+        for k in variables:
+            chunking = grp.variables[k].chunking()
+            if(chunking != 'contiguous'):
+                storage.append(chunking[0])
+        storage = int(np.lcm.reduce(storage))
+        chunksize = max(storage,(chunksize // storage) * storage)
+        ranges = []
+        i0 = 0
+        while i0 < nsamples:
+            i1 = min(i0 + chunksize,nsamples)
+            if(by == 'burst'):
+                i1 = self.burst_end(grp,i0,i1,chunksize)
+            ranges.append([i0,i1])
+            i0 = i1
+
+        return ranges
+
+    def burst_end(self, grp, i0, i1, chunksize):
+        """ Returns the end index of the last complete burst in [i0,i1) or
+        the end of the burst starting at i0 if it is longer than the chunk
+        """
+        nsamples = len(grp.dimensions['count'])
+        while i1 < nsamples:
+            burst = grp.variables['burst'][i0:i1+1]
+            change = np.flatnonzero(burst[1:] != burst[:-1])
+            if(len(change) > 0):
+                return int(i0 + change[-1] + 1)
+            i1 = min(i1 + chunksize,nsamples)
+
+        return nsamples
+
+    def chunks(self, group='vel', variables=None, by='time', chunksize=None):
+        """ Reads the variables of a group chunk wise, see chunk_ranges
+
+        Yields:
+            [i0,i1,data], data is a dictionary of the variables of the samples i0 to i1
+        """
+        grp = self.dataset.groups[group]
+        if(variables is None):
+            variables = self.count_variables(group)
+        for i0, i1 in self.chunk_ranges(group,variables,by,chunksize):
+            yield i0, i1, {k:np.ma.filled(grp.variables[k][i0:i1],np.nan) for k in variables}
+
+    def count_variables(self, group='vel', exclude=()):
+        """ Returns the variables of a group with the first dimension count
+        """
+        grp = self.dataset.groups[group]
+        return [k for k in grp.variables.keys() if ((grp.variables[k].dimensions[:1] == ('count',)) and (k not in exclude))]
+
+    def output(self, group, fname_out=None):
+        """ Returns the dataset and the group the results are written
+        into, the group in the file fname_out (a new file) or in the
+        processed file if None. The group is created if not existing.
+        """
+        if(fname_out is None):
+            dataset = self.dataset
+        else:
+            dataset = netCDF4.Dataset(fname_out,'w')
+            dataset.history = 'Processed by pynortek from ' + str(self.fname)
+            grpinfo = dataset.createGroup('info')
+            grpinfo.setncatts(self.info)
+
+        if(group in dataset.groups.keys()):
+            grp = dataset.groups[group]
+        else:
+            grp = dataset.createGroup(group)
+            grp.createDimension('count',0)
+
+        return dataset, grp
+
+    def write(self, grp, i0, data, src=None):
+        """ Writes the dictionary of arrays data into the group grp starting
+        at sample i0, variables are created on the first write with the
+        dtype of the data and the units of the variable of the same name in the group src
+        """
+        for k in data.keys():
+            x = np.asarray(data[k])
+            if(k not in grp.variables.keys()):
+                dims = ('count',)
+                if(np.ndim(x) > 1):
+                    if('cell' not in grp.dimensions.keys()):
+                        grp.createDimension('cell',np.shape(x)[1])
+                    dims = ('count','cell')
+                var = grp.createVariable(k,x.dtype,dims,zlib=True)
+                name = k.split('_')[0] if k.split('_')[-1] in ['std','count','median','rep'] else k
+                if((src is not None) and (name in src.variables.keys())):
+                    try:
+                        var.units = src.variables[name].units
+                    except AttributeError:
+                        pass
+                if(k.endswith('_count') or (k in ['nsamples','nburst'])):
+                    var.units = 'number of samples'
+
+            grp.variables[k][i0:i0+len(x)] = x
+
+    def attitude(self, t):
+        """ Returns [heading,pitch,roll] in degrees of the system data
+        interpolated onto the times t, only the system data in the
+        time range of t is read
+        """
+        sysgrp = self.dataset.groups['sys']
+        if(self.t_sys is None): # The time of the system data, small compared to the velocities
+            self.t_sys = np.ma.filled(sysgrp.variables['time'][:],np.nan)
+        j0 = max(0,int(np.searchsorted(self.t_sys,t[0],side='right')) - 1)
+        j1 = min(len(self.t_sys),int(np.searchsorted(self.t_sys,t[-1],side='left')) + 1)
+        t_sys = self.t_sys[j0:j1]
+        hpr = []
+        for k in ['Hdg','Pitch','Roll']:
+            x = np.ma.filled(sysgrp.variables[k][j0:j1],np.nan) * attitude_factor
+            if(k == 'Hdg'): # Interpolation across 0/360 deg
+                x = np.unwrap(x,period=360)
+            hpr.append(np.interp(t,t_sys,x))
+
+        hpr[0] = hpr[0] % 360
+        return hpr
+
+    def transformation_matrix(self, coords):
+        """ Returns the transformation matrix (see beam_matrix), needed if BEAM is in coords
+        """
+        if(self.T is None):
+            if('BEAM' in coords):
+                raise ValueError('The transformation matrix is needed for beam coordinates, use the T argument')
+            return np.eye(3)
+
+        return beam_matrix(self.T,self.updown)
+
+    def rot_vel(self, coord, group='vel', variables=('v1','v2','v3'), names=('u','v','w'), group_out=None, fname_out=None, chunksize=None):
+        """ Rotates the velocities to a different coordinate system chunk
+        wise, ENU uses the heading, pitch and roll of the system data
+        interpolated onto the time of the velocities
+
+        Args:
+            coord: The coordinate system, 'BEAM', 'XYZ' or 'ENU'
+            variables: The velocity variables, in self.coordinate_system
+            names: The names of the rotated velocities
+            group_out: The group of the rotated velocities, group if None
+            fname_out: Write into a new file, into the processed file if None
+        Return:
+            The number of samples rotated
+        """
+        if(coord not in coordinate_systems):
+            raise ValueError('Unknown coordinate system {}, choose one of {}'.format(coord,coordinate_systems))
+        if(self.coordinate_system is None):
+            raise ValueError('Unknown coordinate system of the data, use the coordinate_system argument')
+
+        coords = [self.coordinate_system,coord]
+        T = self.transformation_matrix(coords)
+        dataset, grp = self.output(group if group_out is None else group_out,fname_out)
+        src = self.dataset.groups[group]
+        logger.debug('{} to {}'.format(self.coordinate_system,coord))
+        n = 0
+        for i0, i1, data in self.chunks(group,['time'] + list(variables),chunksize=chunksize):
+            vel = [data[k] for k in variables]
+            hpr = self.attitude(data['time']) if ('ENU' in coords) else None
+            dtype = float_dtype(vel[0].dtype)
+            vel_rot = [np.zeros(np.shape(v),dtype=dtype) for v in vel]
+            rotate(vel,rotation_matrix(self.coordinate_system,coord,T,hpr).astype(dtype),vel_rot)
+            out = dict(zip(names,vel_rot))
+            if(grp is not src):
+                out['time'] = data['time']
+            self.write(grp,i0,out,src)
+            n = i1
+
+        for k in names:
+            grp.variables[k].coordinate_system = coord
+        if(dataset is not self.dataset):
+            dataset.close()
+
+        return n
+
+    def navg(self, navg=10, group='vel', variables=None, stats=('mean',), group_out=None, fname_out=None, chunksize=None):
+        """ Averages navg consecutive samples chunk wise, see navg_stream
+
+        Args:
+            variables: The averaged variables, all variables of the group except the index variables (count, burst, ...) if None
+            stats: See group_statistics
+            group_out: The group of the averages, group + '_navg' if None
+        Return:
+            The number of averages
+        """
+        if(variables is None):
+            variables = self.count_variables(group,exclude=index_variables)
+        dataset, grp = self.output(group + '_navg' if group_out is None else group_out,fname_out)
+        grp.navg = navg
+        src = self.dataset.groups[group]
+        source = (data for i0, i1, data in self.chunks(group,['time'] + list(variables),chunksize=chunksize))
+        n = 0
+        for avg in navg_stream(source,navg=navg,time='time',stats=stats):
+            self.write(grp,n,avg,src)
+            n += len(avg['nsamples'])
+
+        if(dataset is not self.dataset):
+            dataset.close()
+
+        return n
+
+    def burst_avg(self, group='vel', variables=None, c_threshold=0, stats=('mean',), group_out=None, fname_out=None, chunksize=None):
+        """ Averages the bursts chunk wise, a chunk contains complete bursts
+
+        Args:
+            variables: The averaged variables, all variables of the group except the index variables (count, burst, ...) if None
+            c_threshold: Samples with all three correlations (c1, c2, c3) below or equal the threshold are not used (if > 0)
+            stats: See group_statistics
+            group_out: The group of the averages, group + '_burstavg' if None
+        Return:
+            The number of bursts
+        """
+        if(variables is None):
+            variables = self.count_variables(group,exclude=index_variables)
+        masks = ['c1','c2','c3'] if c_threshold > 0 else []
+        read = ['time','burst'] + [k for k in list(variables) + masks if k not in ['time','burst']]
+        read = list(dict.fromkeys(read))
+        mask_variables = [k for k in variables if k not in unmasked_variables]
+        dataset, grp = self.output(group + '_burstavg' if group_out is None else group_out,fname_out)
+        src = self.dataset.groups[group]
+        n = 0
+        for i0, i1, data in self.chunks(group,read,by='burst',chunksize=chunksize):
+            burst, starts, counts, order = groups_from_labels(data['burst'])
+            groupstats = group_statistics({k:data[k] for k in variables},starts,counts,order=order,stats=stats,
+                                          masks=[data[k] for k in masks] if c_threshold > 0 else None,
+                                          threshold=c_threshold,mask_variables=mask_variables)
+            t = data['time']
+            out = {'burst':burst,'nburst':counts,
+                   'time':t[groupstats['first']] + (t[groupstats['last']] - t[groupstats['first']]) / 2}
+            out.update({k:groupstats[k] for k in groupstats.keys() if k not in ['first','last']})
+            self.write(grp,n,out,src)
+            n += len(burst)
+
+        if(dataset is not self.dataset):
+            dataset.close()
+
+        return n
+
+    def repair_phase_shift(self, threshold=None, group='vel', variables=('v1','v2','v3'), names=('v1_rep','v2_rep','v3_rep'), group_out=None, fname_out=None, chunksize=None):
+        """ Repairs phase shifts chunk wise, see repair_phase_shift_array.
+        Velocities in XYZ or ENU coordinates are rotated into beam
+        coordinates, repaired and rotated back.
+
+        Args:
+            threshold: The ambiguity velocity, self.threshold if None
+            names: The names of the repaired velocities
+        Return:
+            The number of samples repaired
+        """
+        if(threshold is None):
+            threshold = self.threshold
+        if(threshold is None):
+            raise ValueError('The ambiguity velocity is unknown, use the threshold argument')
+        coordinate_system = self.coordinate_system
+        if(coordinate_system is None):
+            raise ValueError('Unknown coordinate system of the data, use the coordinate_system argument')
+        T = self.transformation_matrix([coordinate_system,'BEAM'])
+        dataset, grp = self.output(group if group_out is None else group_out,fname_out)
+        src = self.dataset.groups[group]
+        vel_prev = None # The last repaired sample of the previous chunk
+        n = 0
+        for i0, i1, data in self.chunks(group,['time'] + list(variables),chunksize=chunksize):
+            vel = [data[k] for k in variables]
+            dtype = float_dtype(vel[0].dtype)
+            hpr = None
+            if(coordinate_system != 'BEAM'):
+                if(coordinate_system == 'ENU'):
+                    hpr = self.attitude(data['time'])
+                vel_beam = [np.zeros(np.shape(v),dtype=dtype) for v in vel]
+                rotate(vel,rotation_matrix(coordinate_system,'BEAM',T,hpr),vel_beam)
+                vel = vel_beam
+
+            vel_rep = repair_phase_shift_array(np.stack(vel,axis=1),threshold,vel_prev)
+            vel_prev = vel_rep[-1]
+            vel_rep = [vel_rep[:,i] for i in range(len(vel))]
+            if(coordinate_system != 'BEAM'):
+                vel_xyz = [np.zeros(np.shape(v),dtype=dtype) for v in vel_rep]
+                rotate(vel_rep,rotation_matrix('BEAM',coordinate_system,T,hpr),vel_xyz)
+                vel_rep = vel_xyz
+
+            out = dict(zip(names,vel_rep))
+            if(grp is not src):
+                out['time'] = data['time']
+            self.write(grp,i0,out,src)
+            n = i1
+
+        if(dataset is not self.dataset):
+            dataset.close()
+
+        return n
@@ -0,0 +1,245 @@
+import numpy as np
+import logging
+import sys
+import netCDF4
+
+# Setup logging module
+logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
+logger = logging.getLogger('pynortek')
+
+# The decimation of the overview levels, every level is a multiple of the previous one
+overview_levels = [64,4096,262144]
+# The variables of the groups the overview is calculated for
+overview_variables = {'vel':['v1','v2','v3','p','a1','a2','a3','c1','c2','c3'],
+                      'imu':['pitch','roll','yaw']}
+
+
+def overview_group(group, level):
+    """ The name of the group of an overview level in the overview group
+    """
+    return '{:s}_{:d}'.format(group,level)
+
+
+class overview_writer():
+    """ Calculates min/max/mean decimation levels of a stream of samples
+    and writes them into the overview group of a netCDF file. The
+    samples are added batch wise (add()), the windows of the first level
+    are calculated from the samples, the windows of the following levels
+    from the windows of the previous level. Only the samples of
+    incomplete windows are kept in memory.
+
+    Usage:
+       >>>ov = overview_writer(dataset)
+       >>>ov.add('vel',t,{'v1':v1,'p':p})
+       >>>ov.close() # Writes the last incomplete windows
+
+    """
+    def __init__(self, dataset, levels=None, variables=None, zlib=True):
+        """
+        Args:
+            dataset: The netCDF4.Dataset the overview group is created in
+            levels: The decimation of the levels, overview_levels if None
+            variables: Dictionary of group:list of variables, overview_variables if None
+        """
+        if(levels is None):
+            levels = overview_levels
+        if(variables is None):
+            variables = overview_variables
+        levels = sorted(levels)
+        for l0, l1 in zip(levels[:-1],levels[1:]):
+            if((l1 % l0) != 0):
+                raise ValueError('The levels have to be multiples of each other: {}'.format(levels))
+
+        self.levels = levels
+        self.variables = variables
+        self.zlib = zlib
+        self.dataset = dataset
+        if('overview' in dataset.groups.keys()):
+            self.grp = dataset.groups['overview']
+        else:
+            self.grp = dataset.createGroup('overview')
+        self.grp.levels = np.asarray(levels)
+        self.buffers = {} # group:list of the incomplete windows of every level
+
+    def create_level(self, group, level, units):
+        """ Creates the group of an overview level
+        """
+        grp = self.grp.createGroup(overview_group(group,level))
+        grp.level = level
+        grp.createDimension('count', 0)
+        var = grp.createVariable('time','d',('count'),zlib=self.zlib)
+        var.units = 'seconds since 1970-01-01 00:00:00'
+        var.long_name = 'center of the window'
+        var = grp.createVariable('nsamples','i',('count'),zlib=self.zlib)
+        var.units = 'number of samples'
+        for k in self.variables[group]:
+            for s in ['min','max','mean']:
+                var = grp.createVariable(k + '_' + s,'f',('count'),zlib=self.zlib)
+                if(k in units.keys()):
+                    var.units = units[k]
+
+        return grp
+
+    def add(self, group, t, data):
+        """ Adds a batch of samples of a group
+
+        Args:
+            t: The time of the samples (seconds since 1970)
+            data: Dictionary of the variables, arrays or lists of the samples
+        Samples with a time of -9999 (no timestamp) are ignored.
+        """
+        if(group not in self.variables.keys()):
+            return
+        t = np.asarray(t,dtype=np.float64)
+        valid = t != -9999 # Samples without timestamp
+        if(not np.any(valid)):
+            return
+        if(group not in self.buffers.keys()):
+            units = {}
+            if(group in self.dataset.groups.keys()):
+                for k in self.variables[group]:
+                    try:
+                        units[k] = self.dataset.groups[group].variables[k].units
+                    except (KeyError, AttributeError):
+                        pass
+            for level in self.levels:
+                self.create_level(group,level,units)
+            self.buffers[group] = [None] * len(self.levels)
+
+        t = t[valid]
+        windows = {'t0':t,'t1':t,'n':np.ones(len(t),dtype=np.int64)}
+        for k in self.variables[group]:
+            x = np.asarray(data[k],dtype=np.float64)[valid]
+            windows[k + '_sum'] = x
+            windows[k + '_min'] = x
+            windows[k + '_max'] = x
+
+        self.reduce(group,0,windows,final=False)
+
+    def reduce(self, group, ilevel, windows, final=False):
+        """ Adds windows (of the previous level or samples) to the buffer of
+        level ilevel, writes the complete windows and passes them to the
+        next level. With final the incomplete window is written as well.
+        """
+        if(ilevel >= len(self.levels)):
+            return
+        factor = self.levels[ilevel] if ilevel == 0 else self.levels[ilevel] // self.levels[ilevel - 1]
+        buf = self.buffers[group][ilevel]
+        if(buf is not None):
+            windows = {k:np.concatenate((buf[k],windows[k])) for k in windows.keys()}
+
+        nwin = len(windows['n'])
+        nfull = (nwin // factor) * factor
+        if(final and (nfull < nwin)): # The last window with less samples
+            starts = np.append(np.arange(0,nfull,factor),nfull)
+        else:
+            starts = np.arange(0,nfull,factor)
+        nused = nwin if final else nfull
+        self.buffers[group][ilevel] = {k:windows[k][nused:] for k in windows.keys()}
+        if(len(starts) > 0):
+            new = {'t0':windows['t0'][starts],'t1':windows['t1'][np.append(starts[1:],nused) - 1],
+                   'n':np.add.reduceat(windows['n'][:nused],starts)}
+            for k in windows.keys():
+                if(k.endswith('_sum')):
+                    new[k] = np.add.reduceat(windows[k][:nused],starts)
+                elif(k.endswith('_min')):
+                    new[k] = np.minimum.reduceat(windows[k][:nused],starts)
+                elif(k.endswith('_max')):
+                    new[k] = np.maximum.reduceat(windows[k][:nused],starts)
+
+            self.write(group,self.levels[ilevel],new)
+            self.reduce(group,ilevel + 1,new,final)
+        elif final:
+            self.reduce(group,ilevel + 1,{k:windows[k][:0] for k in windows.keys()},final)
+
+    def write(self, group, level, windows):
+        """ Appends the windows to the group of the level
+        """
+        grp = self.grp.groups[overview_group(group,level)]
+        n = len(grp.dimensions['count'])
+        nn = n + len(windows['n'])
+        grp.variables['time'][n:nn] = windows['t0'] + (windows['t1'] - windows['t0']) / 2
+        grp.variables['nsamples'][n:nn] = windows['n']
+        for k in self.variables[group]:
+            grp.variables[k + '_min'][n:nn] = windows[k + '_min']
+            grp.variables[k + '_max'][n:nn] = windows[k + '_max']
+            grp.variables[k + '_mean'][n:nn] = windows[k + '_sum'] / windows['n']
+
+    def close(self):
+        """ Writes the incomplete windows of all levels
+        """
+        for group in self.buffers.keys():
+            if(self.buffers[group][0] is not None):
+                self.reduce(group,0,{k:v[:0] for k,v in self.buffers[group][0].items()},final=True)
+
+
+def overview_level(dataset, group, tstart, tend, npixels):
+    """ Returns the level best suited to plot the data of a group between
+    tstart and tend (seconds since 1970) with npixels, the finest level
+    with at most npixels windows in the time span, 1 for the data itself
+
+    Return:
+        [level,i0,i1], the index range of the windows (samples) of the level covering the time span
+    """
+    grpov = dataset.groups['overview']
+    levels = sorted([int(l) for l in np.atleast_1d(grpov.levels)])
+    # The time span in the coarsest level, the windows of all levels are aligned
+    lcoarse = levels[-1]
+    tcoarse = np.ma.filled(grpov.groups[overview_group(group,lcoarse)].variables['time'][:],np.nan)
+    # The coarse windows overlapping the time span
+    j0 = max(0,int(np.searchsorted(tcoarse,tstart,side='right')) - 1)
+    j1 = min(len(tcoarse),int(np.searchsorted(tcoarse,tend,side='left')) + 1)
+    # The samples in the time span, counted with the windows of the finest level within the coarse windows
+    lfine = levels[0]
+    grpfine = grpov.groups[overview_group(group,lfine)]
+    k0 = j0 * (lcoarse // lfine)
+    k1 = j1 * (lcoarse // lfine)
+    tfine = np.ma.filled(grpfine.variables['time'][k0:k1],np.nan)
+    nfine = np.ma.filled(grpfine.variables['nsamples'][k0:k1],0)
+    nsamples = np.sum(nfine[(tfine >= tstart) & (tfine <= tend)])
+    raw = ('count' in dataset.groups[group].dimensions.keys()) # Flat layout
+    candidates = ([1] if raw else []) + levels
+    level = candidates[-1]
+    for l in candidates:
+        if(nsamples / l <= npixels):
+            level = l
+            break
+
+    i0 = j0 * (lcoarse // level)
+    i1 = j1 * (lcoarse // level)
+    return [level,i0,i1]
+
+
+def read_overview(dataset, group, variables, tstart, tend, npixels):
+    """ Reads the data of a group between tstart and tend (seconds since
+    1970) in the level best suited for npixels, see overview_level
+
+    Usage:
+       >>>with netCDF4.Dataset('advfile.nc') as dataset:
+       >>>    ov = read_overview(dataset,'vel',['v1'],t0,t0 + 30*86400,2000)
+       >>>    plt.fill_between(ov['time'],ov['v1_min'],ov['v1_max'])
+
+    Return:
+        Dictionary with level, time and the variables (level 1) or their
+        min, max and mean (variable_min, ...) of the windows in the time span
+    """
+    if(isinstance(dataset,str)):
+        with netCDF4.Dataset(dataset) as ds:
+            return read_overview(ds,group,variables,tstart,tend,npixels)
+
+    level, i0, i1 = overview_level(dataset,group,tstart,tend,npixels)
+    if(level == 1):
+        grp = dataset.groups[group]
+        names = variables
+    else:
+        grp = dataset.groups['overview'].groups[overview_group(group,level)]
+        names = [k + '_' + s for k in variables for s in ['min','max','mean']]
+
+    t = np.ma.filled(grp.variables['time'][i0:i1],np.nan)
+    k0 = int(np.searchsorted(t,tstart,side='left'))
+    k1 = int(np.searchsorted(t,tend,side='right'))
+    result = {'level':level,'time':t[k0:k1]}
+    for k in names:
+        result[k] = np.ma.filled(grp.variables[k][i0+k0:i0+k1],np.nan)
+
+    return result
@@ -0,0 +1,177 @@
+import numpy as np
+import logging
+import sys
+import netCDF4
+
+# Setup logging module
+logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
+logger = logging.getLogger('pynortek')
+
+# The CF attributes of the variables of the bin2nc groups, name:[units,
+# scale_factor,long_name,standard_name], the scale factor converts
+# the binary units (e.g. 0.1 V) into the CF units
+cf_attributes = {'sys':{'bat':['V',0.1,'battery voltage',None],
+                        'SndVel':['m s-1',0.1,'speed of sound',None],
+                        'Hdg':['degree',0.1,'heading','platform_orientation'],
+                        'Pitch':['degree',0.1,'pitch','platform_pitch'],
+                        'Roll':['degree',0.1,'roll','platform_roll'],
+                        'T':['degree_Celsius',0.01,'temperature','sea_water_temperature']},
+                 'vel':{'p':['dbar',0.001,'pressure','sea_water_pressure'],
+                        'v1':['m s-1',1,'velocity beam1 or X or East',None],
+                        'v2':['m s-1',1,'velocity beam2 or Y or North',None],
+                        'v3':['m s-1',1,'velocity beam3 or Z or Up',None],
+                        'a1':['count',1,'amplitude beam1',None],
+                        'a2':['count',1,'amplitude beam2',None],
+                        'a3':['count',1,'amplitude beam3',None],
+                        'c1':['percent',1,'correlation beam1',None],
+                        'c2':['percent',1,'correlation beam2',None],
+                        'c3':['percent',1,'correlation beam3',None]},
+                 'imu':{'DeltaAngleX':['radian',1,'delta angle x',None],
+                        'DeltaAngleY':['radian',1,'delta angle y',None],
+                        'DeltaAngleZ':['radian',1,'delta angle z',None],
+                        'pitch':['degree',1,'pitch','platform_pitch'],
+                        'roll':['degree',1,'roll','platform_roll'],
+                        'yaw':['degree',1,'yaw','platform_yaw']}}
+# Angles interpolated as unit vectors (0/360 deg)
+circular_variables = ['Hdg','yaw']
+
+
+def storage_chunksize(fname, group, chunksize=2**20, dim='count'):
+    """ Returns chunksize rounded to a multiple of the storage chunks
+    of the dimension dim (count or burst) of the variables of group
+    """
+    with netCDF4.Dataset(fname) as dataset:
+        grp = dataset.groups[group]
+        storage = [1]
+        for var in grp.variables.values():
+            chunking = var.chunking()
+            if((chunking != 'contiguous') and (var.dimensions[:1] == (dim,))):
+                storage.append(chunking[0])
+
+    storage = int(np.lcm.reduce(storage))
+    return max(storage,(chunksize // storage) * storage)
+
+
+def cf_decode(ds, group):
+    """ Scales the variables of a group into the units of cf_attributes
+    and sets the CF attributes, the description of the binary units is
+    kept as comment. The scaling is lazy for dask arrays.
+    """
+    for k, (units, scale, long_name, standard_name) in cf_attributes.get(group,{}).items():
+        if(k not in ds.variables):
+            continue
+        attrs = {'units':units,'long_name':long_name}
+        if(standard_name is not None):
+            attrs['standard_name'] = standard_name
+        if('units' in ds[k].attrs):
+            attrs['comment'] = 'binary units: ' + ds[k].attrs['units']
+        if(scale != 1):
+            ds[k] = ds[k] * scale
+        ds[k].attrs = attrs
+
+    return ds
+
+
+def open_groups(fname, groups=None, chunksize=2**20, cf=True):
+    """ Opens the groups of a netCDF file created by bin2nc (or ascii2nc)
+    as lazily loaded, dask chunked xarray Datasets. The time is decoded
+    to datetime64 and is a coordinate of the count dimension. Groups in
+    the burst layout (see create_burst_group) are chunked along the
+    burst dimension, time is the start time of the bursts.
+
+    Usage:
+       >>>ds = open_groups('advfile.nc')
+       >>>vmean = ds['vel']['v1'].mean().compute()
+
+    Args:
+        groups: List of the groups, all groups with a count dimension if None
+        chunksize: The number of samples of a dask chunk, rounded to a multiple of the storage chunks (divided by the samples per burst for the burst layout)
+        cf: Scale the variables into CF units and set the CF attributes, see cf_attributes
+    Return:
+        Dictionary of the xarray Datasets of the groups, the attributes of the info group are the attributes of the Datasets
+    """
+    import xarray
+    with netCDF4.Dataset(fname) as dataset:
+        if(groups is None):
+            groups = [g for g in dataset.groups.keys() if (('count' in dataset.groups[g].dimensions.keys()) or
+                                                           ('burst' in dataset.groups[g].dimensions.keys()))]
+        info = {}
+        if('info' in dataset.groups.keys()):
+            grpinfo = dataset.groups['info']
+            info = {k:grpinfo.getncattr(k) for k in grpinfo.ncattrs()}
+        nsample = {g:len(dataset.groups[g].dimensions['sample']) for g in groups if 'sample' in dataset.groups[g].dimensions.keys()}
+
+    datasets = {}
+    for group in groups:
+        if(group in nsample.keys()): # Burst layout
+            chunks = {'burst':storage_chunksize(fname,group,max(1,chunksize // nsample[group]),'burst')}
+        else:
+            chunks = {'count':storage_chunksize(fname,group,chunksize)}
+        # Only time is decoded, units like the one of the IMU timer contain 'since' as well
+        ds = xarray.open_dataset(fname,group=group,engine='netcdf4',chunks=chunks,decode_times=False)
+        if('time' in ds.variables):
+            ds['time'] = xarray.decode_cf(ds[['time']])['time']
+            ds = ds.set_coords('time')
+        if cf:
+            ds = cf_decode(ds,group)
+        ds.attrs.update(info)
+        datasets[group] = ds
+
+    return datasets
+
+
+def interp_time(ds, t, variables=None):
+    """ Interpolates the variables of ds (e.g. the sys or imu group) linearly
+    onto the times t (e.g. the time of the vel group), chunk wise
+    with dask if t is chunked. The variables of ds are loaded into
+    memory (the system data is small compared to the velocities).
+    Angles in circular_variables are interpolated as unit vectors.
+    Samples of ds without valid time are not used.
+
+    Args:
+        t: DataArray of datetime64 with the dimension count
+        variables: The variables, all variables with the dimension count if None
+    Return:
+        Dataset of the interpolated variables with the dimension of t
+    """
+    import xarray
+    if(variables is None):
+        variables = [k for k in ds.data_vars if ds[k].dims == ('count',)]
+    tsrc = ds['time'].values
+    valid = ~np.isnat(tsrc)
+    order = None
+    if(not np.all(tsrc[valid][1:] >= tsrc[valid][:-1])):
+        order = np.argsort(tsrc[valid],kind='stable')
+    tsrc = tsrc[valid] if order is None else tsrc[valid][order]
+    tsrc = tsrc.astype('datetime64[ns]').astype(np.int64).astype(np.float64)
+    index = np.flatnonzero(valid) if order is None else np.flatnonzero(valid)[order]
+
+    def interp_block(tblock, x):
+        tblock = np.asarray(tblock).astype('datetime64[ns]').astype(np.int64).astype(np.float64)
+        return np.interp(tblock,tsrc,x)
+
+    result = {}
+    for k in variables:
+        x = np.asarray(ds[k].values,dtype=np.float64)[index] # The source is read once
+        if(k in circular_variables):
+            rad = np.deg2rad(x)
+            xc = xarray.apply_ufunc(interp_block,t,kwargs={'x':np.cos(rad)},dask='parallelized',output_dtypes=[np.float64])
+            xs = xarray.apply_ufunc(interp_block,t,kwargs={'x':np.sin(rad)},dask='parallelized',output_dtypes=[np.float64])
+            xi = np.rad2deg(np.arctan2(xs,xc)) % 360
+        else:
+            xi = xarray.apply_ufunc(interp_block,t,kwargs={'x':x},dask='parallelized',output_dtypes=[np.float64])
+        xi.attrs = ds[k].attrs
+        result[k] = xi
+
+    return xarray.Dataset(result,coords={'time':t})
+
+
+def align(datasets, group='sys', to='vel', variables=None):
+    """ Interpolates the variables of a group onto the time axis of another
+    group, see interp_time
+
+    Usage:
+       >>>ds = open_groups('advfile.nc')
+       >>>vel = ds['vel'].assign(align(ds,'sys','vel',['Hdg','Pitch','Roll']).data_vars)
+    """
+    return interp_time(datasets[group],datasets[to]['time'],variables)
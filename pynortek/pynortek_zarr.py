@@ -0,0 +1,302 @@
+import numpy as np
+import logging
+import sys
+import concurrent.futures
+import netCDF4
+
+# Setup logging module
+logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
+logger = logging.getLogger('pynortek')
+
+
+def json_attribute(value):
+    """ Converts numpy values into json serializable zarr attributes
+    """
+    if(isinstance(value,(np.ndarray,np.generic))):
+        return value.tolist()
+    return value
+
+
+class zarr_dimension():
+    """ A dimension of a zarr_group, the length of an unlimited dimension
+    is the largest index written into a variable with the dimension
+    """
+    def __init__(self, name, size):
+        self.name = name
+        self.unlimited = (size is None) or (size == 0)
+        self.size = 0 if self.unlimited else size
+
+    def isunlimited(self):
+        return self.unlimited
+
+    def __len__(self):
+        return self.size
+
+
+class zarr_variable():
+    """ A zarr array with the netCDF4.Variable interface used by the
+    writers of pynortek_binary (slice writes, units attributes, len()).
+    Variables with an unlimited first dimension keep the rows not yet
+    written as complete chunks in memory (the tail), complete chunks
+    are compressed and written by the workers of the zarr_dataset.
+    """
+    def __init__(self, group, name, dtype, dimensions, zlib=True, chunksizes=None, fill_value=None):
+        object.__setattr__(self,'_group',group)
+        object.__setattr__(self,'_futures',[])
+        object.__setattr__(self,'name',name)
+        object.__setattr__(self,'dtype',np.dtype(dtype))
+        object.__setattr__(self,'dimensions',tuple(dimensions))
+        if(fill_value is None):
+            fill_value = netCDF4.default_fillvals[self.dtype.str[1:]]
+        object.__setattr__(self,'_fill_value',self.dtype.type(fill_value))
+        dims = [group.dimensions[d] for d in self.dimensions]
+        unlimited = (len(dims) > 0) and dims[0].isunlimited()
+        object.__setattr__(self,'_unlimited',unlimited)
+        shape = [0 if d.isunlimited() else len(d) for d in dims]
+        if(chunksizes is None):
+            chunksizes = [group._dataset.chunksize if d.isunlimited() else max(1,len(d)) for d in dims]
+        object.__setattr__(self,'_chunks',tuple(chunksizes))
+        kwargs = {'shape':tuple(shape),'chunks':tuple(chunksizes) if len(shape) > 0 else None,
+                  'dtype':self.dtype,'fill_value':self._fill_value,
+                  'attributes':{'_ARRAY_DIMENSIONS':list(self.dimensions)}} # The dimensions for xarray
+        if(not zlib):
+            kwargs['compressors'] = None
+        object.__setattr__(self,'_array',group._zarr.create_array(name,**kwargs))
+        object.__setattr__(self,'_flushed',0) # The rows written into the array
+        object.__setattr__(self,'_extent',0) # The rows written into the variable
+        object.__setattr__(self,'_tail',np.full((0,) + tuple(shape[1:]),self._fill_value,dtype=self.dtype))
+
+    def __setattr__(self, name, value):
+        self.setncattr(name,value)
+
+    def setncattr(self, name, value):
+        self._array.attrs[name] = json_attribute(value)
+
+    def getncattr(self, name):
+        return self._array.attrs[name]
+
+    def ncattrs(self):
+        return [k for k in self._array.attrs.keys() if k != '_ARRAY_DIMENSIONS']
+
+    def __getattr__(self, name):
+        try:
+            return self._array.attrs[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def chunking(self):
+        return list(self._chunks)
+
+    def __len__(self):
+        return len(self._group.dimensions[self.dimensions[0]])
+
+    @property
+    def shape(self):
+        return tuple(len(self._group.dimensions[d]) for d in self.dimensions)
+
+    def row_range(self, k0, nvalue):
+        """ The rows [start,stop) addressed by the index k0 of the first dimension
+        """
+        if(isinstance(k0,slice)):
+            start = 0 if k0.start is None else int(k0.start)
+            stop = start + nvalue if k0.stop is None else int(k0.stop)
+            return start, stop
+        return int(k0), int(k0) + 1
+
+    def __setitem__(self, key, value):
+        if(not self._unlimited):
+            self._array[key] = value
+            return
+
+        key = key if isinstance(key,tuple) else (key,)
+        value = np.asarray(value)
+        start, stop = self.row_range(key[0],len(value) if value.ndim > 0 else 1)
+        if(stop <= start):
+            return
+        dim = self._group.dimensions[self.dimensions[0]]
+        dim.size = max(dim.size,stop)
+        object.__setattr__(self,'_extent',max(self._extent,stop))
+        if(start < self._flushed): # Rows already written into the array
+            self.wait()
+            if(self._array.shape[0] < stop):
+                self._array.resize((stop,) + self._array.shape[1:])
+            self._array[key] = value
+            return
+
+        tail = self._tail
+        if(len(tail) < stop - self._flushed): # Grow the tail
+            nnew = max(stop - self._flushed,2 * len(tail)) - len(tail)
+            tail = np.concatenate((tail,np.full((nnew,) + tail.shape[1:],self._fill_value,dtype=self.dtype)))
+            object.__setattr__(self,'_tail',tail)
+        i0 = start - self._flushed
+        if(isinstance(key[0],slice)):
+            tail[(slice(i0,stop - self._flushed),) + key[1:]] = value
+        else:
+            tail[(i0,) + key[1:]] = value
+
+        # The last chunk is kept in memory, it is likely to be written again (e.g. bursts)
+        nchunk = self._chunks[0]
+        if(self._extent - self._flushed >= 2 * nchunk):
+            self.flush(((self._extent - self._flushed) // nchunk - 1) * nchunk)
+
+    def flush(self, nrows=None):
+        """ Passes the first nrows of the tail (all if None) to the workers
+        """
+        if(nrows is None):
+            nrows = self._extent - self._flushed
+        if(nrows <= 0):
+            return
+        self.wait_resize(self._flushed + nrows)
+        nchunk = self._chunks[0]
+        for c0 in range(0,nrows,nchunk):
+            c1 = min(nrows,c0 + nchunk)
+            block = self._tail[c0:c1].copy()
+            f = self._group._dataset.submit(self.write_block,self._flushed + c0,block)
+            self._futures.append(f)
+
+        object.__setattr__(self,'_tail',self._tail[nrows:])
+        object.__setattr__(self,'_flushed',self._flushed + nrows)
+
+    def write_block(self, row, block):
+        self._array[row:row + len(block)] = block
+
+    def wait(self):
+        """ Waits until the workers wrote the chunks of this variable
+        """
+        for f in self._futures:
+            f.result()
+        self._futures.clear()
+
+    def wait_resize(self, nrows):
+        """ Resizes the array to at least nrows, the pending writes are
+        finished before. The array grows by a factor of two, the final
+        size is set in close()
+        """
+        if(self._array.shape[0] < nrows):
+            self.wait()
+            self._array.resize((max(nrows,2 * self._array.shape[0]),) + self._array.shape[1:])
+
+    def close(self):
+        """ Writes the tail and resizes the array to the length of the dimension
+        """
+        if(self._unlimited):
+            self.flush()
+            self.wait()
+            nrows = len(self)
+            if(self._array.shape[0] != nrows):
+                self._array.resize((nrows,) + self._array.shape[1:])
+
+    def __getitem__(self, key):
+        if(not self._unlimited):
+            return self._array[key]
+
+        nrows = len(self)
+        if(self._flushed == 0):
+            data = self._tail[:nrows - self._flushed]
+            if(len(data) < nrows):
+                data = np.concatenate((data,np.full((nrows - len(data),) + data.shape[1:],self._fill_value,dtype=self.dtype)))
+        else:
+            self.wait()
+            data = np.concatenate((self._array[:self._flushed],self._tail[:max(0,nrows - self._flushed)]))
+            if(len(data) < nrows):
+                data = np.concatenate((data,np.full((nrows - len(data),) + data.shape[1:],self._fill_value,dtype=self.dtype)))
+
+        return np.ma.masked_equal(data[key],self._fill_value)
+
+
+class zarr_group():
+    """ A zarr group with the netCDF4.Group interface used by create_group,
+    create_burst_group and the overview_writer
+    """
+    def __init__(self, dataset, zgroup, name):
+        object.__setattr__(self,'_dataset',dataset)
+        object.__setattr__(self,'_zarr',zgroup)
+        object.__setattr__(self,'name',name)
+        object.__setattr__(self,'groups',{})
+        object.__setattr__(self,'dimensions',{})
+        object.__setattr__(self,'variables',{})
+
+    def __setattr__(self, name, value):
+        self.setncattr(name,value)
+
+    def setncattr(self, name, value):
+        self._zarr.attrs[name] = json_attribute(value)
+
+    def getncattr(self, name):
+        return self._zarr.attrs[name]
+
+    def ncattrs(self):
+        return list(self._zarr.attrs.keys())
+
+    def __getattr__(self, name):
+        try:
+            return self._zarr.attrs[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def createGroup(self, name):
+        grp = zarr_group(self._dataset,self._zarr.create_group(name),name)
+        self.groups[name] = grp
+        return grp
+
+    def createDimension(self, name, size=None):
+        dim = zarr_dimension(name,size)
+        self.dimensions[name] = dim
+        return dim
+
+    def createVariable(self, name, dtype, dimensions=(), zlib=True, chunksizes=None, fill_value=None):
+        if(isinstance(dimensions,str)):
+            dimensions = (dimensions,)
+        var = zarr_variable(self,name,dtype,dimensions,zlib=zlib,chunksizes=chunksizes,fill_value=fill_value)
+        self.variables[name] = var
+        return var
+
+    def close_variables(self):
+        for var in self.variables.values():
+            var.close()
+        for grp in self.groups.values():
+            grp.close_variables()
+
+
+class zarr_dataset(zarr_group):
+    """ A zarr store written with the netCDF4.Dataset interface, the
+    output backend 'zarr' of bin2nc. The groups, variables and
+    attributes are the ones of the netCDF file. The store is written in
+    the zarr format 2 with the dimensions as _ARRAY_DIMENSIONS
+    attributes and consolidated metadata (readable with
+    xarray.open_zarr(fname,group='vel')). Complete chunks of the
+    variables with an unlimited dimension are compressed and written in
+    parallel by a pool of workers.
+
+    Usage:
+       >>>dataset = zarr_dataset('advfile.zarr','w')
+       >>>create_group(dataset,convert_vector_velocity(None,units = True),'vel')
+
+    Args:
+        chunksize: The chunksize of the unlimited dimension
+        workers: The number of threads compressing and writing the chunks
+    """
+    def __init__(self, fname, mode='w', chunksize=2**16, workers=4):
+        import zarr
+        if(mode != 'w'):
+            raise ValueError('zarr_dataset can only be created (mode w), read the store with zarr or xarray')
+        zgroup = zarr.open_group(fname,mode='w',zarr_format=2)
+        zarr_group.__init__(self,self,zgroup,'/')
+        object.__setattr__(self,'filepath',fname)
+        object.__setattr__(self,'chunksize',chunksize)
+        object.__setattr__(self,'_executor',concurrent.futures.ThreadPoolExecutor(max_workers=workers))
+
+    def submit(self, fn, *args):
+        return self._executor.submit(fn,*args)
+
+    def sync(self):
+        """ Writes all data passed to the variables
+        """
+        self.close_variables()
+
+    def close(self):
+        import zarr
+        logger.debug('Closing zarr store ' + str(self.filepath))
+        self.close_variables()
+        self._executor.shutdown(wait=True)
+        zarr.consolidate_metadata(self.filepath)
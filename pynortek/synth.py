@@ -0,0 +1,402 @@
+import numpy as np
+import datetime
+import struct
+import argparse
+from .pynortek_binary import logger, version, calc_checksum
+from .pynortek_binary import package_user_configuration, package_hardware_configuration, package_head_configuration
+from .pynortek_binary import package_vector_velocity_header, package_vector_velocity, package_vector_sytem, package_imu_data
+
+# Synthetic Nortek Vector binary (.vec) data for tests and benchmarks
+
+# The binary layout of the data packages, as in the system integrators manual
+dtype_vector_sytem = np.dtype([('sync','u1'),('id','u1'),('size','<u2'),('time','u1',(6,)),
+                               ('bat','<u2'),('SndVel','<u2'),('Hdg','<i2'),('Pitch','<i2'),
+                               ('Roll','<i2'),('T','<i2'),('err','u1'),('stat','u1'),
+                               ('AnaIn','<u2'),('checksum','<u2')])
+dtype_vector_velocity_header = np.dtype([('sync','u1'),('id','u1'),('size','<u2'),('time','u1',(6,)),
+                                         ('NRecords','<u2'),('Noise','u1',(4,)),('Correlation','u1',(4,)),
+                                         ('spare','u1',(20,)),('checksum','<u2')])
+dtype_vector_velocity = np.dtype([('sync','u1'),('id','u1'),('AnaIn2LSB','u1'),('Count','u1'),
+                                  ('PressureMSB','u1'),('AnaIn2MSB','u1'),('PressureLSW','<u2'),
+                                  ('AnaIn1','<u2'),('v','<i2',(3,)),('a','u1',(3,)),('c','u1',(3,)),
+                                  ('checksum','<u2')])
+dtype_imu_data = np.dtype([('sync','u1'),('id','u1'),('size','<u2'),('EnsCnt','u1'),('AHRSId','u1'),
+                           ('DeltaAngle','<f4',(3,)),('DeltaVel','<f4',(3,)),('M','<f4',(9,)),
+                           ('timer','<i4'),('checksum','<u2')])
+
+# The package definitions belonging to the dtypes
+synth_packages = [(package_vector_sytem,dtype_vector_sytem),
+                  (package_vector_velocity_header,dtype_vector_velocity_header),
+                  (package_vector_velocity,dtype_vector_velocity),
+                  (package_imu_data,dtype_imu_data)]
+
+for _package,_dtype in synth_packages:
+    assert _package['size'] == _dtype.itemsize, _package['name']
+
+
+def dtype_second(nsamples, imu=False):
+    """ A system package followed by nsamples velocity (and IMU) packages
+    """
+    if imu:
+        dtype_sample = np.dtype([('vel',dtype_vector_velocity),('imu',dtype_imu_data)])
+    else:
+        dtype_sample = np.dtype([('vel',dtype_vector_velocity)])
+
+    return np.dtype([('sys',dtype_vector_sytem),('samples',dtype_sample,(nsamples,))])
+
+
+def dtype_burst(samplingrate, samplesperburst, imu=False):
+    """ A velocity header followed by the seconds of one burst, the
+    last second holds the remaining samples
+    """
+    nfull = samplesperburst // samplingrate
+    nrem = samplesperburst % samplingrate
+    fields = [('header',dtype_vector_velocity_header)]
+    if(nfull > 0):
+        fields.append(('seconds',dtype_second(samplingrate,imu),(nfull,)))
+    if(nrem > 0):
+        fields.append(('last',dtype_second(nrem,imu)))
+
+    return np.dtype(fields)
+
+
+def package_offsets(dtype):
+    """ Returns the offsets, sizes and names of all packages within one item of dtype
+    """
+    offsets = []
+    sizes = []
+    names = []
+    for package,dtype_package in synth_packages:
+        if(dtype == dtype_package):
+            return np.asarray([0]),np.asarray([dtype.itemsize]),[package['name']]
+
+    for field in dtype.names:
+        dtype_field, offset = dtype.fields[field][:2]
+        if(dtype_field.subdtype is not None):
+            dtype_base, shape = dtype_field.subdtype
+            nitems = int(np.prod(shape))
+        else:
+            dtype_base = dtype_field
+            nitems = 1
+
+        offs_base, sizes_base, names_base = package_offsets(dtype_base)
+        for n in range(nitems):
+            offsets.append(offs_base + offset + n * dtype_base.itemsize)
+            sizes.append(sizes_base)
+            names.extend(names_base)
+
+    return np.concatenate(offsets),np.concatenate(sizes),names
+
+
+def set_checksum(packages):
+    """ Vectorized version of calc_checksum, packages is a contiguous
+    array of one of the package dtypes
+    """
+    nwords = packages.dtype.itemsize // 2
+    words = packages.view('<u2').reshape(packages.shape + (nwords,))
+    checksum = 0xb58c + words[...,:-1].sum(-1,dtype=np.uint64)
+    packages['checksum'] = (checksum & 0xffff).astype(np.uint16)
+
+
+def bcdtime(t):
+    """ Converts a datetime64 array into the binary (BCD) time of the
+    packages (minute, second, day, hour, year, month)
+    """
+    t = np.asarray(t).astype('datetime64[s]')
+    year = t.astype('datetime64[Y]').astype(int) + 1970
+    month = t.astype('datetime64[M]').astype(int) % 12 + 1
+    day = (t.astype('datetime64[D]') - t.astype('datetime64[M]')).astype(int) + 1
+    hour = (t.astype('datetime64[h]') - t.astype('datetime64[D]')).astype(int)
+    minute = (t.astype('datetime64[m]') - t.astype('datetime64[h]')).astype(int)
+    second = (t - t.astype('datetime64[m]')).astype(int)
+    tbin = np.stack([minute,second,day,hour,year-2000,month],axis=-1)
+    return ((tbin // 10) * 16 + tbin % 10).astype(np.uint8)
+
+
+def create_seconds(tsys, tsample, count, burstsample, samplingrate, imu, rng):
+    """ Creates an array of dtype_second packages
+
+    Args:
+       tsys: datetime64 array of the system packages
+       tsample: Time of the samples in seconds since start, shape tsys.shape + (nsamples,)
+       count: The ensemble counter of the samples
+       burstsample: The sample number within the burst (for the IMU timer)
+    """
+    nsamples = np.shape(tsample)[-1]
+    seconds = np.zeros(np.shape(tsys),dtype_second(nsamples,imu))
+    tsec = tsample[...,0] if nsamples > 0 else np.zeros(np.shape(tsys))
+    # System data
+    sys = np.zeros(np.shape(tsys),dtype_vector_sytem)
+    sys['sync'] = package_vector_sytem['sync'][0]
+    sys['id'] = package_vector_sytem['id'][0]
+    sys['size'] = dtype_vector_sytem.itemsize // 2
+    sys['time'] = bcdtime(tsys)
+    sys['bat'] = 120
+    sys['SndVel'] = 15000
+    sys['Hdg'] = (1800 + 300 * np.sin(2 * np.pi * tsec / 3600.)).astype(np.int16)
+    sys['Pitch'] = rng.integers(-20,20,np.shape(tsys))
+    sys['Roll'] = rng.integers(-20,20,np.shape(tsys))
+    sys['T'] = (1000 + 200 * np.sin(2 * np.pi * tsec / 86400.)).astype(np.int16)
+    sys['stat'] = 0 # mm/s scaling, orientation up
+    set_checksum(sys)
+    seconds['sys'] = sys
+    if(nsamples == 0):
+        return seconds
+
+    # Velocity data
+    shape = np.shape(tsample)
+    vel = np.zeros(shape,dtype_vector_velocity)
+    vel['sync'] = package_vector_velocity['sync'][0]
+    vel['id'] = package_vector_velocity['id'][0]
+    vel['Count'] = count % 256
+    # Pressure [0.001 dbar] with a M2 tide
+    p = (10000 + 1000 * np.sin(2 * np.pi * tsample / 44712.)).astype(np.int64)
+    vel['PressureMSB'] = p >> 16
+    vel['PressureLSW'] = p & 0xffff
+    v = np.empty(shape + (3,))
+    v[...,0] = 500 * np.sin(2 * np.pi * tsample / 44712.)
+    v[...,1] = 300 * np.cos(2 * np.pi * tsample / 44712.)
+    v[...,2] = 0
+    v += rng.normal(0,50,shape + (3,))
+    vel['v'] = np.clip(v,-32768,32767).astype(np.int16) # [mm/s]
+    vel['a'] = rng.integers(100,160,shape + (3,),dtype=np.uint8)
+    vel['c'] = rng.integers(70,100,shape + (3,),dtype=np.uint8)
+    set_checksum(vel)
+    seconds['samples']['vel'] = vel
+    if imu:
+        imu_data = np.zeros(shape,dtype_imu_data)
+        imu_data['sync'] = package_imu_data['sync'][0]
+        imu_data['id'] = package_imu_data['id'][0]
+        imu_data['size'] = dtype_imu_data.itemsize // 2
+        imu_data['EnsCnt'] = count % 256
+        imu_data['AHRSId'] = 0xc3
+        imu_data['DeltaAngle'] = rng.normal(0,1e-3,shape + (3,))
+        imu_data['DeltaVel'] = rng.normal(0,1e-3,shape + (3,))
+        # Orientation matrix with the pitch, roll and yaw as decoded by convert_vector_IMU
+        yaw = np.deg2rad(180 + 30 * np.sin(2 * np.pi * tsample / 3600.))
+        pitch = np.deg2rad(rng.normal(0,2,shape))
+        roll = np.deg2rad(rng.normal(0,2,shape))
+        ca,sa,cb,sb,cc,sc = np.cos(yaw),np.sin(yaw),np.cos(pitch),np.sin(pitch),np.cos(roll),np.sin(roll)
+        imu_data['M'] = np.stack([cb * ca, cb * sa, sb,
+                                  -cc * sa - sc * sb * ca, cc * ca - sc * sb * sa, sc * cb,
+                                  sc * sa - cc * sb * ca, -sc * ca - cc * sb * sa, cc * cb],axis=-1)
+        imu_data['timer'] = burstsample * 62500 // samplingrate
+        set_checksum(imu_data)
+        seconds['samples']['imu'] = imu_data
+
+    return seconds
+
+
+def create_config(samplingrate, samplesperburst, measinterval, imu, coordinate_system, start):
+    """ Creates the user, hardware and head configuration packages
+    """
+    usr = bytearray(package_user_configuration['size'])
+    struct.pack_into('<cc',usr,0,package_user_configuration['sync'],package_user_configuration['id'])
+    struct.pack_into('<H',usr,2,len(usr) // 2)
+    struct.pack_into('<HHHHHHHH',usr,4,2,16,18,100,2000,1,512 // samplingrate,3) # T1..T5, NPings, AvgInterval, nbeams
+    if(samplesperburst > 0):
+        struct.pack_into('<H',usr,20,0) # TimCtrlReg: burst
+    else:
+        struct.pack_into('<H',usr,20,3) # TimCtrlReg: continous
+    struct.pack_into('<H',usr,32,['ENU','XYZ','BEAM'].index(coordinate_system))
+    struct.pack_into('<HHH',usr,34,1,16,measinterval) # NBins, BinLength, MeasInterval
+    usr[40:46] = b'SYNTH\x00'
+    usr[48:54] = bcdtime(np.datetime64(start,'s')).tobytes()
+    comment = ('pynortek ' + version + ' synthetic data').encode('utf-8')
+    usr[256:256 + len(comment)] = comment
+    struct.pack_into('<H',usr,452,samplesperburst) # B1_1
+    struct.pack_into('<H',usr,len(usr) - 2,calc_checksum(bytes(usr[:-2])))
+
+    hw = bytearray(package_hardware_configuration['size'])
+    struct.pack_into('<cc',hw,0,package_hardware_configuration['sync'],package_hardware_configuration['id'])
+    struct.pack_into('<H',hw,2,len(hw) // 2)
+    hw[4:18] = b'VEC 0000      '
+    struct.pack_into('<HH',hw,18,0,6000 if imu else 0) # Config, Frequency
+    hw[42:46] = b'3.42'
+    struct.pack_into('<H',hw,len(hw) - 2,calc_checksum(bytes(hw[:-2])))
+
+    head = bytearray(package_head_configuration['size'])
+    struct.pack_into('<cc',head,0,package_head_configuration['sync'],package_head_configuration['id'])
+    struct.pack_into('<H',head,2,len(head) // 2)
+    struct.pack_into('<HHH',head,4,0,6000,0) # Config, Frequency, Type
+    head[10:22] = b'VEC0000\x00\x00\x00\x00\x00'
+    struct.pack_into('<H',head,220,3) # Nbeams
+    struct.pack_into('<H',head,len(head) - 2,calc_checksum(bytes(head[:-2])))
+
+    return bytes(usr) + bytes(hw) + bytes(head)
+
+
+def corrupt(data, offsets, sizes, rng, garbage=0.0, truncate=0.0, checksum=0.0):
+    """ Corrupts the packages in data (uint8 array)
+
+    Args:
+       offsets, sizes: The packages in data
+       garbage: Fraction of packages preceded by random garbage bytes
+       truncate: Fraction of packages truncated
+       checksum: Fraction of packages with a bad checksum
+    """
+    npackages = len(offsets)
+    if(checksum > 0):
+        ind = rng.random(npackages) < checksum
+        data[offsets[ind] + sizes[ind] - 1] ^= 0xff
+
+    keep = None
+    if(truncate > 0):
+        ind = rng.random(npackages) < truncate
+        ncut = rng.integers(1,sizes[ind])
+        # Indices of the last ncut bytes of the packages
+        icut = np.repeat(offsets[ind] + sizes[ind] - ncut,ncut)
+        icut += np.arange(len(icut)) - np.repeat(np.cumsum(ncut) - ncut,ncut)
+        keep = np.ones(len(data),dtype=bool)
+        keep[icut] = False
+
+    if(garbage > 0):
+        ind = rng.random(npackages) < garbage
+        pos = offsets[ind]
+        ngarbage = rng.integers(1,64,len(pos))
+        if keep is not None: # Positions after truncation
+            ndeleted = np.concatenate(([0],np.cumsum(~keep)))
+            pos = pos - ndeleted[pos]
+            data = data[keep]
+            keep = None
+
+        garbage_data = rng.integers(0,256,ngarbage.sum(),dtype=np.uint8)
+        garbage_data[garbage_data == package_vector_velocity['sync'][0]] = 0 # No accidental packages
+        data = np.insert(data,np.repeat(pos,ngarbage),garbage_data)
+
+    if keep is not None:
+        data = data[keep]
+
+    return data
+
+
+def write_vec(fname, duration=3600, nbytes=None, samplingrate=16, samplesperburst=0, measinterval=None,
+              imu=False, start=datetime.datetime(2020,1,1), coordinate_system='XYZ',
+              garbage=0.0, truncate=0.0, checksum=0.0, seed=0, chunkseconds=3600):
+    """ Writes a synthetic Nortek Vector binary (.vec) file
+
+    Args:
+       duration: Length of the deployment in seconds
+       nbytes: Approximate file size, overrides duration if given
+       samplingrate: Sampling rate in Hz, 512 must be a multiple of it
+       samplesperburst: Samples per burst, 0 for continous sampling
+       measinterval: Seconds between the start of two bursts
+       imu: Add IMU packages
+       garbage, truncate, checksum: Fractions of corrupted packages, see corrupt()
+       seed: Seed of the random number generator
+       chunkseconds: Seconds of data generated at once
+    Return:
+       A dictionary with the number of bytes and packages written
+    """
+    if((samplingrate < 1) or (512 % samplingrate) != 0):
+        raise ValueError('Samplingrate must be a divisor of 512')
+
+    rng = np.random.default_rng(seed)
+    start64 = np.datetime64(start,'s')
+    if(samplesperburst > 0):
+        tburst = int(np.ceil(samplesperburst / samplingrate))
+        if(measinterval is None):
+            measinterval = 2 * tburst
+        if(measinterval < tburst):
+            raise ValueError('measinterval is shorter than a burst')
+        dtype_block = dtype_burst(samplingrate,samplesperburst,imu)
+        block_seconds = measinterval
+    else:
+        if(measinterval is None):
+            measinterval = 1
+        dtype_block = dtype_second(samplingrate,imu)
+        block_seconds = 1
+
+    config = create_config(samplingrate,samplesperburst,measinterval,imu,coordinate_system,start)
+    if(nbytes is not None):
+        duration = max(1,int((nbytes - len(config)) / dtype_block.itemsize)) * block_seconds
+
+    nblocks = max(1,int(duration // block_seconds))
+    nblocks_chunk = max(1,int(chunkseconds // block_seconds))
+    offsets, sizes, names = package_offsets(dtype_block)
+    logger.info('Writing {:d} blocks of {:d} bytes to {:s}'.format(nblocks,dtype_block.itemsize,fname))
+    bytes_written = 0
+    with open(fname,'wb') as f:
+        f.write(config)
+        bytes_written += len(config)
+        for b0 in range(0,nblocks,nblocks_chunk):
+            b1 = min(b0 + nblocks_chunk,nblocks)
+            iblock = np.arange(b0,b1)
+            blocks = np.zeros(len(iblock),dtype_block)
+            if(samplesperburst > 0):
+                tstart = iblock * measinterval # Burst start in seconds since start
+                header = np.zeros(len(iblock),dtype_vector_velocity_header)
+                header['sync'] = package_vector_velocity_header['sync'][0]
+                header['id'] = package_vector_velocity_header['id'][0]
+                header['size'] = dtype_vector_velocity_header.itemsize // 2
+                header['time'] = bcdtime(start64 + tstart.astype('timedelta64[s]'))
+                header['NRecords'] = samplesperburst
+                set_checksum(header)
+                blocks['header'] = header
+                nfull = samplesperburst // samplingrate
+                nrem = samplesperburst % samplingrate
+                if(nfull > 0):
+                    isec = np.arange(nfull)
+                    burstsample = isec[:,None] * samplingrate + np.arange(samplingrate)
+                    tsys = start64 + (tstart[:,None] + isec).astype('timedelta64[s]')
+                    tsample = tstart[:,None,None] + burstsample / samplingrate
+                    count = iblock[:,None,None] * samplesperburst + burstsample
+                    blocks['seconds'] = create_seconds(tsys,tsample,count,burstsample,samplingrate,imu,rng)
+                if(nrem > 0):
+                    burstsample = nfull * samplingrate + np.arange(nrem)
+                    tsys = start64 + (tstart + nfull).astype('timedelta64[s]')
+                    tsample = tstart[:,None] + burstsample / samplingrate
+                    count = iblock[:,None] * samplesperburst + burstsample
+                    blocks['last'] = create_seconds(tsys,tsample,count,burstsample,samplingrate,imu,rng)
+            else:
+                tsys = start64 + iblock.astype('timedelta64[s]')
+                burstsample = np.arange(samplingrate)
+                tsample = iblock[:,None] + burstsample / samplingrate
+                count = iblock[:,None] * samplingrate + burstsample
+                blocks[:] = create_seconds(tsys,tsample,count,burstsample,samplingrate,imu,rng)
+
+            data = blocks.view(np.uint8)
+            if((garbage > 0) or (truncate > 0) or (checksum > 0)):
+                offsets_chunk = (np.arange(len(iblock)) * dtype_block.itemsize)[:,None] + offsets
+                sizes_chunk = np.broadcast_to(sizes,offsets_chunk.shape)
+                data = corrupt(data,offsets_chunk.ravel(),sizes_chunk.ravel(),rng,garbage,truncate,checksum)
+
+            data.tofile(f)
+            bytes_written += len(data)
+
+    npackages = {}
+    for name in names:
+        npackages[name] = npackages.get(name,0) + nblocks
+
+    npackages['user config'] = 1
+    npackages['hardware config'] = 1
+    npackages['head config'] = 1
+    return {'fname':fname,'nbytes':bytes_written,'packages':npackages,'duration':nblocks * block_seconds,
+            'samplingrate':samplingrate,'samplesperburst':samplesperburst,'imu':imu}
+
+
+def synth():
+    """ Command line interface to write_vec
+    """
+    parser = argparse.ArgumentParser(description='Writes a synthetic Nortek Vector binary (.vec) file')
+    parser.add_argument('--version', action='version', version='%(prog)s ' + version)
+    parser.add_argument('filename',help='Name of the .vec file')
+    parser.add_argument('--duration',type=float,default=3600,help='Length of the deployment in seconds')
+    parser.add_argument('--nbytes',help='Approximate file size in bytes, overrides --duration')
+    parser.add_argument('--samplingrate',type=int,default=16,help='Sampling rate in Hz')
+    parser.add_argument('--samplesperburst',type=int,default=0,help='Samples per burst, 0 for continous sampling')
+    parser.add_argument('--measinterval',type=int,help='Seconds between the start of two bursts')
+    parser.add_argument('--imu',action='store_true',help='Add IMU packages')
+    parser.add_argument('--garbage',type=float,default=0.0,help='Fraction of packages preceded by garbage bytes')
+    parser.add_argument('--truncate',type=float,default=0.0,help='Fraction of truncated packages')
+    parser.add_argument('--checksum',type=float,default=0.0,help='Fraction of packages with a bad checksum')
+    parser.add_argument('--seed',type=int,default=0,help='Seed of the random number generator')
+    args = parser.parse_args()
+    nbytes = None
+    if(args.nbytes is not None):
+        nbytes = int(float(args.nbytes))
+
+    info = write_vec(args.filename,duration=args.duration,nbytes=nbytes,samplingrate=args.samplingrate,
+                     samplesperburst=args.samplesperburst,measinterval=args.measinterval,imu=args.imu,
+                     garbage=args.garbage,truncate=args.truncate,checksum=args.checksum,seed=args.seed)
+    logger.info('Wrote {:d} bytes'.format(info['nbytes']))
@@ -0,0 +1,109 @@
+#
+# Benchmarks of the loaders of the ASCII exports on synthetic files
+#
+# Usage:
+#   python benchmark_ascii.py --sizes 10e6,100e6
+#
+import argparse
+import concurrent.futures
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import pynortek.pynortek_ascii
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+logger = logging.getLogger('pynortek')
+
+# The synthetic files, suffix:[number of columns, format, dtype of the compact memory profile]
+filetypes = {'sen':[17,'%.3f',np.float64],
+             'v1':[30,'%8.3f',np.float32],
+             'a1':[30,'%d',np.uint8]}
+
+# The loaders, np.loadtxt (float64 converted afterwards) is the baseline
+loaders = ['np.loadtxt','loadtxt_ascii','loadtxt_blocks']
+
+
+def datafile(datadir, nbytes, suffix):
+    """ Returns the name of a synthetic ASCII file, creates it if not existing
+    """
+    fname = os.path.join(datadir,'synth_{:d}MB.{:s}'.format(int(nbytes/1e6),suffix))
+    if(os.path.isfile(fname) == False):
+        ncols, fmt, dtype = filetypes[suffix]
+        rng = np.random.default_rng(0)
+        with open(fname,'w') as f:
+            while(f.tell() < nbytes):
+                if(np.issubdtype(dtype,np.integer)):
+                    data = rng.integers(0,256,(10000,ncols))
+                else:
+                    data = rng.normal(0,1,(10000,ncols))
+                np.savetxt(f,data,fmt=fmt)
+
+    return fname
+
+
+def run_case(case):
+    """ Runs one benchmark case, called in an own process to get the peak RSS of the case
+    """
+    logger.setLevel(logging.WARNING)
+    fname, loader, dtype = case['fname'], case['loader'], np.dtype(case['dtype'])
+    t0 = time.perf_counter()
+    if(loader == 'np.loadtxt'):
+        data = np.loadtxt(fname).astype(dtype)
+    elif(loader == 'loadtxt_ascii'):
+        data = pynortek.pynortek_ascii.loadtxt_ascii(fname,dtype=dtype)
+    else:
+        data = np.concatenate([b.astype(dtype) for b in pynortek.pynortek_ascii.loadtxt_blocks(fname)])
+    ttotal = time.perf_counter() - t0
+
+    if resource is not None:
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if(sys.platform == 'darwin'): # bytes on macOS, kilobytes on Linux
+            maxrss = maxrss / 1024
+        maxrss = maxrss / 1024 # MB
+    else:
+        maxrss = np.nan
+
+    nbytes = os.path.getsize(fname)
+    result = dict(case)
+    result.update({'time':ttotal,'nbytes':nbytes,'nrows':len(data),
+                   'MB/s':nbytes / 1e6 / ttotal,'rows/s':len(data) / ttotal,'peak RSS MB':maxrss})
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks of the loaders of the pynortek ASCII exports')
+    parser.add_argument('--sizes',default='10e6',help='Comma separated file sizes in bytes, e.g. 10e6,100e6')
+    parser.add_argument('--filetypes',default=','.join(filetypes.keys()),help='Comma separated file types')
+    parser.add_argument('--datadir',default=os.path.join(tempfile.gettempdir(),'pynortek_benchmark'),help='Directory of the synthetic data files')
+    args = parser.parse_args()
+
+    os.makedirs(args.datadir,exist_ok=True)
+    ctx = multiprocessing.get_context('spawn')
+    print('{:40s} {:>10s} {:>12s} {:>12s} {:>10s}'.format('case','MB/s','rows/s','peak RSS MB','np.loadtxt'))
+    for nbytes in [float(s) for s in args.sizes.split(',')]:
+        for suffix in args.filetypes.split(','):
+            fname = datafile(args.datadir,nbytes,suffix)
+            dtype = np.dtype(filetypes[suffix][2]).name
+            baseline = None
+            for loader in loaders:
+                case = {'fname':fname,'loader':loader,'dtype':dtype}
+                with concurrent.futures.ProcessPoolExecutor(max_workers=1,mp_context=ctx) as pool:
+                    result = pool.submit(run_case,case).result()
+
+                if(baseline is None):
+                    baseline = result
+                key = '{:s}/{:s}/{:.0f}/{:s}'.format(loader,suffix,nbytes,dtype)
+                print('{:40s} {:10.3f} {:12.1f} {:12.1f} {:>10s}'.format(key,result['MB/s'],result['rows/s'],result['peak RSS MB'],
+                                                                         '{:.2f}x'.format(result['MB/s'] / baseline['MB/s'])))
+
+
+if __name__ == '__main__':
+    main()
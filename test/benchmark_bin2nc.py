@@ -0,0 +1,231 @@
+#
+# Benchmarks of the binary conversion pipeline on synthetic .vec files
+#
+# Usage:
+#   python benchmark_bin2nc.py --sizes 10e6,100e6,1e9,10e9 --save baseline.json
+#   python benchmark_bin2nc.py --baseline baseline.json
+#
+import argparse
+import concurrent.futures
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+import numpy as np
+import pynortek
+import pynortek.synth
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+logger = logging.getLogger('pynortek')
+
+# The sampling modes of the synthetic data
+modes = {'continous':{'samplesperburst':0},
+         'burst':{'samplesperburst':1024,'measinterval':120}}
+
+# The stages and the modes they are run with
+stages = {'calc_checksum':['continous','burst'],
+          'convert_bin':['continous','burst'],
+          'add_timestamp_sys':['continous'],
+          'add_timestamp':['continous'],
+          'add_timestamp_burst':['burst'],
+          'add_packages_to_netcdf':['continous','burst'],
+          'bin2nc':['continous','burst']}
+
+
+def datafile(datadir, nbytes, mode, imu, samplingrate):
+    """ Returns the name of a synthetic .vec file, creates it if not existing
+    """
+    fname = 'synth_{:d}MB_{:s}_{:d}Hz{:s}.vec'.format(int(nbytes/1e6),mode,samplingrate,'_imu' if imu else '')
+    fname = os.path.join(datadir,fname)
+    if(os.path.isfile(fname) == False or os.path.isfile(fname + '.json') == False):
+        info = pynortek.synth.write_vec(fname,nbytes=nbytes,samplingrate=samplingrate,imu=imu,**modes[mode])
+        with open(fname + '.json','w') as f:
+            json.dump(info,f)
+
+    return fname
+
+
+def read_chunks(fname, chunksize):
+    """ Reads and converts fname chunk wise as bin2nc does, yields the
+    data and the converted packages of each chunk
+    """
+    state = {'burst_num':0,'burst_sample':0,'burstIMU_sample':0,'burst_startdate':datetime.datetime(1,1,1)}
+    data_rest = b''
+    with open(fname,'rb') as f:
+        while True:
+            data = f.read(chunksize)
+            if(len(data) == 0):
+                break
+            data = data_rest + data
+            t0 = time.perf_counter()
+            package_data = pynortek.convert_bin(data,statistics=True,**state)
+            dt = time.perf_counter() - t0
+            for k in state.keys():
+                state[k] = package_data[k]
+
+            data_rest = package_data['data_rest']
+            yield data, package_data, dt
+
+
+def add_timestamps(packages, samplingrate, mode, stage, timeinfo):
+    """ Calls the timestamp stage, timeinfo holds the state of add_timestamp_sys
+    """
+    if(stage == 'add_timestamp_burst'):
+        return pynortek.add_timestamp_burst(packages,samplingrate)
+    elif(stage == 'add_timestamp'):
+        return pynortek.add_timestamp(packages,num_dates=2)
+    else:
+        ret = pynortek.add_timestamp_sys(packages,samplingrate,*timeinfo[1:],date_sys=timeinfo[0])
+        timeinfo[:] = ret['timeinfo']
+        return ret['packages']
+
+
+def run_case(case):
+    """ Runs one benchmark case, called in an own process to get the peak RSS of the case
+    """
+    logger.setLevel(logging.WARNING)
+    fname, stage, mode, chunksize = case['fname'], case['stage'], case['mode'], case['chunksize']
+    with open(fname + '.json') as f:
+        info = json.load(f)
+
+    samplingrate = info['samplingrate']
+    ttotal = 0
+    nbytes = 0
+    npackets = 0
+    tmpdir = tempfile.mkdtemp()
+    fname_nc = os.path.join(tmpdir,'benchmark.nc')
+    if(stage == 'bin2nc'):
+        t0 = time.perf_counter()
+        pynortek.bin2nc(fname,fname_nc,chunksize=chunksize,logfile=False)
+        ttotal = time.perf_counter() - t0
+        nbytes = info['nbytes']
+        npackets = sum(info['packages'].values())
+    else:
+        if(stage == 'add_packages_to_netcdf'):
+            dataset = pynortek.create_netcdf(fname_nc,imu=info['imu'])
+
+        timeinfo = [datetime.datetime(1,1,1),0,0]
+        for data, package_data, dt in read_chunks(fname,chunksize):
+            packages = package_data['packages']
+            nbytes += package_data['ilast']
+            if(stage == 'convert_bin'):
+                ttotal += dt
+                npackets += len(packages)
+            elif(stage == 'calc_checksum'):
+                t0 = time.perf_counter()
+                for p in package_data['statistics']['packages']:
+                    pynortek.calc_checksum(data[p[0]:p[1]-2])
+                ttotal += time.perf_counter() - t0
+                npackets += len(package_data['statistics']['packages'])
+            elif(stage.startswith('add_timestamp')):
+                t0 = time.perf_counter()
+                add_timestamps(packages,samplingrate,mode,stage,timeinfo)
+                ttotal += time.perf_counter() - t0
+                npackets += len(packages)
+            elif(stage == 'add_packages_to_netcdf'):
+                tstage = 'add_timestamp_burst' if mode == 'burst' else 'add_timestamp_sys'
+                packages = add_timestamps(packages,samplingrate,mode,tstage,timeinfo)
+                t0 = time.perf_counter()
+                pynortek.add_packages_to_netcdf(dataset,packages)
+                ttotal += time.perf_counter() - t0
+                npackets += len(packages)
+
+        if(stage == 'add_packages_to_netcdf'):
+            dataset.close()
+
+    if os.path.isfile(fname_nc):
+        os.remove(fname_nc)
+    os.rmdir(tmpdir)
+
+    if resource is not None:
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if(sys.platform == 'darwin'): # bytes on macOS, kilobytes on Linux
+            maxrss = maxrss / 1024
+        maxrss = maxrss / 1024 # MB
+    else:
+        maxrss = np.nan
+
+    result = dict(case)
+    result.update({'time':ttotal,'nbytes':nbytes,'npackets':npackets,
+                   'MB/s':nbytes / 1e6 / ttotal,'packets/s':npackets / ttotal,'peak RSS MB':maxrss})
+    return result
+
+
+def case_key(case):
+    return '{stage}/{mode}/{imustr}/{nbytes:.0f}'.format(imustr='imu' if case['imu'] else 'noimu',**case)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks of the pynortek binary conversion pipeline')
+    parser.add_argument('--sizes',default='10e6',help='Comma separated file sizes in bytes, e.g. 10e6,100e6,1e9,10e9')
+    parser.add_argument('--stages',default=','.join(stages.keys()),help='Comma separated stages')
+    parser.add_argument('--modes',default='continous,burst',help='Comma separated sampling modes')
+    parser.add_argument('--imu',default='both',choices=['both','yes','no'],help='With and/or without IMU data')
+    parser.add_argument('--samplingrate',type=int,default=16,help='Sampling rate of the synthetic data in Hz')
+    parser.add_argument('--chunksize',type=int,default=4096*2000,help='Chunksize of the conversion')
+    parser.add_argument('--datadir',default=os.path.join(tempfile.gettempdir(),'pynortek_benchmark'),help='Directory of the synthetic data files')
+    parser.add_argument('--save',help='Save the results as json file (the baseline)')
+    parser.add_argument('--baseline',help='Compare the results with a baseline json file')
+    parser.add_argument('--tolerance',type=float,default=0.2,help='Relative slow down regarded as regression')
+    args = parser.parse_args()
+
+    os.makedirs(args.datadir,exist_ok=True)
+    imus = {'both':[False,True],'yes':[True],'no':[False]}[args.imu]
+    sizes = [float(s) for s in args.sizes.split(',')]
+    cases = []
+    for nbytes in sizes:
+        for mode in args.modes.split(','):
+            for imu in imus:
+                fname = datafile(args.datadir,nbytes,mode,imu,args.samplingrate)
+                for stage in args.stages.split(','):
+                    if(mode in stages[stage]):
+                        cases.append({'stage':stage,'mode':mode,'imu':imu,'nbytes':nbytes,
+                                      'fname':fname,'chunksize':args.chunksize})
+
+    baseline = None
+    if(args.baseline is not None):
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+
+    results = {}
+    regressions = []
+    ctx = multiprocessing.get_context('spawn')
+    print('{:60s} {:>10s} {:>12s} {:>12s} {:>10s}'.format('case','MB/s','packets/s','peak RSS MB','baseline'))
+    for case in cases:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=1,mp_context=ctx) as pool:
+            result = pool.submit(run_case,case).result()
+
+        key = case_key(case)
+        results[key] = result
+        bstr = ''
+        if((baseline is not None) and (key in baseline.keys())):
+            ratio = result['MB/s'] / baseline[key]['MB/s']
+            bstr = '{:.2f}x'.format(ratio)
+            if(ratio < (1 - args.tolerance)):
+                bstr += ' REGRESSION'
+                regressions.append(key)
+
+        print('{:60s} {:10.3f} {:12.1f} {:12.1f} {:>10s}'.format(key,result['MB/s'],result['packets/s'],result['peak RSS MB'],bstr))
+
+    if(args.save is not None):
+        with open(args.save,'w') as f:
+            json.dump({'date':str(datetime.datetime.now()),'version':pynortek.__version__,
+                       'host':platform.node(),'python':platform.python_version(),
+                       'results':results},f,indent=1)
+
+    if(len(regressions) > 0):
+        print('Regressions found in: ' + ', '.join(regressions))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+#
+# Regression checks of bin2nc on synthetic .vec files, the converted
+# subsets are compared with the full conversion
+#
+# Usage:
+#   python check_bin2nc.py
+#   python check_bin2nc.py --checks selection_without_vel --datadir /tmp/checks
+#
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import numpy as np
+import netCDF4
+import pynortek
+import pynortek.synth
+
+logger = logging.getLogger('pynortek')
+
+# The synthetic files of the checks, name:arguments of write_vec
+datafiles = {'continous':{'duration':600,'samplingrate':16},
+             'burst':{'duration':3600,'samplingrate':16,'samplesperburst':256,'measinterval':300,'imu':True}}
+
+
+def datafile(datadir, name):
+    """ Returns the name of a synthetic .vec file, creates it if not existing
+    """
+    fname = os.path.join(datadir,'check_{:s}.vec'.format(name))
+    if(os.path.isfile(fname) == False):
+        pynortek.synth.write_vec(fname,**datafiles[name])
+
+    return fname
+
+
+def convert(fname, fname_nc, **kwargs):
+    """ Converts fname with bin2nc and returns the groups as dictionaries of arrays
+    """
+    if(os.path.exists(fname_nc)):
+        os.remove(fname_nc)
+    pynortek.bin2nc(fname,fname_nc,logfile=False,**kwargs)
+    data = {}
+    with netCDF4.Dataset(fname_nc) as nc:
+        for g in ['sys','vel','imu']:
+            if(g in nc.groups.keys()):
+                data[g] = {k:np.ma.filled(v[:].astype(float),np.nan) for k,v in nc.groups[g].variables.items()}
+
+    return data
+
+
+def compare(name, data, data_full, group, variables=None):
+    """ Compares the variables of a group with the full conversion, returns the failures
+    """
+    if(group not in data.keys()):
+        return ['{:s}: group {:s} missing'.format(name,group)]
+    if(variables is None):
+        variables = data[group].keys()
+    failures = []
+    for k in variables:
+        if(not np.array_equal(data[group][k],data_full[group][k],equal_nan=True)):
+            failures.append('{:s}: {:s}/{:s} has {:d} rows, full conversion {:d}'.format(name,group,k,
+                            len(data[group][k]),len(data_full[group][k])))
+
+    return failures
+
+
+def check_selection_without_vel(datadir):
+    """ The sys and imu groups are written if no velocity packages are
+    decoded (groups=['sys'], variables=['Hdg'], groups=['imu'])
+    """
+    failures = []
+    for name in datafiles.keys():
+        fname = datafile(datadir,name)
+        data_full = convert(fname,os.path.join(datadir,'full.nc'))
+        data = convert(fname,os.path.join(datadir,'sys.nc'),groups=['sys'])
+        failures += compare(name + ' groups=sys',data,data_full,'sys')
+        data = convert(fname,os.path.join(datadir,'hdg.nc'),variables=['Hdg'])
+        failures += compare(name + ' variables=Hdg',data,data_full,'sys',['time','Hdg'])
+        if('imu' in data_full.keys()):
+            data = convert(fname,os.path.join(datadir,'imu.nc'),groups=['imu'])
+            failures += compare(name + ' groups=imu',data,data_full,'imu')
+
+    return failures
+
+
+def check_overview_level(datadir):
+    """ read_overview chooses the finest level with at most npixels windows in the requested time span
+    """
+    failures = []
+    fname = datafile(datadir,'continous')
+    fname_nc = os.path.join(datadir,'overview.nc')
+    data = convert(fname,fname_nc,overview=True)
+    t = data['vel']['time']
+    # time span in seconds, npixels
+    for span, npixels in [(30,1000),(300,100),(300,2),(400,1)]:
+        tstart = t[0] + 120.3
+        tend = tstart + span
+        nsamples = np.sum((t >= tstart) & (t <= tend))
+        level = [l for l in [1] + pynortek.overview_levels if nsamples / l <= npixels][0]
+        ov = pynortek.read_overview(fname_nc,'vel',['v1'],tstart,tend,npixels)
+        if((ov['level'] != level) or (len(ov['time']) == 0) or (len(ov['time']) > npixels + 1)):
+            failures.append('span {:d} s, {:d} pixels: level {:d} with {:d} windows, expected level {:d}'.format(span,npixels,
+                            ov['level'],len(ov['time']),level))
+
+    return failures
+
+
+def check_burst_decimate(datadir):
+    """ The decimated burst layout holds the decimated samples of the flat layout
+    """
+    failures = []
+    decimate = 4
+    fname = datafile(datadir,'burst')
+    data_full = convert(fname,os.path.join(datadir,'full.nc'))
+    data = convert(fname,os.path.join(datadir,'burst.nc'),layout='burst',decimate=decimate)
+    for g in ['vel','imu']:
+        flat = data_full[g]
+        ind = (flat['burstsample'] % decimate) == 0
+        burst = data[g]
+        nsamples = burst['nsamples'].astype(int)
+        valid = np.arange(len(burst['sample_time']))[np.newaxis,:] < nsamples[:,np.newaxis]
+        t = (burst['time'][:,np.newaxis] + burst['sample_time'][np.newaxis,:])[valid]
+        if(not np.allclose(t,flat['time'][ind])):
+            failures.append('{:s}: time differs from the decimated flat layout'.format(g))
+        for k in burst.keys():
+            if((np.ndim(burst[k]) == 2) and (not np.array_equal(burst[k][valid],flat[k][ind],equal_nan=True))):
+                failures.append('{:s}/{:s} differs from the decimated flat layout'.format(g,k))
+        if(np.any(~np.isnan(burst['v1' if g == 'vel' else 'pitch'][~valid]))):
+            failures.append('{:s}: values behind nsamples'.format(g))
+
+    return failures
+
+
+# The checks, name:function returning a list of failures
+checks = {'selection_without_vel':check_selection_without_vel,'overview_level':check_overview_level,
+          'burst_decimate':check_burst_decimate}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Regression checks of bin2nc on synthetic files')
+    parser.add_argument('--checks', help='Comma separated list of checks (default all)', default=','.join(checks.keys()))
+    parser.add_argument('--datadir', help='Directory of the synthetic files (default temporary directory)', default=None)
+    args = parser.parse_args()
+    logger.setLevel(logging.WARNING)
+    datadir = tempfile.mkdtemp() if args.datadir is None else args.datadir
+    os.makedirs(datadir,exist_ok=True)
+    nfailed = 0
+    for c in args.checks.split(','):
+        failures = checks[c](datadir)
+        print('{:s}: {:s}'.format(c,'ok' if len(failures) == 0 else 'FAILED'))
+        for fail in failures:
+            print('   ' + fail)
+        nfailed += len(failures)
+
+    sys.exit(1 if nfailed > 0 else 0)
+
+
+if __name__ == '__main__':
+    main()